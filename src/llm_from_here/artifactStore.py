@@ -0,0 +1,211 @@
+import os
+import json
+import shutil
+import hashlib
+import uuid
+import tempfile
+import logging
+import threading
+import appdirs
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class ArtifactStore:
+    """
+    A store of generated files shared between runs, addressed by a hash of what produced them.
+
+    Files are keyed by the provider and the inputs that determine their content (e.g. the
+    TTS engine, voice and text), and linked into a run's output folder, so re-running a show
+    reuses every unchanged asset without calling the provider again or copying the file.
+    Files are hardlinked where the file system allows it, and copied otherwise.
+
+    A run's linked files are the stored files, so they must never be rewritten in place,
+    which would change the stored file for every later run. Stored files are made read-only,
+    fetch removes the file it's about to produce, and files are exported with
+    replace_on_write, which replaces a file instead of writing into it.
+
+    With max_bytes set, the least recently used files are evicted when the store grows
+    beyond it. The store's size is scanned once, then tracked as files are added, and the
+    store is only scanned again to evict. Hits, misses and evictions are counted in stats.
+    The store can be used by several threads at once.
+    """
+
+    def __init__(self, root=None, enabled=True, max_bytes=None):
+        """
+        Args:
+        root (str, optional): The directory to store files in; defaults to LLMFH_ARTIFACT_DIR,
+            or an artifacts directory in the user cache directory.
+        enabled (bool, optional): If False, fetch always produces the file.
+        max_bytes (int, optional): The maximum total size of the stored files.
+        """
+        self.root = root or default_root()
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.stats = Counter()
+        # guards the tracked size and the stats
+        self._lock = threading.Lock()
+        self._size = self._scan_size() if max_bytes is not None else None
+
+    @staticmethod
+    def key(provider, *args, **params):
+        """Return the key of the file a provider produces from the given inputs."""
+        data = json.dumps([provider, args, params], sort_keys=True, default=str)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def path(self, key, extension='.wav'):
+        return os.path.join(self.root, key[:2], key + extension)
+
+    @staticmethod
+    def link(source, destination):
+        """Hardlink source to destination, replacing it, or copy it if it can't be linked."""
+        directory = os.path.dirname(os.path.abspath(destination))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        os.close(fd)
+        os.remove(temp_path)
+        try:
+            try:
+                os.link(source, temp_path)
+            except OSError:
+                shutil.copyfile(source, temp_path)
+            os.replace(temp_path, destination)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def get(self, key, output_file):
+        """Link the stored file for key to output_file, returning False if there isn't one."""
+        stored = self.path(key, os.path.splitext(output_file)[1])
+        if not self.enabled:
+            return False
+        if not os.path.exists(stored):
+            with self._lock:
+                self.stats['misses'] += 1
+            return False
+        with self._lock:
+            self.stats['hits'] += 1
+        # the modification time orders files for eviction
+        os.utime(stored)
+        self.link(stored, output_file)
+        return True
+
+    def put(self, key, file_path):
+        """Add a file to the store under key."""
+        if self.enabled and os.path.getsize(file_path) > 0:
+            stored = self.path(key, os.path.splitext(file_path)[1])
+            with self._lock:
+                replaced_size = os.path.getsize(stored) if os.path.exists(stored) else 0
+                self.link(file_path, stored)
+                os.chmod(stored, 0o444)
+                if self.max_bytes is not None:
+                    if self._size is None:
+                        self._size = self._scan_size()
+                    else:
+                        self._size += os.path.getsize(stored) - replaced_size
+                    if self._size > self.max_bytes:
+                        self._evict()
+
+    def _files(self):
+        """Return the modification time, size and path of each stored file."""
+        files = []
+        for directory, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                if not file_name.endswith('.tmp'):
+                    path = os.path.join(directory, file_name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        # removed by another process
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._files())
+
+    def evict(self):
+        """Remove the least recently used files until the store is within max_bytes."""
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        files = self._files()
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            logger.info(f"Evicting stored artifact {path}")
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.stats['evictions'] += 1
+        # the scan also picks up files other processes added or removed
+        self._size = total
+
+    def log_stats(self):
+        with self._lock:
+            stats = Counter(self.stats)
+        logger.info(
+            f"Artifact store {self.root}: {stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['evictions']} evictions")
+
+    def fetch(self, key, output_file, produce):
+        """
+        Link the stored file for key to output_file. If there isn't one, call produce(output_file)
+        to write it and store the result.
+
+        Returns:
+        The value returned by produce, or None if the file was already stored.
+        """
+        if self.get(key, output_file):
+            logger.info(f"Reused stored artifact {key} for {output_file}")
+            return None
+        # the file may be linked to another stored file, which mustn't be written into
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        result = produce(output_file)
+        if os.path.exists(output_file):
+            self.put(key, output_file)
+        return result
+
+
+@contextmanager
+def replace_on_write(path):
+    """
+    Yield a temporary path next to path to write a file to, which then replaces path, so
+    that a file linked to a stored artifact is replaced rather than rewritten in place.
+    """
+    # the file is created by the writer, with the permissions it would have had
+    temp_path = f"{os.path.abspath(path)}.{uuid.uuid4().hex}.tmp"
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def default_root():
+    return os.getenv('LLMFH_ARTIFACT_DIR') or os.path.join(
+        appdirs.user_cache_dir(appname='llm_from_here'), 'artifacts')
+
+
+_artifact_stores = {}
+
+
+def get_artifact_store(namespace=None, max_bytes=None):
+    """
+    Return the shared artifact store, or the one for a namespace, which is kept in its own
+    directory so that it can be bounded separately. Stores are disabled when
+    LLMFH_ARTIFACT_STORE is 0.
+    """
+    if namespace not in _artifact_stores:
+        root = os.path.join(default_root(), namespace) if namespace else default_root()
+        _artifact_stores[namespace] = ArtifactStore(
+            root, enabled=os.getenv('LLMFH_ARTIFACT_STORE', '1') != '0', max_bytes=max_bytes)
+    return _artifact_stores[namespace]
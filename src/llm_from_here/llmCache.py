@@ -0,0 +1,125 @@
+import os
+import time
+import json
+import hashlib
+import logging
+import threading
+import appdirs
+from openai.types.chat import ChatCompletion
+
+from llm_from_here.pluginCache import PluginCache
+
+logger = logging.getLogger(__name__)
+
+
+class LLMCacheMiss(KeyError):
+    """Raised in replay mode when a completion isn't in the cache."""
+
+
+class LLMCache:
+    """
+    A persistent cache of chat completions, keyed by the model, the full list of messages and
+    the sampling parameters of a request, so that sending the same conversation again returns
+    the stored completion without calling the API.
+
+    In replay mode, a request that isn't cached raises LLMCacheMiss instead of calling the
+    API, so a show can be re-run entirely offline. Entries are bounded by size and age, as in
+    PluginCache.
+    """
+
+    def __init__(self, file_path, replay=False, max_bytes=None, max_age_days=None):
+        """
+        Args:
+        file_path (str): The SQLite file to store the cache in.
+        replay (bool, optional): Raise LLMCacheMiss for requests that aren't cached.
+        max_bytes (int, optional): The maximum total size of the cached completions.
+        max_age_days (float, optional): The maximum age of a cached completion.
+        """
+        self.file_path = file_path
+        self.replay = replay
+        self.max_age = max_age_days * 24 * 60 * 60 if max_age_days is not None else None
+        self.cache = PluginCache(file_path, autocommit=True)
+        self.cache.configure(max_bytes=max_bytes, max_age_days=max_age_days)
+        # chat apps in different threads share the cache
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model, messages, **params):
+        """Return the key of a request for a completion."""
+        data = json.dumps([model, messages, params], sort_keys=True, default=str)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    @property
+    def stats(self):
+        return self.cache.stats
+
+    def get(self, key):
+        """Return the completion cached for key, or None if there isn't one that's fresh."""
+        with self._lock:
+            data = self.cache.get(key)
+            created = self.cache.created(key) if data is not None else None
+            if self.max_age is not None and created is not None and time.time() - created > self.max_age:
+                # PluginCache only evicts expired entries on writes
+                del self.cache[key]
+                self.stats['hits'] -= 1
+                self.stats['misses'] += 1
+                data = None
+        if data is None:
+            if self.replay:
+                raise LLMCacheMiss(f"No cached completion for request {key} in replay mode")
+            return None
+        return ChatCompletion.model_validate(data)
+
+    def put(self, key, response):
+        """Cache a completion under key."""
+        with self._lock:
+            self.cache.set(key, response.model_dump(mode="json"), plugin=response.model)
+
+    def delete(self, key):
+        """Remove the completion cached for key, e.g. because it was rejected."""
+        with self._lock:
+            if key in self.cache:
+                del self.cache[key]
+
+    def log_stats(self):
+        logger.info(
+            f"LLM cache: {self.stats['hits']} hits, {self.stats['misses']} misses, "
+            f"{self.stats['evictions']} evictions, {len(self.cache)} completions ({self.cache.size()} bytes)")
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def llm_cache_mode():
+    """Return the LLM cache mode set by LLMFH_LLM_CACHE: off (the default), on or replay."""
+    mode = os.getenv("LLMFH_LLM_CACHE", "off").lower()
+    return {"0": "off", "false": "off", "1": "on", "true": "on"}.get(mode, mode)
+
+
+def get_llm_cache():
+    """
+    Return the shared LLM cache, or None if it's off. It's configured by LLMFH_LLM_CACHE,
+    LLMFH_LLM_CACHE_FILE, LLMFH_LLM_CACHE_MAX_BYTES and LLMFH_LLM_CACHE_MAX_AGE_DAYS.
+    """
+    global _llm_cache
+    mode = llm_cache_mode()
+    if mode == "off":
+        return None
+    if mode not in ("on", "replay"):
+        raise ValueError(f"LLMFH_LLM_CACHE must be off, on or replay, not {mode}")
+
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            file_path = os.getenv("LLMFH_LLM_CACHE_FILE") or os.path.join(
+                appdirs.user_cache_dir(appname="llm_from_here"), "llm_cache.sqlite")
+            os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+            max_bytes = os.getenv("LLMFH_LLM_CACHE_MAX_BYTES")
+            max_age_days = os.getenv("LLMFH_LLM_CACHE_MAX_AGE_DAYS")
+            _llm_cache = LLMCache(
+                file_path,
+                replay=mode == "replay",
+                max_bytes=int(max_bytes) if max_bytes else None,
+                max_age_days=float(max_age_days) if max_age_days else None,
+            )
+        return _llm_cache
@@ -0,0 +1,276 @@
+import os
+import pickle
+import sqlite3
+import time
+import logging
+from collections import Counter
+from sqlitedict import SqliteDict, PICKLE_PROTOCOL
+
+from llm_from_here.pickleDict import PickleDict
+
+logger = logging.getLogger(__name__)
+
+
+class PluginCache:
+    """
+    A persistent mapping of plugin entry hashes to plugin results, stored in SQLite.
+
+    Unlike PickleDict, entries are read and written one at a time: opening the cache
+    doesn't load it, reading an entry only unpickles that entry, and each write is
+    committed in its own transaction, so a crash never leaves a partially written cache.
+
+    The cache can be bounded by configure(): entries older than a maximum age are dropped,
+    and the least recently hit entries are evicted when the cache, or a plugin's entries,
+    grow beyond a maximum size. The total sizes are tracked as entries are written, and the
+    metadata is only read again to evict. Hits, misses and evictions are counted in stats.
+    """
+
+    def __init__(self, file_path, autocommit=False, legacy_file_path=None):
+        """
+        Args:
+        file_path (str): The SQLite file to store the cache in.
+        autocommit (bool, optional): Commit after every write, rather than on commit().
+        legacy_file_path (str, optional): A PickleDict cache file whose entries are migrated
+            into this cache, and which is then removed.
+        """
+        self.file_path = file_path
+        self.autocommit = autocommit
+        # values are pickled before they're stored so that their size is known, with the
+        # same encoding sqlitedict uses, so they're decoded as usual
+        self.db = SqliteDict(file_path, tablename='plugin_cache', journal_mode='WAL',
+                             encode=sqlite3.Binary)
+        # the plugin, size in bytes, creation time and last hit time of each entry, kept in
+        # a separate file so that writing it never waits on an uncommitted cache write
+        self.meta_db = SqliteDict(f"{os.path.splitext(file_path)[0]}.meta{os.path.splitext(file_path)[1]}",
+                                  tablename='plugin_cache_meta', journal_mode='WAL')
+        self.meta = dict(self.meta_db.items())
+        # the total size of the entries, and of each plugin's entries
+        self._size = 0
+        self._plugin_sizes = Counter()
+        # keys whose last hit time hasn't been written yet
+        self._hits = set()
+        keys = set(self.db.keys())
+        for key in [key for key in self.meta if key not in keys]:
+            del self.meta[key]
+            del self.meta_db[key]
+        for key in keys:
+            if key not in self.meta:
+                self._set_meta(key, None, len(self._encode(self.db[key])))
+        self.meta_db.commit()
+        self._count_sizes()
+
+        self.max_bytes = None
+        self.max_age = None
+        self.plugin_max_bytes = {}
+        self.stats = Counter()
+
+        if legacy_file_path and os.path.exists(legacy_file_path):
+            self.migrate(legacy_file_path)
+
+    @staticmethod
+    def _encode(value):
+        return pickle.dumps(value, protocol=PICKLE_PROTOCOL)
+
+    def _set_meta(self, key, plugin, size):
+        self._pop_meta(key)
+        now = time.time()
+        self.meta[key] = {'plugin': plugin, 'size': size, 'created': now, 'last_hit': now}
+        self.meta_db[key] = self.meta[key]
+        self._size += size
+        self._plugin_sizes[plugin] += size
+
+    def _pop_meta(self, key):
+        """Remove the metadata of key from the tracked metadata and sizes."""
+        meta = self.meta.pop(key, None)
+        if meta is not None:
+            self._size -= meta['size']
+            self._plugin_sizes[meta['plugin']] -= meta['size']
+
+    def _count_sizes(self):
+        self._size = sum(meta['size'] for meta in self.meta.values())
+        self._plugin_sizes = Counter()
+        for meta in self.meta.values():
+            self._plugin_sizes[meta['plugin']] += meta['size']
+
+    def configure(self, max_bytes=None, max_age_days=None, plugin_max_bytes=None):
+        """
+        Set the bounds of the cache and evict the entries beyond them.
+
+        Args:
+        max_bytes (int, optional): The maximum total size of the pickled entries.
+        max_age_days (float, optional): The maximum age of an entry, from when it was stored.
+        plugin_max_bytes (dict, optional): The maximum total size of each plugin's entries.
+        """
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 24 * 60 * 60 if max_age_days is not None else None
+        self.plugin_max_bytes = plugin_max_bytes or {}
+        self.evict()
+
+    def _reload_meta(self):
+        """
+        Re-read the metadata, which other handles on the cache file, e.g. in other processes,
+        may have changed, keeping the hits of this handle that haven't been written yet.
+        """
+        meta = dict(self.meta_db.items())
+        for key in self._hits:
+            if key in meta and key in self.meta:
+                meta[key]['last_hit'] = max(meta[key]['last_hit'], self.meta[key]['last_hit'])
+        self.meta = meta
+        self._count_sizes()
+
+    def evict(self):
+        """Evict expired entries, then the least recently hit ones until within the size bounds."""
+        self._reload_meta()
+        if self.max_age is not None:
+            expired = time.time() - self.max_age
+            for key in [key for key, meta in self.meta.items() if meta['created'] < expired]:
+                self._evict(key, 'expired')
+
+        lru = sorted(self.meta, key=lambda key: self.meta[key]['last_hit'])
+        for plugin, max_bytes in self.plugin_max_bytes.items():
+            plugin_keys = [key for key in lru if self.meta[key]['plugin'] == plugin]
+            total = sum(self.meta[key]['size'] for key in plugin_keys)
+            for key in plugin_keys:
+                if total <= max_bytes:
+                    break
+                total -= self.meta[key]['size']
+                self._evict(key, f"over the {plugin} quota")
+
+        if self.max_bytes is not None:
+            total = sum(meta['size'] for meta in self.meta.values())
+            for key in lru:
+                if total <= self.max_bytes:
+                    break
+                if key in self.meta:
+                    total -= self.meta[key]['size']
+                    self._evict(key, "over the cache size")
+
+        if self.autocommit:
+            self.commit()
+
+    def _evict(self, key, reason):
+        if key not in self.db:
+            # already removed through another handle
+            self._pop_meta(key)
+            if key in self.meta_db:
+                del self.meta_db[key]
+            return
+        logger.info(f"Evicting cache entry {key} of plugin {self.meta[key]['plugin']}: {reason}")
+        self.stats['evictions'] += 1
+        self.stats['evicted_bytes'] += self.meta[key]['size']
+        del self.db[key]
+        if key in self.meta_db:
+            del self.meta_db[key]
+        self._pop_meta(key)
+
+    def created(self, key):
+        """Return when the entry for key was stored, or None if that isn't known."""
+        meta = self.meta.get(key) or self.meta_db.get(key)
+        return meta['created'] if meta else None
+
+    def size(self):
+        """Return the total size in bytes of the pickled entries."""
+        self._reload_meta()
+        return self._size
+
+    def _over_bounds(self, plugin):
+        """Return whether the tracked sizes are over the cache's, or plugin's, size bound."""
+        if self.max_bytes is not None and self._size > self.max_bytes:
+            return True
+        max_bytes = self.plugin_max_bytes.get(plugin)
+        return max_bytes is not None and self._plugin_sizes[plugin] > max_bytes
+
+    def log_stats(self):
+        logger.info(
+            f"Plugin cache: {self.stats['hits']} hits, {self.stats['misses']} misses, "
+            f"{self.stats['evictions']} evictions ({self.stats['evicted_bytes']} bytes), "
+            f"{len(self.meta)} entries ({self.size()} bytes)")
+
+    def set(self, key, value, plugin=None):
+        """Store a plugin's results, then evict entries if the cache is over its bounds."""
+        data = self._encode(value)
+        self.db[key] = data
+        self._set_meta(key, plugin, len(data))
+        if self._over_bounds(plugin):
+            self.evict()
+        elif self.autocommit:
+            self.commit()
+
+    def get(self, key, default=None):
+        """Return the results stored for key, counting the lookup as a hit or a miss."""
+        try:
+            return self[key]
+        except KeyError:
+            self.stats['misses'] += 1
+            return default
+
+    def migrate(self, legacy_file_path):
+        """Copy the entries of a PickleDict cache file into this cache and remove the file."""
+        legacy = PickleDict(legacy_file_path)
+        for key, value in legacy.items():
+            if key not in self.db:
+                data = self._encode(value)
+                self.db[key] = data
+                self._set_meta(key, None, len(data))
+        self.commit()
+        os.remove(legacy_file_path)
+        logger.info(f"Migrated {len(legacy)} cache entries from {legacy_file_path} to {self.file_path}")
+
+    def commit(self):
+        for key in self._hits:
+            if key in self.meta:
+                self.meta_db[key] = self.meta[key]
+        self._hits.clear()
+        self.db.commit()
+        self.meta_db.commit()
+
+    def close(self):
+        self.db.close()
+        self.meta_db.close()
+
+    def __getitem__(self, key):
+        value = self.db[key]
+        self.stats['hits'] += 1
+        if key in self.meta:
+            self.meta[key]['last_hit'] = time.time()
+            self._hits.add(key)
+            if self.autocommit:
+                self.commit()
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        del self.db[key]
+        self._pop_meta(key)
+        if key in self.meta_db:
+            del self.meta_db[key]
+        if self.autocommit:
+            self.commit()
+
+    def __contains__(self, key):
+        return key in self.db
+
+    def __len__(self):
+        return len(self.db)
+
+    def __iter__(self):
+        return iter(self.db)
+
+    def keys(self):
+        return self.db.keys()
+
+    def values(self):
+        return self.db.values()
+
+    def items(self):
+        return self.db.items()
+
+    def clear(self):
+        self.db.clear()
+        self.meta_db.clear()
+        self.meta.clear()
+        self._count_sizes()
+        if self.autocommit:
+            self.commit()
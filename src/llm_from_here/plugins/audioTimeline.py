@@ -1,9 +1,16 @@
 from pydub import AudioSegment
+from pydub.utils import get_encoder_name
+import numpy as np
 import os
+import subprocess
+import wave
 
 from enum import Enum
 import logging
 
+from llm_from_here.sound.silence import silence_bounds, trim_silence
+from llm_from_here.artifactStore import replace_on_write
+
 logger = logging.getLogger(__name__)
 
 
@@ -11,12 +18,334 @@ class SegmentLabel(Enum):
     FOREGROUND = 'foreground'
     BACKGROUND = 'background'
 
+# numpy dtypes for pydub sample widths (24-bit audio is widened to 32-bit before mixing)
+SAMPLE_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+# ffmpeg raw PCM formats for the sample widths above
+PCM_FORMATS = {1: 's8', 2: 's16le', 4: 's32le'}
+
+
+def audio_to_array(audio, frame_rate=None, channels=None, sample_width=None):
+    """
+    Convert an AudioSegment to a (frames, channels) numpy array of integer samples,
+    optionally converting it to the given frame rate, channel count and sample width first.
+    """
+    if frame_rate and audio.frame_rate != frame_rate:
+        audio = audio.set_frame_rate(frame_rate)
+    if channels and audio.channels != channels:
+        audio = audio.set_channels(channels)
+    if sample_width and audio.sample_width != sample_width:
+        audio = audio.set_sample_width(sample_width)
+    samples = np.frombuffer(audio.raw_data, dtype=SAMPLE_DTYPES[audio.sample_width])
+    return samples.reshape(-1, audio.channels)
+
+
+def array_to_audio(samples, frame_rate, sample_width):
+    """
+    Convert a (frames, channels) numpy array to an AudioSegment, clipping the samples
+    to the range of the sample width.
+    """
+    dtype = SAMPLE_DTYPES[sample_width]
+    info = np.iinfo(dtype)
+    samples = np.clip(samples, info.min, info.max).astype(dtype)
+    return AudioSegment(samples.tobytes(), frame_rate=frame_rate,
+                        sample_width=sample_width, channels=samples.shape[1])
+
+
+# leading silence below this level (in dBFS) is trimmed, checked in chunks of this many ms
+SILENCE_THRESHOLD = -50.0
+SILENCE_CHUNK_MS = 10
+
+
 def match_target_amplitude(sound, target_dBFS=-20.0):
     change_in_dBFS = target_dBFS - sound.dBFS
     return sound.apply_gain(change_in_dBFS)
 
+
+def loop_audio(audio, duration, trim=True):
+    """
+    Loop audio if it is shorter than the duration.
+    """
+    prior_len = len(audio)
+    if duration:
+        if len(audio) < duration:
+            num_loops = duration // len(audio)
+            remainder = duration % len(audio)
+            audio = audio * num_loops + audio[:remainder]
+
+        if trim:
+            audio = audio[:duration]
+
+    if len(audio) != prior_len:
+        logger.info(f"Trimmed/looped audio from {prior_len} to {len(audio)}")
+    return audio
+
+
+def leading_silence(audio, silence_threshold=SILENCE_THRESHOLD, chunk_size=SILENCE_CHUNK_MS):
+    """
+    Return the length in ms of the silence at the start of an AudioSegment, up to the first
+    chunk of chunk_size ms louder than silence_threshold (in dB). The result is len(audio)
+    if the whole segment is silent.
+    """
+    assert chunk_size > 0
+    assert isinstance(audio, AudioSegment)  # to avoid other types
+    return silence_bounds(audio, silence_threshold, chunk_size)[0]
+
+
+def apply_fades(audio, fade_in=0, fade_out=0):
+    """Apply fade-in and fade-out effects to a given audio segment."""
+    if fade_in > 0:
+        audio = audio.fade_in(fade_in)
+    if fade_out > 0:
+        audio = audio.fade_out(fade_out)
+    return audio
+
+
+class TimelineEntry:
+    """
+    An audio clip placed on the timeline.
+
+    The source is either an AudioSegment or the path to an audio file. Files aren't decoded
+    when the entry is created: the format and duration are read from the wav header and the
+    leading silence by reading up to the first sound, so a timeline of file entries pickles
+    to paths and metadata. The processing applied when the timeline is built (looping,
+    trimming leading silence, gain and fades) is recorded on the entry and applied by load()
+    when it is rendered.
+
+    Entries can be read and written like the dicts they replace, e.g. entry['start_time'];
+    entry['audio'] returns the processed audio.
+    """
+    KEYS = ('audio', 'start_time', 'label', 'end_time', 'name', 'type')
+
+    __slots__ = ('source', 'start_time', 'label', 'end_time', 'name', 'type',
+                 'frame_rate', 'channels', 'sample_width', 'source_duration', '_leading_silence',
+                 'loop_duration', 'trim_start', 'gain', 'fade_in', 'fade_out', '_dBFS')
+
+    def __init__(self, source, start_time=0, label=SegmentLabel.FOREGROUND, name=None, type=None,
+                 end_time=None):
+        self.start_time = start_time
+        self.label = label
+        self.end_time = end_time
+        self.name = name
+        self.type = type
+        self.set_source(source)
+
+    def set_source(self, source):
+        """Set the audio source, clearing any processing and reading its format and duration."""
+        self.source = source
+        self._leading_silence = None
+        self.loop_duration = None
+        self.trim_start = 0
+        self.gain = 0
+        self.fade_in = 0
+        self.fade_out = 0
+        self._dBFS = None
+
+        if not isinstance(source, AudioSegment):
+            try:
+                with wave.open(source, 'rb') as reader:
+                    self.frame_rate = reader.getframerate()
+                    self.channels = reader.getnchannels()
+                    self.sample_width = reader.getsampwidth()
+                    self.source_duration = round(1000 * reader.getnframes() / self.frame_rate)
+                return
+            except (wave.Error, EOFError):
+                # not a PCM wav file, so its metadata has to come from decoding it
+                source = self._decode()
+        self.frame_rate = source.frame_rate
+        self.channels = source.channels
+        self.sample_width = source.sample_width
+        self.source_duration = len(source)
+
+    def _decode(self):
+        if isinstance(self.source, AudioSegment):
+            return self.source
+        # wav files are read directly, falling back to ffmpeg if they turn out not to be PCM
+        format = 'wav' if self.source.lower().endswith('.wav') else None
+        with open(self.source, 'rb') as file:
+            return AudioSegment.from_file(file, format=format)
+
+    @property
+    def leading_silence(self):
+        """The length in ms of the silence at the start of the source, found on first use."""
+        if self._leading_silence is None:
+            self._leading_silence = self._find_leading_silence()
+        return self._leading_silence
+
+    def _find_leading_silence(self, block_ms=1000):
+        if isinstance(self.source, AudioSegment):
+            return leading_silence(self.source)
+        try:
+            reader = wave.open(self.source, 'rb')
+        except (wave.Error, EOFError):
+            return leading_silence(self._decode())
+
+        # read blocks of whole silence chunks until one has sound in it
+        with reader:
+            offset = 0
+            while True:
+                data = reader.readframes(reader.getframerate() * block_ms // 1000)
+                if not data:
+                    return offset
+                if self.sample_width == 1:
+                    # 8-bit wav samples are unsigned
+                    data = (np.frombuffer(data, dtype=np.uint8).astype(np.int16) - 128).astype(np.int8).tobytes()
+                block = AudioSegment(data, frame_rate=self.frame_rate,
+                                     sample_width=self.sample_width, channels=self.channels)
+                silence = leading_silence(block)
+                if silence < len(block):
+                    return offset + silence
+                offset += len(block)
+
+    @property
+    def looped_duration(self):
+        """The duration in ms of the source once looped or trimmed to loop_duration."""
+        if self.loop_duration and self.source_duration:
+            return self.loop_duration
+        return self.source_duration
+
+    @property
+    def duration(self):
+        """The duration in ms of the processed audio."""
+        return max(self.looped_duration - self.trim_start, 0)
+
+    def trim_leading_silence(self):
+        """Trim the leading silence from the looped audio when it is loaded."""
+        if self.leading_silence >= self.source_duration:
+            self.trim_start = self.looped_duration
+        else:
+            self.trim_start = min(self.leading_silence, self.looped_duration)
+        self._dBFS = None
+
+    def set_effects(self, gain=0, fade_in=0, fade_out=0):
+        """Set the gain in dB and the fade durations in ms applied when the audio is loaded."""
+        self.gain = gain or 0
+        self.fade_in = fade_in
+        self.fade_out = fade_out
+        self._dBFS = None
+
+    def load(self, effects=True):
+        """
+        Decode the source and apply the entry's processing to it.
+
+        Args:
+        effects (bool, optional): Whether to apply the gain and fades, or only loop and trim.
+        """
+        audio = loop_audio(self._decode(), duration=self.loop_duration)
+        audio = audio[self.trim_start:]
+        if effects:
+            if self.gain:
+                audio = audio.apply_gain(self.gain)
+            audio = apply_fades(audio, self.fade_in, self.fade_out)
+        return audio
+
+    @property
+    def dBFS(self):
+        """The loudness of the processed audio, computed on first use."""
+        if self._dBFS is None:
+            self._dBFS = self.load().dBFS
+        return self._dBFS
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        if key == 'audio':
+            return self.load()
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        if key == 'audio':
+            self.set_source(value)
+        else:
+            setattr(self, key, value)
+
+    def get(self, key, default=None):
+        return self[key] if key in self.KEYS else default
+
+    def keys(self):
+        return list(self.KEYS)
+
+    def values(self):
+        return [self[key] for key in self.KEYS]
+
+    def items(self):
+        return list(zip(self.keys(), self.values()))
+
+    def __repr__(self):
+        source = self.source if isinstance(self.source, str) else 'AudioSegment'
+        return (f"TimelineEntry({source!r}, start_time={self.start_time}, label={self.label}, "
+                f"end_time={self.end_time}, name={self.name!r}, type={self.type!r})")
+
+
+class IntervalIndex:
+    """
+    A static centered interval tree over half-open [start, end) intervals.
+
+    Finds the intervals overlapping a range in O(log n + k) for k matches, rather than
+    scanning every interval.
+    """
+
+    def __init__(self, intervals):
+        """
+        Args:
+        intervals (list): (start, end) tuples; empty intervals never match a query.
+        """
+        self.intervals = list(intervals)
+        self.root = self._build([(i, start, end) for i, (start, end) in enumerate(self.intervals)
+                                 if end > start])
+
+    @classmethod
+    def _build(cls, items):
+        if not items:
+            return None
+        # centering on the median start guarantees at least one interval is stored per node
+        center = sorted(start for _, start, _ in items)[len(items) // 2]
+        here = [item for item in items if item[1] <= center < item[2]]
+        return {
+            'center': center,
+            'by_start': sorted(here, key=lambda item: item[1]),
+            'by_end': sorted(here, key=lambda item: -item[2]),
+            'left': cls._build([item for item in items if item[2] <= center]),
+            'right': cls._build([item for item in items if item[1] > center]),
+        }
+
+    def overlapping(self, start, end):
+        """Return the sorted indices of the intervals overlapping [start, end)."""
+        found = []
+        node = self.root
+        stack = [node] if node else []
+        while stack:
+            node = stack.pop()
+            if end <= node['center']:
+                # intervals here all end after the range starts; keep those starting before it ends
+                for i, item_start, _ in node['by_start']:
+                    if item_start >= end:
+                        break
+                    found.append(i)
+                if node['left']:
+                    stack.append(node['left'])
+            elif start > node['center']:
+                # intervals here all start before the range ends; keep those ending after it starts
+                for i, _, item_end in node['by_end']:
+                    if item_end <= start:
+                        break
+                    found.append(i)
+                if node['right']:
+                    stack.append(node['right'])
+            else:
+                found.extend(i for i, _, _ in node['by_start'])
+                stack.extend(child for child in (node['left'], node['right']) if child)
+        return sorted(found)
+
+    def at(self, time):
+        """Return the sorted indices of the intervals containing time."""
+        return self.overlapping(time, time + 1e-9)
+
+
 class AudioTimeline:
     def __init__(self, params=None, global_results=None, plugin_instance_name=None):
+        self.timeline = []
         # check if a timeline already exists
         if params and global_results and plugin_instance_name:
             time_variable = params.get('timeline_variable', None)
@@ -28,47 +357,89 @@ class AudioTimeline:
                     logger.error(
                         f"Unable to retrieve timeline from global results for {plugin_instance_name} and time variable {time_variable}: {e}")
                     raise e
-        else:
-            self.timeline = []
 
         self.params = params
         self.global_results = global_results
         self.plugin_instance_name = plugin_instance_name
 
+        self._reset_index()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # the indexes are rebuilt from the timeline on demand
+        for key in ('_tails', '_indexed', '_interval_index'):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset_index()
+
+    def _reset_index(self):
+        self._tails = {}
+        self._indexed = 0
+        self._interval_index = None
+
+    def _update_tails(self):
+        """
+        Bring the per-label tail pointers up to date with the entries appended to the timeline
+        since the last call, so that the last entry for a label is found in O(1). The timeline
+        list may be shared with another AudioTimeline, so appends aren't only made through this one.
+        """
+        if self._indexed > len(self.timeline):
+            self._reset_index()
+        for entry in self.timeline[self._indexed:]:
+            self._tails[entry['label']] = entry
+        self._indexed = len(self.timeline)
+
+    def interval_index(self):
+        """
+        Return an IntervalIndex over the rendered (start, end) span of each entry, in milliseconds
+        and in timeline order. The index is rebuilt when entries are added or end times are set.
+        """
+        if self._interval_index is None or len(self._interval_index.intervals) != len(self.timeline):
+            self._interval_index = IntervalIndex(
+                [(entry['start_time'], entry['start_time'] + self._render_duration(entry))
+                 for entry in self.timeline])
+        return self._interval_index
+
+    def entries_between(self, start_time, end_time):
+        """Return the entries that play at some point between start_time and end_time (in ms)."""
+        return [self.timeline[i] for i in self.interval_index().overlapping(start_time, end_time)]
+
+    def entries_at(self, time):
+        """Return the entries that are playing at the given time (in ms)."""
+        return [self.timeline[i] for i in self.interval_index().at(time)]
+
     def _validate_audio(self, audio):
-        """Validate the audio input to ensure it's an instance of AudioSegment, if not,
-        and it's a valid file, assume it's to be imported and return AudioSegment."""
+        """Validate the audio input to ensure it's an instance of AudioSegment, or the path
+        of an existing file, which is left to be decoded when the timeline is rendered."""
         if isinstance(audio, AudioSegment):
             return audio
         elif isinstance(audio, str):
             if os.path.isfile(audio):
-                with open(audio, 'rb') as file:
-                    return AudioSegment.from_file(file)
-                #return AudioSegment.from_file(audio)
+                return audio
             else:
                 raise ValueError(f"Audio file {audio} does not exist.")
 
     def _apply_effects(self, audio, fade_in, fade_out, gain=None):
         """Apply fade-in and fade-out effects to a given audio segment."""
-        ret = audio
-        if fade_in > 0:
-            ret = audio.fade_in(fade_in)
-        if fade_out > 0:
-            ret = audio.fade_out(fade_out)
-        
+        ret = apply_fades(audio, fade_in, fade_out)
+
         if gain and gain != 0:
             ret = ret.apply_gain(gain)
-            
+
         return ret
 
     def _add_to_timeline(self, audio, start_time, label=SegmentLabel.FOREGROUND, name=None, type=None, end_time=None):
-        """Add the audio segment to the timeline."""
-        self.timeline.append({'audio': audio,
-                              'start_time': start_time,
-                              'label': label,
-                              'end_time': end_time,
-                              'name': name,
-                              'type': type})
+        """Add the audio segment, or a TimelineEntry, to the timeline."""
+        if isinstance(audio, TimelineEntry):
+            entry = audio
+            entry.start_time, entry.label, entry.end_time = start_time, label, end_time
+            entry.name, entry.type = name, type
+        else:
+            entry = TimelineEntry(audio, start_time, label, name=name, type=type, end_time=end_time)
+        self.timeline.append(entry)
 
     def get_last_type(self):
         """Return the last type in the timeline."""
@@ -79,31 +450,28 @@ class AudioTimeline:
         
     def get_last_end_time(self, label=SegmentLabel.FOREGROUND):
         """Return the last end time for a FOREGROUND entry in the timeline."""
-        if self.timeline:
-            for entry in reversed(self.timeline):
-                if entry['label'] == label:
-                    if entry['end_time']:
+        entry = self.get_last_entry(label=label)
+        if entry:
+            if entry['end_time']:
+                return entry['end_time']
+            else:
+                if label == SegmentLabel.FOREGROUND:
+                    return entry['start_time'] + entry.duration
+                else:
+                    #get the last foreground entry and use its end time
+                    last_entry = self.get_last_entry(label=SegmentLabel.FOREGROUND)
+                    if last_entry:
+                        entry['end_time'] = last_entry['end_time']
+                        self._interval_index = None
+                        logger.info(f"End time is {entry['end_time']}")
                         return entry['end_time']
-                    else:
-                        if label == SegmentLabel.FOREGROUND:
-                            return entry['start_time'] + len(entry['audio'])
-                        else:
-                            #get the last foreground entry and use its end time
-                            last_entry = self.get_last_entry(label=SegmentLabel.FOREGROUND)
-                            if last_entry:
-                                entry['end_time'] = last_entry['end_time']
-                                logger.info(f"End time is {entry['end_time']}")
-                                return entry['end_time']
-                        
+
         return 0
     
     def get_last_entry(self, label=SegmentLabel.FOREGROUND):
         """Return the last entry in the timeline."""
-        if self.timeline:
-            for entry in reversed(self.timeline):
-                if entry['label'] == label:
-                    return entry
-        return None
+        self._update_tails()
+        return self._tails.get(label)
 
     def _apply_gain(self, audio, gain):
         """Apply gain to the audio segment."""
@@ -114,26 +482,16 @@ class AudioTimeline:
             return audio
     
     def _strip_silence(self, audio):
-        """Strip silence from the audio segment."""
-        return audio.strip_silence(
-            silence_thresh=-50, silence_len=50, padding=0)
+        """Strip leading and trailing silence from the audio segment."""
+        return trim_silence(audio, silence_threshold=-50)
 
     def _trim_leading_silence(self, audio, silence_threshold=-50.0, chunk_size=10):
         """
         audio is a pydub.AudioSegment
         silence_threshold in dB
         chunk_size in ms
-
-        iterate over chunks until you find the first one with audio
         """
-        trim_ms = 0 # ms
-
-        assert chunk_size > 0 # to avoid infinite loop
-        assert isinstance(audio, AudioSegment) # to avoid other types
-        while audio[trim_ms:trim_ms+chunk_size].dBFS < silence_threshold and trim_ms < len(audio):
-            trim_ms += chunk_size
-
-        return audio[trim_ms:]
+        return audio[leading_silence(audio, silence_threshold, chunk_size):]
 
     def _process_background_audio(self, audio, match_audio):
         bg = audio
@@ -175,34 +533,33 @@ class AudioTimeline:
         fade_in (int, optional): The duration in milliseconds of the fade-in effect.
         fade_out (int, optional): The duration in milliseconds of the fade-out effect.
         """
-        audio = self._validate_audio(audio)
+        entry = TimelineEntry(self._validate_audio(audio))
         last_entry = self.get_last_entry()
         #extend audio to meet end time, and trim, if necessary
-        logging.debug(f"Audio duration: {len(audio)} before looping")
-        audio=self.loop_audio(audio, duration=duration)
-        logging.debug(f"Audio duration: {len(audio)} after looping")
+        logging.debug(f"Audio duration: {entry.source_duration} before looping")
+        entry.loop_duration = duration
+        logging.debug(f"Audio duration: {entry.looped_duration} after looping")
 
-        #process audio
-        audio = self._trim_leading_silence(audio)
+        #process audio; this is recorded on the entry and applied when it's rendered
+        entry.trim_leading_silence()
+        match_gain = 0
         if last_entry and gain_match and label == SegmentLabel.FOREGROUND:
-            audio = match_target_amplitude(audio, target_dBFS=last_entry['audio'].dBFS)
+            match_gain = last_entry.dBFS - entry.load(effects=False).dBFS
         logger.info(f"Gain is {gain}")
-        audio = self._apply_gain(audio, gain)
-        audio = self._apply_effects(audio, fade_in, fade_out)
+        entry.set_effects(match_gain + (gain or 0), fade_in, fade_out)
         
         logger.info(f" Overlay percentage is {overlay_percentage} and overlay duration is {overlay_duration}")
         overlay_duration = 0
         if overlay_duration:
             overlay_duration = overlay_duration
         elif overlay_percentage:
-            previous_len = last_entry['audio']
-            overlay_duration = int(len(previous_len) * (overlay_percentage / 100))
+            overlay_duration = int(last_entry.duration * (overlay_percentage / 100))
 
         overlay_start_time = start_time - overlay_duration
         logging.debug(f"Overlay start time is {overlay_start_time}, overlay duration is {overlay_duration} and start time is {start_time}")
-        logging.debug(f"Audio length is {len(audio)}")
-        self._add_to_timeline(audio, overlay_start_time, label,
-                              name=name, type=type, end_time=len(audio)+overlay_start_time)
+        logging.debug(f"Audio length is {entry.duration}")
+        self._add_to_timeline(entry, overlay_start_time, label,
+                              name=name, type=type, end_time=entry.duration+overlay_start_time)
 
 
     def add_after_previous(self, audio, label=SegmentLabel.FOREGROUND, name=None, type=None,
@@ -249,14 +606,14 @@ class AudioTimeline:
         """
         last_entry = self.get_last_entry(label=SegmentLabel.BACKGROUND)
         
-        audio = self._validate_audio(audio)
-        audio = self._trim_leading_silence(audio)
+        entry = TimelineEntry(self._validate_audio(audio))
+        entry.trim_leading_silence()
+        match_gain = 0
         if last_entry and gain_match:
-            audio = match_target_amplitude(audio, target_dBFS=last_entry['audio'].dBFS)
-        audio = self._apply_gain(audio, gain)
-        audio = self._apply_effects(audio, fade_in, fade_out)
+            match_gain = last_entry.dBFS - entry.load(effects=False).dBFS
+        entry.set_effects(match_gain + (gain or 0), fade_in, fade_out)
         self._add_to_timeline(
-            audio, start_time, SegmentLabel.BACKGROUND, name=name, type=type, end_time=end_time)
+            entry, start_time, SegmentLabel.BACKGROUND, name=name, type=type, end_time=end_time)
 
     def set_end_times(self):
         """
@@ -286,34 +643,128 @@ class AudioTimeline:
                 self.timeline[k]['end_time'] = v
                 logger.info(
                     f"Set end time for background audio {self.timeline[k]['name']} to {v}")
+        self._interval_index = None
         
     def loop_audio(self, audio, duration, trim=True):
         """
         Loop audio if it is shorter than the duration.
         """
-        prior_len = len(audio)
-        if duration:
-            if len(audio) < duration:
-                num_loops = duration // len(audio)
-                remainder = duration % len(audio)
-                audio = audio * num_loops + audio[:remainder]
-            
-            if trim:
-                audio = audio[:duration]
-        
-        if len(audio) != prior_len:
-            logger.info(f"Trimmed/looped audio from {prior_len} to {len(audio)}")
-        return audio
+        return loop_audio(audio, duration, trim=trim)
     
-    def merge_segment(self, audio, start_time, target_audio):
+    def _render_format(self):
+        """
+        Return the (frame_rate, channels, sample_width) used to render the timeline;
+        like pydub's overlay, the highest of each found in the timeline.
+        """
+        if not self.timeline:
+            silence = AudioSegment.silent(duration=0)
+            return silence.frame_rate, silence.channels, silence.sample_width
+
+        frame_rate = max(entry.frame_rate for entry in self.timeline)
+        channels = max(entry.channels for entry in self.timeline)
+        sample_width = max(entry.sample_width for entry in self.timeline)
+        if sample_width == 3:
+            sample_width = 4
+        return frame_rate, channels, sample_width
+
+    def _render_duration(self, entry):
+        """
+        Return the duration in milliseconds an entry plays for once rendered: the span
+        between its start and end times, or the length of its audio if that span is empty.
+        """
+        if entry['end_time'] is not None and entry['end_time'] > entry['start_time']:
+            return entry['end_time'] - entry['start_time']
+        return entry.duration
+
+    def _render_clips(self, frame_rate):
+        """
+        Return a (entry, start_frame, num_frames) tuple for each entry in the timeline,
+        sorted by start frame.
         """
-        Merge a segment into the target audio.
+        def to_frames(ms):
+            return int(round(ms * frame_rate / 1000))
+
+        clips = [(entry, to_frames(entry['start_time']), to_frames(self._render_duration(entry)))
+                 for entry in self.timeline]
+        return sorted(clips, key=lambda clip: clip[1])
+
+    @staticmethod
+    def _add_clip(mixed, mixed_start, samples, clip_start, clip_frames):
+        """
+        Add the part of a clip that falls within mixed, a buffer starting at frame mixed_start.
+        The clip's samples are looped or trimmed to clip_frames frames.
+        """
+        start = max(clip_start, mixed_start)
+        end = min(clip_start + clip_frames, mixed_start + len(mixed))
+        if end <= start or len(samples) == 0:
+            return
+
+        # loop the clip by adding it a slice at a time, without indexing every frame
+        position = start
+        while position < end:
+            offset = (position - clip_start) % len(samples)
+            frames = min(len(samples) - offset, end - position)
+            mixed[position - mixed_start:position - mixed_start + frames] += samples[offset:offset + frames]
+            position += frames
+
+    def mix(self):
+        """
+        Mix the timeline into a single AudioSegment.
+
+        Each entry is decoded once into a numpy array and summed into a single preallocated
+        buffer at its sample offset, looping or trimming it to its rendered duration.
+        Samples are clipped to the output sample width once all entries are mixed in.
         """
+        frame_rate, channels, sample_width = self._render_format()
+        clips = self._render_clips(frame_rate)
 
-        # Pad silence to the start of the audio
-        pad_silence = AudioSegment.silent(duration=start_time)
-        padded_audio = pad_silence + audio
-        return  padded_audio.overlay(target_audio)
+        # accumulate in a wider integer type so that summing clips can't overflow
+        accumulator_dtype = np.int64 if sample_width == 4 else np.int32
+        total_frames = max([max(start, 0) + num_frames for _, start, num_frames in clips], default=0)
+        mixed = np.zeros((total_frames, channels), dtype=accumulator_dtype)
+
+        for entry, start, num_frames in clips:
+            logger.info(f"Rendering audio name {entry['name']} with duration {entry.duration}")
+            samples = audio_to_array(entry.load(), frame_rate, channels, sample_width)
+            self._add_clip(mixed, 0, samples, start, num_frames)
+
+        return array_to_audio(mixed, frame_rate, sample_width)
+
+    def mix_windows(self, window_ms=10000):
+        """
+        Mix the timeline in fixed-size time windows.
+
+        Yields (samples, frame_rate, sample_width) for each window in order, where samples
+        is a (frames, channels) numpy array. Only the entries overlapping a window are mixed
+        into it, and each entry is decoded when the first window it overlaps is mixed and
+        released after the last one, so memory is bounded by the window size plus the
+        entries active at once rather than by the length of the timeline.
+        """
+        frame_rate, channels, sample_width = self._render_format()
+        clips = self._render_clips(frame_rate)
+        accumulator_dtype = np.int64 if sample_width == 4 else np.int32
+        total_frames = max([max(start, 0) + num_frames for _, start, num_frames in clips], default=0)
+        window_frames = max(int(window_ms * frame_rate / 1000), 1)
+
+        index = IntervalIndex([(start, start + num_frames) for _, start, num_frames in clips])
+        decoded = {}
+        for window_start in range(0, total_frames, window_frames):
+            window_end = min(window_start + window_frames, total_frames)
+            active = index.overlapping(window_start, window_end)
+
+            # release clips that ended before this window, decode the ones starting in it
+            decoded = {i: decoded[i] for i in active if i in decoded}
+            for i in active:
+                if i not in decoded:
+                    entry = clips[i][0]
+                    logger.info(f"Rendering audio name {entry['name']} with duration {entry.duration}")
+                    decoded[i] = audio_to_array(entry.load(), frame_rate, channels, sample_width)
+
+            mixed = np.zeros((window_end - window_start, channels), dtype=accumulator_dtype)
+            for i in active:
+                _, start, num_frames = clips[i]
+                self._add_clip(mixed, window_start, decoded[i], start, num_frames)
+            yield mixed, frame_rate, sample_width
 
     def render(self, filename, format):
         """
@@ -324,44 +775,10 @@ class AudioTimeline:
         format (str): The format to save the rendered audio in.
         """
         try:
-            foreground_audio = AudioSegment.silent(duration=0)
-            background_audio = AudioSegment.silent(duration=0)
-
             self.set_end_times()
+            rendered_audio = self.mix()
 
-            # now accumulate audio
-            for entry in self.timeline:
-                audio = entry['audio']
-                #extend audio to meet end time, and trim, if necessary
-                logger.info(f"Rendering audio name {entry['name']} with duration {len(audio)}")
-                audio = self.loop_audio(audio, 
-                                        duration=entry['end_time'] - entry['start_time'])
-                
-                
-                if entry['label'] == SegmentLabel.FOREGROUND:
-                    foreground_audio=self.merge_segment(audio, 
-                                   target_audio=foreground_audio,
-                                   start_time=entry['start_time'])
-                else:
-                    background_audio=self.merge_segment(audio, 
-                                   target_audio=background_audio,
-                                   start_time=entry['start_time'])
-
-                
-
-            logger.info(f"Foreground audio duration: {len(foreground_audio)} ")
-            logger.info(f"Background audio duration: {len(background_audio)} ")
-            if len(background_audio) > 0:
-                #background_audio = self._process_background_audio(background_audio, foreground_audio)
-                if len(foreground_audio) > len(background_audio):
-                    rendered_audio = foreground_audio.overlay(
-                        background_audio)
-                else:
-                    rendered_audio = background_audio.overlay(foreground_audio)
-            else:
-                rendered_audio = foreground_audio
-
-            with open(filename, 'wb') as file:
+            with replace_on_write(filename) as path, open(path, 'wb') as file:
                 rendered_audio.export(file, format=format)
 
             logger.info(
@@ -370,6 +787,60 @@ class AudioTimeline:
             print(f"An error occurred while rendering: {str(e)}")
             raise e
 
+    def render_stream(self, filename, format, window_ms=10000):
+        """
+        Render the timeline to a single audio file window by window, without holding the
+        whole rendered audio in memory. WAV files are written directly, other formats are
+        encoded by piping raw samples to ffmpeg.
+
+        Args:
+        filename (str): The name of the file to save the rendered audio to.
+        format (str): The format to save the rendered audio in.
+        window_ms (int, optional): The length in milliseconds of each rendered window.
+        """
+        self.set_end_times()
+        frame_rate, channels, sample_width = self._render_format()
+        dtype = SAMPLE_DTYPES[sample_width]
+        info = np.iinfo(dtype)
+
+        with replace_on_write(filename) as path:
+            if format == 'wav':
+                writer = wave.open(path, 'wb')
+                writer.setnchannels(channels)
+                writer.setsampwidth(sample_width)
+                writer.setframerate(frame_rate)
+                write = writer.writeframes
+            else:
+                writer = subprocess.Popen(
+                    [get_encoder_name(), '-y', '-loglevel', 'error',
+                     '-f', PCM_FORMATS[sample_width], '-ar', str(frame_rate), '-ac', str(channels),
+                     '-i', 'pipe:0', '-f', format, path],
+                    stdin=subprocess.PIPE)
+                write = writer.stdin.write
+
+            total_frames = 0
+            try:
+                for mixed, _, _ in self.mix_windows(window_ms):
+                    samples = np.clip(mixed, info.min, info.max).astype(dtype)
+                    if format == 'wav' and sample_width == 1:
+                        # 8-bit wav samples are unsigned
+                        samples = (samples.astype(np.int16) + 128).astype(np.uint8)
+                    write(samples.tobytes())
+                    total_frames += len(samples)
+            except Exception as e:
+                print(f"An error occurred while rendering: {str(e)}")
+                raise e
+            finally:
+                if format == 'wav':
+                    writer.close()
+                else:
+                    writer.stdin.close()
+                    if writer.wait() != 0:
+                        raise RuntimeError(f"Encoding {filename} as {format} failed with code {writer.returncode}")
+
+        logger.info(
+            f"Rendered timeline to file {filename} with duration {total_frames * 1000 // frame_rate}")
+
     def visualize_timeline(self, output_file='audio_timeline.html'):
         """
         Visualize the timeline using Plotly to generate a Gantt-style plot.
@@ -382,16 +853,12 @@ class AudioTimeline:
 
         data = []
 
+        index = self.interval_index()
         for i, entry in enumerate(self.timeline):
-            duration = len(entry['audio'])
+            duration = entry.duration
+            start_time, end_time = index.intervals[i]
 
-            # Calculate the end time if not provided
-            if entry['end_time'] is None:
-                end_time = entry['start_time'] + duration
-            else:
-                end_time = entry['end_time']
-
-            start_datetime = datetime.fromtimestamp(entry['start_time'] / 1000)
+            start_datetime = datetime.fromtimestamp(start_time / 1000)
             end_datetime = datetime.fromtimestamp(end_time / 1000)
 
             data.append({
@@ -402,12 +869,13 @@ class AudioTimeline:
                 'Name': entry['name'],
                 'Type': entry['type'],
                 'Duration': duration,
+                'Overlapping': len([j for j in index.overlapping(start_time, end_time) if j != i]),
             })
 
         df = pd.DataFrame(data)
 
         fig = px.timeline(df, x_start="Start", x_end="Finish",
-                          y="Task", color="Type", hover_data=["Name"])
+                          y="Task", color="Type", hover_data=["Name", "Overlapping"])
         # fig.update_yaxes(autorange="reversed")  # Reverse the y-axis order
 
         # Create an HTML file from the figure
@@ -420,7 +888,10 @@ class AudioTimeline:
             output_folder, f"{self.plugin_instance_name}.wav")
         logger.info(
             f"Rendering timeline for {self.plugin_instance_name} to file {file_path}")
-        self.render(file_path, "wav")
+        if self.params and self.params.get('stream_render', False):
+            self.render_stream(file_path, "wav", window_ms=self.params.get('render_window_ms', 10000))
+        else:
+            self.render(file_path, "wav")
 
         html_file_path = os.path.join(
             output_folder, f"{self.plugin_instance_name}_timeline.html")
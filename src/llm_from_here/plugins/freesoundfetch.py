@@ -3,6 +3,7 @@ from dotenv import load_dotenv
 import os
 import random
 import pathvalidate
+from llm_from_here.artifactStore import ArtifactStore, get_artifact_store
 
 load_dotenv()  # take environment variables from .env.
 
@@ -34,7 +35,9 @@ class FreeSoundFetch:
     def download_sample(self, sound):
         sanitized_filename = pathvalidate.sanitize_filename(sound.name)
         temp_file_name = os.path.join(self.out_dir, f"{sanitized_filename}.wav")
-        sound.retrieve_preview(self.out_dir, name=temp_file_name)
+        key = ArtifactStore.key("freesound", sound.id, "preview")
+        get_artifact_store().fetch(key, temp_file_name,
+                                   lambda path: sound.retrieve_preview(self.out_dir, name=path))
         self.temp_files.append(temp_file_name)
 
     def search_and_download_top_samples(self, query, num_samples=1, filter_params=None):
@@ -1,12 +1,22 @@
 import openai
 import os
+import asyncio
+import random
 import logging
 from retry import retry
 import jsonschema
 import json
 import re
+import threading
+import time
+import weakref
 import yaml
 from collections import Counter
+from functools import lru_cache
+
+from openai.types.chat import ChatCompletion
+
+from llm_from_here.llmCache import LLMCache, get_llm_cache, llm_cache_mode
 
 # Setup basic logging
 logger = logging.getLogger(__name__)
@@ -14,6 +24,21 @@ logger = logging.getLogger(__name__)
 import dotenv
 dotenv.load_dotenv()
 
+# the number of prompts chat_many sends at once
+CHAT_CONCURRENCY = int(os.getenv("LLMFH_CHAT_CONCURRENCY", 4))
+# errors worth retrying, as in ChatApp.chat
+RETRY_ERRORS = (
+    openai.RateLimitError,
+    openai.AuthenticationError,
+    openai.APIError,
+)
+# errors worth retrying with structured output; a bad request means it isn't supported
+STRUCTURED_RETRY_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
 def extract_json_response(response):
     """
     Attempts to extract objects, and lists of objects from a response string.
@@ -29,34 +54,265 @@ def extract_json_response(response):
     return response
 
 
+def parse_list_response(response):
+    """
+    Parses a list from a response string, as YAML or as a bullet list, between triple single
+    quotes or backticks.
+    """
+    # Extract the response between triple single quotes, or backticks
+    match = re.search(r"'''(.*?)'''", response, re.DOTALL) or re.search(r"```(.*?)```", response, re.DOTALL)
+    if not match:
+        raise ValueError("No response was found between triple single quotes.")
+    extracted_response = match.group(1).strip()
+
+    # Try parsing as YAML
+    try:
+        response_as_list = yaml.safe_load(extracted_response)
+    except yaml.YAMLError:
+        # If that fails, try parsing as a bullet list
+        response_as_list = [
+            line.strip()[1:].strip()
+            for line in extracted_response.split("\n")
+            if line.strip().startswith("-")
+        ]
+
+    if not isinstance(response_as_list, list):
+        raise ValueError("Extracted response could not be parsed as a list.")
+    return response_as_list
+
+
+@lru_cache(maxsize=None)
+def _validator(schema_json):
+    schema = json.loads(schema_json)
+    validator_class = jsonschema.validators.validator_for(schema)
+    validator_class.check_schema(schema)
+    return validator_class(schema)
+
+
+def get_validator(json_schema):
+    """
+    Returns a validator for a JSON schema, which is checked and compiled once and reused.
+    """
+    return _validator(json.dumps(json_schema, sort_keys=True))
+
+
+def nullable_json_schema(json_schema):
+    """Returns a copy of a JSON schema that also accepts null."""
+    if "type" not in json_schema:
+        return {"anyOf": [json_schema, {"type": "null"}]}
+    types = json_schema["type"] if isinstance(json_schema["type"], list) else [json_schema["type"]]
+    if "null" in types:
+        return json_schema
+    nullable = {**json_schema, "type": types + ["null"]}
+    if "enum" in json_schema:
+        nullable["enum"] = json_schema["enum"] + [None]
+    return nullable
+
+
+def strict_json_schema(json_schema):
+    """
+    Returns a copy of a JSON schema that strict structured output accepts, where every
+    object lists all its properties as required and allows no others. Strict mode requires
+    every property, so the optional ones are made nullable instead; drop_optional_nulls
+    removes the nulls from the response.
+    """
+    if isinstance(json_schema, list):
+        return [strict_json_schema(item) for item in json_schema]
+    if not isinstance(json_schema, dict):
+        return json_schema
+    strict = {key: strict_json_schema(value) for key, value in json_schema.items()}
+    for key in ("properties", "$defs", "definitions"):
+        if isinstance(json_schema.get(key), dict):
+            strict[key] = {name: strict_json_schema(value) for name, value in json_schema[key].items()}
+    if json_schema.get("type") == "object" or "properties" in json_schema:
+        strict.setdefault("additionalProperties", False)
+        required = json_schema.get("required", [])
+        strict["properties"] = {
+            name: value if name in required else nullable_json_schema(value)
+            for name, value in strict.get("properties", {}).items()
+        }
+        strict["required"] = list(strict["properties"])
+    return strict
+
+
+def drop_optional_nulls(response, json_schema):
+    """
+    Returns a structured output response without the nulls strict_json_schema allowed for
+    the optional properties of json_schema, so that it obeys json_schema.
+    """
+    if not isinstance(json_schema, dict):
+        return response
+    if isinstance(response, dict) and isinstance(json_schema.get("properties"), dict):
+        properties, required = json_schema["properties"], json_schema.get("required", [])
+        return {
+            name: drop_optional_nulls(value, properties.get(name))
+            for name, value in response.items()
+            if not (value is None and name in properties and name not in required)
+        }
+    if isinstance(response, list) and isinstance(json_schema.get("items"), dict):
+        return [drop_optional_nulls(item, json_schema["items"]) for item in response]
+    return response
+
+
+def structured_output_error(error):
+    """
+    Returns what a bad request for structured output was rejected for: "schema" if strict
+    mode doesn't accept the JSON schema, "model" if the model doesn't support structured
+    output, or None if it wasn't rejected for its response_format.
+    """
+    message = str(error)
+    if getattr(error, "param", None) != "response_format" and "response_format" not in message:
+        return None
+    return "schema" if "invalid schema" in message.lower() else "model"
+
+
+def structured_response_format(json_schema):
+    """
+    Returns the response_format asking the OpenAI API for a response obeying a JSON schema,
+    which it enforces strictly, and whether the schema was wrapped in an object under a
+    "response" property, because the API only returns objects.
+    """
+    wrapped = json_schema.get("type") != "object"
+    if wrapped:
+        json_schema = {
+            "type": "object",
+            "properties": {"response": json_schema},
+            "required": ["response"],
+        }
+    response_format = {
+        "type": "json_schema",
+        "json_schema": {"name": "response", "schema": strict_json_schema(json_schema), "strict": True},
+    }
+    return response_format, wrapped
+
+
+def chat_named_prompts(chat_app, prompts, concurrent=False):
+    """
+    Sends prompts, each a dict with a name and a prompt, to a chat app, and returns the
+    responses by name. Concurrent prompts are independent of each other, and sent at once
+    by chat_many; otherwise each is sent after the previous responses.
+    """
+    responses = {}
+    if concurrent:
+        logger.info(f"Running {len(prompts)} prompts concurrently")
+        for prompt, response in zip(prompts, chat_app.chat_many([prompt['prompt'] for prompt in prompts])):
+            responses[prompt['name']] = response
+            logger.info(f"Prompt {prompt['name']} response: {response}")
+        return responses
+
+    for prompt in prompts:
+        logger.info(f"Running prompt: {prompt}")
+        responses[prompt['name']] = chat_app.chat(prompt['prompt'])
+        logger.info(f"Prompt response: {responses[prompt['name']]}")
+    return responses
+
+
+HISTORY_POLICIES = ("window", "pin", "summarize")
+HISTORY_SUMMARY_PROMPT = (
+    "Summarize the conversation so far in a few sentences, keeping the names, facts and "
+    "decisions that later messages may refer to."
+)
+
+
+def estimate_tokens(messages):
+    """
+    Returns a rough count of the tokens in a list of messages, at about 4 characters a token.
+    """
+    return sum(len(message["content"] or "") // 4 + 4 for message in messages)
+
+
+def token_count(value):
+    # usage is missing from some responses, and mocked in tests
+    return value if isinstance(value, int) else 0
+
+
+def api_key():
+    # a replayed run never calls the API, so it doesn't need a key
+    return os.getenv("OPENAI_API_KEY") or ("replay" if llm_cache_mode() == "replay" else None)
+
+
+def retry_after(error):
+    """
+    Returns the delay in seconds the API asked for in the Retry-After headers of an error,
+    or None if it didn't.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header, scale in (("retry-after-ms", 1000), ("retry-after", 1)):
+        try:
+            return float(headers[header]) / scale
+        except (KeyError, TypeError, ValueError):
+            pass
+    return None
+
+
+def backoff_delay(attempt, delay=2, backoff=2, max_delay=60):
+    """
+    Returns a jittered delay before retry number attempt (from 0), spreading out the
+    retries of prompts that failed together.
+    """
+    return random.uniform(0, min(max_delay, delay * backoff**attempt))
+
+
 class ChatApp:
     MODEL_NAME = os.getenv("OPENAI_MODEL_NAME", "gpt-3.5-turbo")
-
-    def __init__(self, system_message=""):
+    # ask the API for responses obeying the JSON schema in enforce_json_response
+    STRUCTURED_OUTPUT = os.getenv("LLMFH_STRUCTURED_OUTPUT", "false").lower() in ("1", "true")
+    # models that rejected a structured output request
+    structured_output_unsupported = set()
+    # the (model, schema) pairs whose schema strict structured output rejected
+    structured_schema_unsupported = set()
+
+    def __init__(self, system_message="", history_policy=None):
         """
         Initialize the chat app.
         Args:
             system_message (str): The system message to start the conversation.
+            history_policy (dict, optional): How the conversation is kept from growing
+                without bound; see apply_history_policy.
         """
+        if history_policy and history_policy.get("type") not in HISTORY_POLICIES:
+            raise ValueError(f"History policy type must be one of {HISTORY_POLICIES}: {history_policy}")
+        self.history_policy = history_policy
+        # the tokens and time taken by each request
+        self.usage = []
         # Setting the API key to use the OpenAI API
         self.messages = [
             {"role": "system", "content": system_message},
         ]
         self.system_message = system_message
         self.responses = []
-        self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        # the LLM cache key of each response, so a rejected response can be removed from the cache
+        self._cache_keys = []
+        self.client = openai.OpenAI(api_key=api_key())
+        # chat apps in global results can be shared by plugins running in parallel
+        self._lock = threading.RLock()
+        self._init_async()
+
+    def _init_async(self):
+        # the async client of each event loop, and the loop chat_many runs on
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._loop = None
 
     def __getstate__(self):
         state = self.__dict__.copy()
         # Remove the unpickleable entries.
         state.pop('client', None)
+        state.pop('_lock', None)
+        state.pop('_async_clients', None)
+        state.pop('_loop', None)
         return state
 
     def __setstate__(self, state):
         # Restore instance attributes.
         self.__dict__.update(state)
+        self.__dict__.setdefault('_cache_keys', [None] * len(self.responses))
+        self.__dict__.setdefault('history_policy', None)
+        self.__dict__.setdefault('usage', [])
         # Recreate the client or set it to None, depending on your needs.
-        self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.client = openai.OpenAI(api_key=api_key())
+        self._lock = threading.RLock()
+        self._init_async()
 
     def chat(self, message, strip_quotes=False, tries=5, delay=2, backoff=2):
         @retry(
@@ -78,35 +334,395 @@ class ChatApp:
             Returns:
                 The assistant's response.
             """
+            with self._lock:
+                messages = self.messages + [{"role": "user", "content": message}]
+                try:
+                    response, cache_key = self._create(messages)
+                except Exception as e:
+                    logger.error(f"Error interacting with OpenAI API: {e}")
+                    raise e
+
+                return self._add_responses([response], strip_quotes, [cache_key])[0]
+
+        return chat(self, message, strip_quotes=strip_quotes)
+
+    def chat_stream(self, message, tries=5, delay=2, backoff=2):
+        """
+        Sends a message to the OpenAI API and yields the assistant's response in pieces as
+        they arrive. The full response is added to the conversation once it's complete.
+        As in achat, the message is sent after the conversation so far, which isn't locked
+        while the response streams, so a stream that's never finished doesn't block other
+        threads sharing the chat app.
+        Args:
+            message (str): The message to send.
+        Yields:
+            The pieces of the assistant's response.
+        """
+        with self._lock:
             messages = self.messages + [{"role": "user", "content": message}]
+        yield from self._chat_stream(messages, tries, delay, backoff)
+
+    def _chat_stream(self, messages, tries, delay, backoff):
+
+        start = time.perf_counter()
+        key, response = self._cached(messages)
+        if response is not None:
+            self._record_usage(None, time.perf_counter() - start, from_cache=True)
+            yield response.choices[0].message.content
+            self._add_responses([response], False, [key])
+            return
+
+        # only opening the stream is retried; a stream that fails part way raises
+        @retry(RETRY_ERRORS, tries=tries, delay=delay, backoff=backoff)
+        def create():
+            return self.client.chat.completions.create(
+                model=self.MODEL_NAME,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+
+        first_chunk, usage, finish_reason = None, None, "stop"
+        pieces = []
+        for chunk in create():
+            first_chunk = first_chunk or chunk
+            usage = chunk.usage or usage
+            for choice in chunk.choices:
+                if choice.delta.content:
+                    pieces.append(choice.delta.content)
+                    yield choice.delta.content
+                finish_reason = choice.finish_reason or finish_reason
+
+        # assemble the chunks into a completion, as chat would have received
+        response = ChatCompletion.model_validate(
+            {
+                "id": first_chunk.id if first_chunk else "",
+                "object": "chat.completion",
+                "created": first_chunk.created if first_chunk else 0,
+                "model": first_chunk.model if first_chunk else self.MODEL_NAME,
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": finish_reason,
+                        "message": {"role": "assistant", "content": "".join(pieces)},
+                    }
+                ],
+                "usage": usage.model_dump() if usage else None,
+            }
+        )
+        self._record_usage(response, time.perf_counter() - start)
+        if key is not None:
+            get_llm_cache().put(key, response)
+        self._add_responses([response], False, [key])
+
+    def _cache_key(self, messages, cache_tag=None, **params):
+        """
+        Returns the LLM cache key of a request, or None if the LLM cache is off. cache_tag
+        tells apart requests that are sampled again on purpose, without being sent to the API.
+        """
+        if get_llm_cache() is None:
+            return None
+        if cache_tag is not None:
+            params["cache_tag"] = cache_tag
+        return LLMCache.key(self.MODEL_NAME, messages, **params)
+
+    def _cached(self, messages, cache_tag=None, **params):
+        """
+        Returns the LLM cache key of a request and the completion cached for it, or None.
+        """
+        key = self._cache_key(messages, cache_tag, **params)
+        return key, get_llm_cache().get(key) if key is not None else None
+
+    def _create(self, messages, cache_tag=None, **params):
+        """
+        Sends messages to the OpenAI API, unless the LLM cache has the completion, and returns
+        the completion and its cache key.
+        """
+        start = time.perf_counter()
+        key, response = self._cached(messages, cache_tag, **params)
+        if response is not None:
+            self._record_usage(None, time.perf_counter() - start, from_cache=True)
+            return response, key
+        response = self.client.chat.completions.create(
+            model=self.MODEL_NAME, messages=messages, **params
+        )
+        self._record_usage(response, time.perf_counter() - start)
+        if key is not None:
+            get_llm_cache().put(key, response)
+        return response, key
+
+    def _record_usage(self, response, seconds, from_cache=False):
+        usage = getattr(response, "usage", None)
+        details = getattr(usage, "prompt_tokens_details", None)
+        record = {
+            "prompt_tokens": token_count(getattr(usage, "prompt_tokens", 0)),
+            "completion_tokens": token_count(getattr(usage, "completion_tokens", 0)),
+            "cached_tokens": token_count(getattr(details, "cached_tokens", 0)),
+            "seconds": seconds,
+            "from_cache": from_cache,
+        }
+        with self._lock:
+            self.usage.append(record)
+
+    def total_usage(self):
+        """
+        Returns the total tokens and time taken by the requests of this chat app, and the
+        number of requests, and of those answered by the LLM cache.
+        """
+        with self._lock:
+            usage = list(self.usage)
+        total = Counter(requests=len(usage), from_cache=sum(record["from_cache"] for record in usage))
+        for key in ("prompt_tokens", "completion_tokens", "cached_tokens", "seconds"):
+            total[key] = sum(record[key] for record in usage)
+        return total
+
+    def log_usage(self, name=""):
+        total = self.total_usage()
+        logger.info(
+            f"Chat app {name}: {total['requests']} requests ({total['from_cache']} from the LLM cache), "
+            f"{total['prompt_tokens']} prompt tokens ({total['cached_tokens']} cached), "
+            f"{total['completion_tokens']} completion tokens, {total['seconds']:.1f}s"
+        )
+
+    def _structured_chat(self, message, json_schema, tries=5, delay=2, backoff=2):
+        """
+        Sends a message to the OpenAI API asking for a response obeying a JSON schema, and
+        returns the parsed response. Raises openai.BadRequestError if the model doesn't
+        support structured output, and ValueError if the response isn't JSON, e.g. because
+        the model refused to answer.
+        """
+        response_format, wrapped = structured_response_format(json_schema)
+
+        @retry(STRUCTURED_RETRY_ERRORS, tries=tries, delay=delay, backoff=backoff)
+        def create(messages):
+            return self._create(messages, response_format=response_format)
+
+        with self._lock:
+            messages = self.messages + [{"role": "user", "content": message}]
+            response, cache_key = create(messages)
+            response_text = self._add_responses([response], False, [cache_key])[0]
+
+        if response_text is None:
+            raise ValueError(f"The model refused to respond: {response.choices[0].message.refusal}")
+        response_json = json.loads(response_text)
+        if wrapped and not (isinstance(response_json, dict) and "response" in response_json):
+            raise ValueError(f"The response isn't wrapped in a response property: {response_text}")
+        return response_json["response"] if wrapped else response_json
+
+    def _async_client(self):
+        """
+        Returns the async client of the running event loop, which is made once and reused, so
+        that every request made on the loop shares its connection pool.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                # retries are made by achat, honouring Retry-After, so the client doesn't retry too
+                client = openai.AsyncOpenAI(api_key=api_key(), max_retries=0)
+                self._async_clients[loop] = client
+        return client
+
+    def _run(self, coroutine):
+        """
+        Runs a coroutine on the chat app's event loop, which runs in its own thread for as long
+        as the chat app is used, so that its async client is reused by every call.
+        """
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True).start()
+            loop = self._loop
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    async def _acomplete(self, messages, client, tries=5, delay=2, backoff=2):
+        """
+        Sends messages to the OpenAI API, retrying with jittered backoff, or after the delay
+        the API asks for, and returns the response, unless the LLM cache has it.
+        """
+        start = time.perf_counter()
+        key, response = self._cached(messages)
+        if response is not None:
+            self._record_usage(None, time.perf_counter() - start, from_cache=True)
+            return response
+        for attempt in range(tries):
             try:
-                response = self.client.chat.completions.create(
+                response = await client.chat.completions.create(
                     model=self.MODEL_NAME, messages=messages
                 )
-            except Exception as e:
-                logger.error(f"Error interacting with OpenAI API: {e}")
-                raise e
+                self._record_usage(response, time.perf_counter() - start)
+                if key is not None:
+                    get_llm_cache().put(key, response)
+                return response
+            except RETRY_ERRORS as e:
+                if attempt == tries - 1:
+                    logger.error(f"Error interacting with OpenAI API: {e}")
+                    raise e
+                wait = retry_after(e)
+                if wait is None:
+                    wait = backoff_delay(attempt, delay, backoff)
+                logger.warning(f"Error interacting with OpenAI API: {e}. Retrying in {wait:.1f}s")
+                await asyncio.sleep(wait)
+
+    def _add_responses(self, responses, strip_quotes, cache_keys):
+        with self._lock:
+            self._cache_keys.extend(cache_keys)
+            for response in responses:
+                self.messages.append(
+                    {
+                        "role": "assistant",
+                        "content": response.choices[0].message.content,
+                    }
+                )
+                self.responses.append(response)
+            self.apply_history_policy()
+        response_texts = [response.choices[0].message.content for response in responses]
+        return [text.strip('"') for text in response_texts] if strip_quotes else response_texts
 
-            self.messages.append(
-                {
-                    "role": "assistant",
-                    "content": response.choices[0].message.content,
-                }
-            )
-            self.responses.append(response)
+    async def achat(self, message, strip_quotes=False, tries=5, delay=2, backoff=2):
+        """
+        Sends a message to the OpenAI API without blocking, and returns the assistant's response.
+        Args:
+            message (str): The message to send.
+            strip_quotes (bool): If true, strips quotes from the response.
+        Returns:
+            The assistant's response.
+        """
+        with self._lock:
+            messages = self.messages + [{"role": "user", "content": message}]
+        response = await self._acomplete(messages, self._async_client(), tries, delay, backoff)
+        return self._add_responses([response], strip_quotes, [self._cache_key(messages)])[0]
 
-            response_text = response.choices[0].message.content
-            return response_text.strip('"') if strip_quotes else response_text
+    async def achat_many(self, messages, strip_quotes=False, max_concurrency=None, tries=5, delay=2, backoff=2):
+        """
+        Sends independent messages to the OpenAI API concurrently, at most max_concurrency
+        (default LLMFH_CHAT_CONCURRENCY) at a time, over one connection pool.
 
-        return chat(self, message, strip_quotes=strip_quotes)
+        Each message is sent after the conversation so far, without the others' responses,
+        which are then added to the conversation in the order of the messages.
+        Args:
+            messages (list): The messages to send.
+            strip_quotes (bool): If true, strips quotes from the responses.
+            max_concurrency (int, optional): The maximum number of messages sent at once.
+        Returns:
+            The assistant's responses, in the order of the messages.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or CHAT_CONCURRENCY)
+        with self._lock:
+            conversation = list(self.messages)
+
+        requests = [conversation + [{"role": "user", "content": message}] for message in messages]
+
+        client = self._async_client()
+
+        async def complete(request):
+            async with semaphore:
+                return await self._acomplete(request, client, tries, delay, backoff)
+
+        responses = await asyncio.gather(*(complete(request) for request in requests))
+
+        cache_keys = [self._cache_key(request) for request in requests]
+        return self._add_responses(responses, strip_quotes, cache_keys)
+
+    def chat_many(self, messages, strip_quotes=False, max_concurrency=None, **kwargs):
+        """
+        Sends independent messages to the OpenAI API concurrently, and returns the assistant's
+        responses in the order of the messages; see achat_many.
+        """
+        return self._run(self.achat_many(messages, strip_quotes, max_concurrency, **kwargs))
+
+    def fork(self):
+        """
+        Returns a chat app that continues the conversation so far on its own, e.g. for one of
+        several tasks running in parallel, so that their turns aren't interleaved by timing.
+        The turns it takes are added to this conversation by join.
+        """
+        with self._lock:
+            fork = object.__new__(type(self))
+            fork.__dict__.update(self.__dict__)
+            fork.messages = list(self.messages)
+            fork.responses = []
+            fork._cache_keys = []
+            fork.usage = []
+            # the conversation is trimmed when the fork is joined
+            fork.history_policy = None
+            fork._lock = threading.RLock()
+            fork._init_async()
+            fork._fork_start = len(self.messages)
+        return fork
+
+    def join(self, fork):
+        """Adds the turns taken by a fork of this chat app to the conversation."""
+        with fork._lock:
+            messages = fork.messages[fork._fork_start:]
+            responses, cache_keys, usage = list(fork.responses), list(fork._cache_keys), list(fork.usage)
+        with self._lock:
+            self.messages.extend(messages)
+            self.responses.extend(responses)
+            self._cache_keys.extend(cache_keys)
+            self.usage.extend(usage)
+            self.apply_history_policy()
 
     def delete_last_message(self):
         """
         Deletes the last message from the conversation, except for the initial system message.
         """
-        if len(self.messages) > 1:
-            self.messages.pop()
-            self.responses.pop()
+        with self._lock:
+            if len(self.messages) > 1:
+                self.messages.pop()
+                # a summary of older messages, kept by the history policy, has no response
+                if self.responses:
+                    self.responses.pop()
+                # the response was rejected, so don't serve it from the LLM cache again
+                if self._cache_keys and (cache_key := self._cache_keys.pop()) is not None:
+                    get_llm_cache().delete(cache_key)
+
+    def apply_history_policy(self):
+        """
+        Trims the conversation according to the history policy, which is called after each
+        response is added. The system message is always kept. The policy types are:
+            pin: keep only the last last_n messages (default 10).
+            window: drop the oldest messages until the conversation is within max_tokens
+                (default 2000), estimated.
+            summarize: as window, but replace the dropped messages with a summary of them,
+                made by one more request.
+        """
+        policy = self.history_policy
+        if not policy:
+            return
+        with self._lock:
+            history = self.messages[1:]
+            if policy["type"] == "pin":
+                dropped = max(0, len(history) - policy.get("last_n", 10))
+            else:
+                max_tokens = policy.get("max_tokens", 2000)
+                dropped = 0
+                # the latest response is always kept
+                while dropped < len(history) - 1 and estimate_tokens(
+                    self.messages[:1] + history[dropped:]
+                ) > max_tokens:
+                    dropped += 1
+            if dropped == 0:
+                return
+
+            kept = history[dropped:]
+            logger.info(f"Dropping {dropped} messages from the conversation by its {policy['type']} history policy")
+            if policy["type"] == "summarize":
+                kept = [self._summarize(history[:dropped])] + kept
+            self.messages = self.messages[:1] + kept
+            # responses are only kept for the messages still in the conversation
+            self.responses = self.responses[max(0, len(self.responses) - len(kept)):]
+            self._cache_keys = self._cache_keys[max(0, len(self._cache_keys) - len(kept)):]
+
+    def _summarize(self, messages):
+        """Returns a message summarizing a list of messages."""
+        response, _ = self._create(
+            self.messages[:1] + messages + [{"role": "user", "content": HISTORY_SUMMARY_PROMPT}]
+        )
+        return {
+            "role": "system",
+            "content": f"Summary of the earlier conversation: {response.choices[0].message.content}",
+        }
 
     def reset_conversation(self):
         """
@@ -116,6 +732,7 @@ class ChatApp:
             {"role": "system", "content": self.system_message},
         ]
         self.responses = []
+        self._cache_keys = []
 
     def save_conversation(self, file_path):
         """
@@ -132,8 +749,73 @@ class ChatApp:
             raise
 
     def enforce_json_response(
-        self, message, json_schema, log_prompt=False, tries=5, delay=2, backoff=2
+        self, message, json_schema, log_prompt=False, tries=5, delay=2, backoff=2, structured=None
     ):
+        """
+        Sends a message to the OpenAI API and returns its response, parsed as JSON obeying
+        json_schema, retrying if it doesn't.
+
+        With structured output (structured, or LLMFH_STRUCTURED_OUTPUT), the API is asked for a
+        response obeying the schema. If the model doesn't support that, or otherwise, the schema
+        is added to the message and the JSON is extracted from the response.
+        """
+        if structured is None:
+            structured = self.STRUCTURED_OUTPUT
+        validator = get_validator(json_schema)
+
+        @retry(
+            (jsonschema.exceptions.ValidationError),
+            tries=tries,
+            delay=delay,
+            backoff=backoff,
+        )
+        def enforce_structured_response(self, message, json_schema):
+            if log_prompt:
+                logger.info(f"Prompting chat app for structured output with: {message}")
+
+            try:
+                response = drop_optional_nulls(self._structured_chat(message, json_schema), json_schema)
+            except ValueError as e:
+                # a refusal, or a response that isn't JSON, is retried like an invalid one
+                self.delete_last_message()
+                logger.warning(f"Response isn't valid JSON: {e}. Retrying...")
+                raise jsonschema.exceptions.ValidationError(str(e)) from e
+
+            if log_prompt:
+                logger.info(f"Chat app response: {response}")
+
+            try:
+                validator.validate(response)
+            except jsonschema.exceptions.ValidationError as e:
+                self.delete_last_message()
+                logger.warning(
+                    f"Response does not obey the provided JSON schema. Retrying..."
+                )
+                raise e
+
+            return response
+
+        schema_key = (self.MODEL_NAME, json.dumps(json_schema, sort_keys=True))
+        if (
+            structured
+            and self.MODEL_NAME not in self.structured_output_unsupported
+            and schema_key not in self.structured_schema_unsupported
+        ):
+            try:
+                return enforce_structured_response(self, message, json_schema)
+            except openai.BadRequestError as e:
+                rejected = structured_output_error(e)
+                if rejected == "model":
+                    logger.warning(
+                        f"Structured output isn't supported by {self.MODEL_NAME}, extracting JSON instead: {e}"
+                    )
+                    self.structured_output_unsupported.add(self.MODEL_NAME)
+                elif rejected == "schema":
+                    logger.warning(f"Structured output doesn't accept the schema, extracting JSON for it instead: {e}")
+                    self.structured_schema_unsupported.add(schema_key)
+                else:
+                    logger.warning(f"Structured output request failed, extracting JSON instead: {e}")
+
         @retry(
             (jsonschema.exceptions.ValidationError),
             tries=tries,
@@ -165,9 +847,7 @@ class ChatApp:
                     logger.warning(f"Extracted response: {extracted_response}")
 
             try:
-                jsonschema.validate(
-                    instance=json.loads(extracted_response), schema=json_schema
-                )
+                validator.validate(json.loads(extracted_response))
             except jsonschema.exceptions.ValidationError as e:
                 self.delete_last_message()
                 logger.warning(
@@ -211,32 +891,7 @@ class ChatApp:
             if log_prompt:
                 logger.info(f"Chat app response: {response}")
             try:
-                # Extract the response between triple single quotes, or backticks
-                match = re.search(r"'''(.*?)'''", response, re.DOTALL) or re.search(r"```(.*?)```", response, re.DOTALL)
-                if match:
-                    extracted_response = match.group(1).strip()
-
-                    # Try parsing as YAML
-                    try:
-                        response_as_list = yaml.safe_load(extracted_response)
-                    except yaml.YAMLError:
-                        # If that fails, try parsing as a bullet list
-                        response_as_list = [
-                            line.strip()[1:].strip()
-                            for line in extracted_response.split("\n")
-                            if line.strip().startswith("-")
-                        ]
-
-                    if isinstance(response_as_list, list):
-                        return response_as_list
-                    else:
-                        raise ValueError(
-                            "Extracted response could not be parsed as a list."
-                        )
-                else:
-                    raise ValueError(
-                        "No response was found between triple single quotes."
-                    )
+                return parse_list_response(response)
             except Exception as e:
                 if log_prompt:
                     logger.info(f"Chat app response: {response}")
@@ -247,6 +902,31 @@ class ChatApp:
 
         return enforce_list_response_inner(self, message, num_entries, list_format)
 
+    def sample_list_responses(self, message, num_samples, sample_round=0, tries=5, delay=2, backoff=2):
+        """
+        Sends a message once, asking the OpenAI API for num_samples independent completions
+        (its n parameter), and returns the lists parsed from them. Completions that can't be
+        parsed as a list are skipped. The conversation isn't changed.
+
+        Each round of sampling is cached separately by the LLM cache, so a cached round isn't
+        counted again as new samples.
+        """
+        @retry(RETRY_ERRORS, tries=tries, delay=delay, backoff=backoff)
+        def create(messages):
+            return self._create(messages, cache_tag=f"sample {sample_round}", n=num_samples)[0]
+
+        with self._lock:
+            messages = self.messages + [{"role": "user", "content": message}]
+        response = create(messages)
+
+        samples = []
+        for choice in response.choices:
+            try:
+                samples.append(parse_list_response(choice.message.content))
+            except ValueError as e:
+                logger.warning(f"Skipping a sample that could not be parsed as a list: {e}")
+        return samples
+
     def enforce_list_response_consensus(
         self,
         message,
@@ -258,38 +938,53 @@ class ChatApp:
         delay=2,
         backoff=2,
         reset_conversation=True,
+        num_samples=None,
+        max_rounds=10,
     ):
         """
-        Repeatedly calls enforce_list_response, stores the results,
-        and adds results to a consensus list until they reach num_consensus results
-        that have been seen at least twice. Then, sorts the consensus responses by their counts
-        in descending order and returns the top num_entries responses.
+        Samples lists of responses in rounds, num_samples independent lists per round from a
+        single request, and counts how often each response is seen, until num_entries
+        responses have been seen at least num_consensus times or max_rounds rounds have been
+        made. Then, sorts the consensus responses by their counts in descending order and
+        returns the top num_entries responses.
         Args:
             message (str): The message to send.
             num_entries (int): The number of entries to request in the list.
-            num_consensus (int): The number of unique responses to reach a consensus.
+            num_consensus (int): The number of times a response must be seen to reach a consensus.
             list_format (str): The string to add to the message to ask for a list.
+            num_samples (int, optional): The number of lists sampled per round; defaults to
+                num_consensus.
+            max_rounds (int, optional): The maximum number of rounds; if they run out, fewer
+                than num_entries responses are returned.
         Returns:
             The consensus list of responses.
         """
-        all_responses = []
+        if reset_conversation:
+            self.reset_conversation()
 
-        while True:
-            if reset_conversation:
-                self.reset_conversation()
+        injected_message = f"{message}\n{list_format.format(num_entries)}"
+        if log_prompt:
+            logger.info(f"Prompting chat app with: {injected_message}")
 
-            response = self.enforce_list_response(
-                message, num_entries, list_format, log_prompt, tries, delay, backoff
-            )
-            all_responses.extend(response)
+        response_counts = Counter()
+        consensus_responses = []
+        for i in range(max_rounds):
+            for sample in self.sample_list_responses(
+                injected_message, num_samples or max(num_consensus, 1), i, tries, delay, backoff
+            ):
+                response_counts.update(sample)
 
-            response_counts = Counter(all_responses)
             consensus_responses = [
                 item for item, count in response_counts.items() if count >= num_consensus
             ]
-
+            if log_prompt:
+                logger.info(f"Round {i + 1}: {len(consensus_responses)} consensus responses")
             if len(consensus_responses) >= num_entries:
                 break
+        else:
+            logger.warning(
+                f"Only {len(consensus_responses)} of {num_entries} responses reached a consensus in {max_rounds} rounds"
+            )
 
         if reset_conversation:
             self.reset_conversation()
@@ -300,7 +995,6 @@ class ChatApp:
         )
         return sorted_responses[:num_entries]
 
-
 if __name__ == "__main__":
     import sys
 
@@ -16,8 +16,10 @@ class GuestSelection:
         self.plugin_instance_name = plugin_instance_name
 
     def add_to_queue(self, sq, n, prompt):
-        # x = self.chat_app.enforce_list_response_consensus(prompt, n, log_prompt=True)
-        x = self.chat_app.enforce_list_response(prompt, n, log_prompt=True)
+        if self.params.get("consensus", False):
+            x = self.chat_app.enforce_list_response_consensus(prompt, n, log_prompt=True)
+        else:
+            x = self.chat_app.enforce_list_response(prompt, n, log_prompt=True)
         sq.enqueue(x)
 
     def get_params(self, guest_category):
@@ -59,7 +61,11 @@ class GuestSelection:
             ) = self.get_params(guest_category)
 
             # ensure SupaQueue is initialized
-            supaqs[name] = SupaQueue(queue_name=f"{is_production_prefix()}{name}")
+            supaqs[name] = SupaQueue(
+                queue_name=f"{is_production_prefix()}{name}",
+                shared=self.params.get("shared_queues", False),
+                claim_timeout_hours=self.params.get("queue_claim_timeout_hours", 6),
+            )
 
             # make sure queue contains enough elements
             if (q_len := supaqs[name].length()) < select_n:
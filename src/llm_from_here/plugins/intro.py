@@ -62,8 +62,9 @@ def match_categories(guest_list, standard_categories):
 
 def set_guests(guests, guest_set):
     guests=list(set(guests))
+    added = {guest.lower() for guest in guest_set.add_many(guests)}
     for guest in guests:
-        if not guest_set.add(guest):
+        if guest.lower() not in added:
             logger.warning(f"Guest {guest} already exists in supaset. Maybe retrying...")
             raise ValidationError(f"Guest {guest} already exists in supaset. Maybe retrying...")
         
@@ -78,13 +79,14 @@ def add_guests_to_prompt(prompt, guest_set):
 
 class Intro:
     def __init__(self, params, global_params, plugin_instance_name, chat_app=None):
-        self.chat_app = chat_app or gpt.ChatApp(params['system_message'])
+        self.chat_app = chat_app or gpt.ChatApp(params['system_message'], history_policy=params.get('history_policy'))
         self.params = params
         self.global_params = global_params
         self.plugin_instance_name = plugin_instance_name
         supaset_name = f'{is_production_prefix()}guests_set'
         self.guests_set = SupaSet(supaset_name,
-                                          autoexpire = params.get('guests_supaset_autoexpire_days', 90))
+                                          autoexpire = params.get('guests_supaset_autoexpire_days', 90),
+                                          local_cache = params.get('guests_supaset_local_cache', True))
 
         self.validate_required_params()
         
@@ -125,13 +127,11 @@ class Intro:
                 raise Exception(f"Required parameter {required_param} not found in params.")
 
     def get_extra_prompt_responses(self):
-        extra_prompts = self.params.get('extra_prompts', [{}])
-        extra_prompt_responses = {}
-        for prompt in extra_prompts:
-            logger.info(f"Running extra_prompt: {prompt}")
-            extra_prompt_responses[prompt['name']] = self.chat_app.chat(prompt['prompt'])
-            logger.info(f"Extra prompt response: {extra_prompt_responses[prompt['name']]}")
-        return extra_prompt_responses
+        return gpt.chat_named_prompts(
+            self.chat_app,
+            self.params.get('extra_prompts', [{}]),
+            concurrent=self.params.get('concurrent_extra_prompts', False),
+        )
 
     def normalize_guest_categories(self):
         """
@@ -18,7 +18,7 @@ def render_template(template_string, **kwargs):
 
 class IntroFromGuestlist:
     def __init__(self, params, global_params, plugin_instance_name, chat_app=None):
-        self.chat_app = chat_app or gpt.ChatApp(params['system_message'])
+        self.chat_app = chat_app or gpt.ChatApp(params['system_message'], history_policy=params.get('history_policy'))
         self.params = params
         self.global_params = global_params
         self.plugin_instance_name = plugin_instance_name
@@ -68,13 +68,11 @@ class IntroFromGuestlist:
                 raise Exception(f"Required parameter {required_param} not found in params.")
             
     def get_extra_prompt_responses(self):
-        extra_prompts = self.params.get('extra_prompts', [{}])
-        extra_prompt_responses = {}
-        for prompt in extra_prompts:
-            logger.info(f"Running extra_prompt: {prompt}")
-            extra_prompt_responses[prompt['name']] = self.chat_app.chat(prompt['prompt'])
-            logger.info(f"Extra prompt response: {extra_prompt_responses[prompt['name']]}")
-        return extra_prompt_responses
+        return gpt.chat_named_prompts(
+            self.chat_app,
+            self.params.get('extra_prompts', [{}]),
+            concurrent=self.params.get('concurrent_extra_prompts', False),
+        )
 
     def execute(self):
 
@@ -1,6 +1,8 @@
 
 import logging
+import threading
 from llm_from_here.plugins.gpt import ChatApp
+from llm_from_here.segmentStream import SegmentStream, StreamedScript
 import re
 import yaml
 import fnmatch
@@ -10,7 +12,7 @@ logger = logging.getLogger(__name__)
 
 class PromptToSegment:
     def __init__(self, params, global_params, plugin_instance_name):
-        self.chat_app =  ChatApp(params.get('system_message', ''))
+        self.chat_app =  ChatApp(params.get('system_message', ''), history_policy=params.get('history_policy'))
         self.params = params
         self.global_params = global_params
         self.plugin_instance_name = plugin_instance_name
@@ -22,6 +24,13 @@ class PromptToSegment:
         self.character_numbers = {}
 
         self.validate_required_params()
+
+        if self.streaming():
+            # the script is written and parsed from execute, and the segments consumed meanwhile
+            self.is_dialog = self.params.get('is_dialog', False)
+            self.segments = SegmentStream()
+            return
+
         self.process_prompts()
         
         if self.params.get('script_variable', None):
@@ -71,50 +80,55 @@ class PromptToSegment:
         Take Background sound cue and convert them to "background" segments.
         """
         self.segments = []
-        char_line_pattern = r'^([A-Za-z0-9\s]+):\s*(.*)$'
-        
         for line in self.script.splitlines():
-            if line.strip() == "":
-                continue
-            if line.lower().startswith('[background'):
-                result = re.sub(r'\[background:', '', line, flags=re.IGNORECASE)
-                result = re.sub(r'\]', '', result)
-                segment = {
-                    'speaker': 'background',
-                    'dialog': result
-                }
-                self.segments.append(segment)
-            elif start:= self.get_sound_effect(line):
-                segment = {
-                    'speaker': 'sound effect',
-                    'dialog': start
-                }
-                self.segments.append(segment)
-            elif match := re.match(char_line_pattern, line, flags=re.IGNORECASE):
-                character_name = match.group(1)
-                dialog = match.group(2)
-                if self.filter_character_name(character_name):
-                    logger.info(f"Filtering character name: {character_name}")
-                    continue
-                segment = {
-                    'speaker': 'character ' + str(self.get_character_number(character_name)),
-                    'dialog': dialog,
-                    'character_name': character_name,
-                }
-                self.segments.append(segment)
-            elif self.is_dialog:
-                segment = {
-                    'speaker': 'character ' + str(self.get_character_number('narrator')),
-                    'dialog': line,
-                    'character_name': 'narrator',
-                }
-                self.segments.append(segment)
-            else:
-                logger.warning(f"Ignoring line; Could not parse line: {line}")
+            self.segments += self.segments_from_line(line, filter_empty_dialog)
+
+    def segments_from_line(self, line, filter_empty_dialog=True):
+        """
+        Convert one line of a script to segments, so that a script can be converted line by
+        line as it's written.
+        """
+        char_line_pattern = r'^([A-Za-z0-9\s]+):\s*(.*)$'
+
+        if line.strip() == "":
+            return []
+        if line.lower().startswith('[background'):
+            result = re.sub(r'\[background:', '', line, flags=re.IGNORECASE)
+            result = re.sub(r'\]', '', result)
+            segment = {
+                'speaker': 'background',
+                'dialog': result
+            }
+        elif start:= self.get_sound_effect(line):
+            segment = {
+                'speaker': 'sound effect',
+                'dialog': start
+            }
+        elif match := re.match(char_line_pattern, line, flags=re.IGNORECASE):
+            character_name = match.group(1)
+            dialog = match.group(2)
+            if self.filter_character_name(character_name):
+                logger.info(f"Filtering character name: {character_name}")
+                return []
+            segment = {
+                'speaker': 'character ' + str(self.get_character_number(character_name)),
+                'dialog': dialog,
+                'character_name': character_name,
+            }
+        elif self.is_dialog:
+            segment = {
+                'speaker': 'character ' + str(self.get_character_number('narrator')),
+                'dialog': line,
+                'character_name': 'narrator',
+            }
+        else:
+            logger.warning(f"Ignoring line; Could not parse line: {line}")
+            return []
+
+        if filter_empty_dialog and segment['dialog'].strip() == "":
+            return []
+        return [segment]
 
-        if filter_empty_dialog:
-            self.segments = [segment for segment in self.segments if segment['dialog'].strip() != ""]
-                
     def split_dialog(self, dialog):
         """
         Split dialog into segments based on [APPLAUSE ...] cues
@@ -145,32 +159,89 @@ class PromptToSegment:
                 raise Exception(f"Required parameter {required_param} not found in params.")
 
 
+    def streaming(self):
+        """
+        Returns whether the script is streamed: with stream set, if the script is written by
+        the prompts and converted to segments.
+        """
+        return (self.params.get('stream', False)
+                and not self.params.get('script_variable', None)
+                and self.params.get('convert_script_to_segments', True))
+
+    def stream_prompts(self):
+        """
+        Run the prompts like process_prompts, streaming the responses of accumulated prompts
+        and adding the segments of each script line to the segment stream as soon as the line
+        is complete.
+        """
+        try:
+            for prompt in self.params.get('prompts', []):
+                prompt_text = prompt.get('prompt', None)
+                prompt_js = prompt.get('prompt_js', None)
+                accumulate = prompt.get('accumulate', False)
+
+                if prompt_js:
+                    # segments accumulated from JSON are replaced by the script's, as in
+                    # convert_script_to_segments, so only the conversation is kept
+                    response = self.chat_app.enforce_json_response(prompt_text, prompt_js, log_prompt=True)
+                    logger.info(f"Prompt response: {response}")
+                    continue
+                if not accumulate:
+                    self.process_prompt(prompt)
+                    continue
+
+                logger.info(f"Streaming prompt: {prompt_text}")
+                self.script += "\n"
+                line = ""
+                for text in self.chat_app.chat_stream(prompt_text):
+                    self.script += text
+                    *lines, line = (line + text).split("\n")
+                    for complete_line in lines:
+                        self.segments.extend(self.segments_from_line(complete_line))
+                self.segments.extend(self.segments_from_line(line))
+                logger.info(f"Prompt response: {self.script}")
+
+            if self.script.strip() == "":
+                raise Exception("Script is empty. Cannot convert to segments.")
+            self.segments.script = self.script
+            self.segments.close()
+            logger.info(f"Segments: {yaml.dump(self.segments.wait())}")
+        except Exception as e:
+            logger.exception(f"Streaming prompts failed: {e}")
+            self.segments.close(error=e)
+
+    def process_prompt(self, prompt):
+        prompt_text = prompt.get('prompt', None)
+        prompt_js = prompt.get('prompt_js', None)
+        accumulate = prompt.get('accumulate', False)
+
+        if prompt_js:
+            response = self.chat_app.enforce_json_response(
+                prompt_text,
+                prompt_js,
+                log_prompt=True)
+            if accumulate:
+                self.segments += response
+        else:
+            logger.info(f"Running prompt: {prompt_text}")
+            response=self.chat_app.chat(prompt_text)
+            if accumulate:
+                self.script += "\n" + response
+
+        logger.info(f"Prompt response: {response}")
+
     def process_prompts(self):
 
         for prompt in self.params.get('prompts', []):
-            prompt_text = prompt.get('prompt', None)
-            prompt_js = prompt.get('prompt_js', None)
-            accumulate = prompt.get('accumulate', False)
-            
-            if prompt_js:
-                response = self.chat_app.enforce_json_response(
-                    prompt_text,
-                    prompt_js,
-                    log_prompt=True)
-                if accumulate:
-                    self.segments += response
-            else:
-                logger.info(f"Running prompt: {prompt_text}")
-                response=self.chat_app.chat(prompt_text)
-                if accumulate:
-                    self.script += "\n" + response
-                
-            logger.info(f"Prompt response: {response}")
+            self.process_prompt(prompt)
 
         
     def execute(self):
+        # while streaming, the script is complete once the segment stream is
+        if self.streaming():
+            threading.Thread(target=self.stream_prompts, daemon=True).start()
         return {
             "chat_app": self.chat_app,
             "segments": self.segments,
-            "script": self.script
+            "script": StreamedScript(self.segments) if self.streaming() else self.script
         }
@@ -7,6 +7,7 @@ import shutil
 from llm_from_here.plugins.applause import generate_applause
 import llm_from_here.plugins.freesoundfetch as freesoundfetch
 import llm_from_here.plugins.ytfetch as ytfetch
+from llm_from_here.artifactStore import replace_on_write
 
 import logging
 logger = logging.getLogger(__name__)
@@ -33,7 +34,8 @@ class SegmentAudio():
         applause_segement = generate_applause(duration, 2000, 4000, 500)
 
         # Export to a new file
-        applause_segement.export(output_file, format="wav")
+        with replace_on_write(output_file) as path:
+            applause_segement.export(path, format="wav")
 
     def music_generator_freesound(self, text, output_file,
                                   additional_query_text="",
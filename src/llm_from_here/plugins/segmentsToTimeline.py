@@ -2,16 +2,39 @@ import llm_from_here.plugins.showTTS as showTTS
 import os
 import re
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from llm_from_here.plugins.applause import generate_applause
 import llm_from_here.plugins.freesoundfetch as freesoundfetch
 import llm_from_here.plugins.ytfetch as ytfetch
 import llm_from_here.plugins.audioTimeline as audioTimeline
+from llm_from_here.artifactStore import replace_on_write
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+# the provider each asset function calls, which bounds how many can run at once
+FUNCTION_PROVIDERS = {
+    "fast_TTS": "fast_tts",
+    "slow_TTS": "slow_tts",
+    "youtube_search": "youtube",
+    "youtube_playlist": "youtube",
+    "music_generator_freesound": "freesound",
+    "applause_generator": "applause",
+}
+# the freesound and youtube fetchers keep per-download state, so those are serialized unless
+# provider_concurrency says otherwise
+DEFAULT_PROVIDER_CONCURRENCY = {
+    "fast_tts": 4,
+    "slow_tts": 4,
+    "youtube": 1,
+    "freesound": 1,
+    "applause": 4,
+    "chat": 1,
+}
+
 
 class SegmentsToTimeline:
     def __init__(self, params, global_results, plugin_instance_name):
@@ -26,6 +49,10 @@ class SegmentsToTimeline:
         self.global_results = global_results
         self.params = params
         self.plugin_instance_name = plugin_instance_name
+        self._lock = threading.RLock()
+        self._provider_limits = {}
+        # the chat app of the job running in each thread
+        self._job_state = threading.local()
 
         # check if a timeline already exists
         timeline_variable = params.get("timeline_variable", None)
@@ -50,9 +77,9 @@ class SegmentsToTimeline:
         applause_segment = generate_applause(duration, 2000, 4000, 500)
 
         # Export to a new file
-        with open(output_file, "wb") as f:
+        with replace_on_write(output_file) as path, open(path, "wb") as f:
             applause_segment.export(f, format="wav")
-            return True
+        return True
 
     def music_generator_freesound(
         self,
@@ -83,8 +110,9 @@ class SegmentsToTimeline:
         return True
 
     def tts(self, text, output_file, fast_tts=True):
-        if self.show_tts is None:
-            self.show_tts = showTTS.ShowTextToSpeech()
+        with self._lock:
+            if self.show_tts is None:
+                self.show_tts = showTTS.ShowTextToSpeech()
         # filter out any text in brackets, parantheses
         text_filtered = re.sub(r"\[.*?\]", "", text)
         text_filtered = re.sub(r"\(.*?\)", "", text_filtered)
@@ -110,8 +138,9 @@ class SegmentsToTimeline:
         return self.tts(text, output_file, fast_tts=False)
         
     def init_ytfetch(self, **kwargs):
-        if self.yt_fetch is None:
-            self.yt_fetch = ytfetch.YtFetch(**kwargs)
+        with self._lock:
+            if self.yt_fetch is None:
+                self.yt_fetch = ytfetch.YtFetch(**kwargs)
 
     def youtube_search(self, text, output_file, **kwargs):
         self.init_ytfetch(**kwargs)
@@ -119,7 +148,7 @@ class SegmentsToTimeline:
 
         query = f"{text} {additional_query_text}"
         logger.info(f"Retreiving youtube audio with query: {query}")
-        kwargs["chat_app"] = self.chat_app_object
+        kwargs["chat_app"] = self.chat_app()
 
         res = self.yt_fetch.search_and_download_audio_with_duration(
             query, output_file, **kwargs
@@ -200,13 +229,43 @@ class SegmentsToTimeline:
             logger.info(f"Data is now: {data}")
         return data
 
-    def generate_audio_segments(self):
+    def _provider(self, function_name, function_arguments=None):
+        """Return the provider whose concurrency limit applies to an asset function."""
+        if function_name == "tts":
+            fast_tts = (function_arguments or {}).get("fast_tts", True)
+            return "fast_tts" if fast_tts else "slow_tts"
+        return FUNCTION_PROVIDERS.get(function_name, function_name)
+
+    def _limit(self, provider):
+        """Return the semaphore bounding concurrent calls to a provider."""
+        with self._lock:
+            if provider not in self._provider_limits:
+                concurrency = {
+                    **DEFAULT_PROVIDER_CONCURRENCY,
+                    **self.params.get("provider_concurrency", {}),
+                }
+                self._provider_limits[provider] = threading.BoundedSemaphore(
+                    concurrency.get(provider, 1)
+                )
+            return self._provider_limits[provider]
+
+    def plan_segments(self):
+        """
+        Return a job for each entry that produces audio, in timeline order, holding the
+        function to call and where to write its output.
+        """
+        return list(self.iter_jobs())
+
+    def iter_jobs(self):
+        """
+        Yield the jobs of plan_segments one at a time, so that a job can start as soon as
+        its entry is available, e.g. from a segment stream.
+        """
         output_folder = self.global_results["output_folder"]
         type_key = self.params.get("segment_type_key", "speaker")
         value_key = self.params.get("segment_value_key", "dialog")
         single_background = self.params.get("single_background", False)
         segment_type_map = self.params.get("segment_type_map", {})
-        segment_transition_map = self.params.get("segment_transition_map", {})
 
         background_seen = False
         for i, entry in enumerate(self.get_data(type_key, value_key)):
@@ -227,9 +286,6 @@ class SegmentsToTimeline:
                 )
                 segment_type = "default"
 
-            function_name = segment_type_map[segment_type].get("segment_type")
-            function_arguments = segment_type_map[segment_type].get("arguments", {})
-
             # only allow one background music segment, if enabled
             background_music = segment_type_map[segment_type].get(
                 "background_music", False
@@ -242,94 +298,180 @@ class SegmentsToTimeline:
             else:
                 background_seen = True
 
-            # Call the specified function
-            logger.info(
-                f"Generating audio for type: {entry[type_key]} using function {function_name} with value: {entry[value_key]} and arguments {function_arguments}"
-            )
-            res = getattr(self, function_name)(
-                entry[value_key], file_path, **function_arguments
-            )
-
-            if res is None:
-                logger.info(f"No audio generated for type: {entry[type_key]}")
-                continue  # None indicates no audio was generated
+            yield {
+                "index": i,
+                "type": entry[type_key],
+                "value": entry[value_key],
+                "segment_type": segment_type_map[segment_type],
+                "file_path": file_path,
+                "filename_prefix": filename_prefix,
+                "background_music": background_music,
+            }
+
+    def chat_app(self):
+        """Return the chat app of the job running in this thread, or the shared one."""
+        return getattr(self._job_state, "chat_app", None) or self.chat_app_object
+
+    def generate_segment_assets(self, job):
+        """
+        Generate the audio files for a job: the segment itself and, if enabled, its spoken
+        intro and applause. Returns None if no audio was generated for the segment.
+
+        The job's chats are sent on its chat_app, if it has one.
+        """
+        self._job_state.chat_app = job.get("chat_app")
+        try:
+            return self._generate_segment_assets(job)
+        finally:
+            self._job_state.chat_app = None
+
+    def _generate_segment_assets(self, job):
+        output_folder = self.global_results["output_folder"]
+        segment_type = job["segment_type"]
+        function_name = segment_type.get("segment_type")
+        function_arguments = segment_type.get("arguments", {})
 
-            title = (
-                res.get("title", None)
-                if res is not None and type(res) == dict
-                else None
+        # Call the specified function
+        logger.info(
+            f"Generating audio for type: {job['type']} using function {function_name} with value: {job['value']} and arguments {function_arguments}"
+        )
+        with self._limit(self._provider(function_name, function_arguments)):
+            res = getattr(self, function_name)(
+                job["value"], job["file_path"], **function_arguments
             )
 
-            # generate applause, if enabled for this segment
-            if (
-                segment_type_map[segment_type].get("intro_name", False)
-                and res is not None
-            ):
-                if title:
-                    intro_file_name = filename_prefix + "_intro_name.wav"
-                    intro_file_path = os.path.join(output_folder, intro_file_name)
-                    prompt = segment_type_map[segment_type].get("intro_prompt", None)
-                    if prompt and self.chat_app_object:
-                        intro_prompt = prompt + entry[value_key] + ":::" + title
-                        logger.info(f"Prompting chat app with: {intro_prompt}")
-                        intro_text = self.chat_app_object.chat(
-                            intro_prompt, strip_quotes=True
-                        )
-                    else:
-                        intro_text = "Ladies and gentlemen... {intro_text}"
-                    
-                    fast_tts = segment_type_map[segment_type].get("fast_tts", True)
-                    self.tts(intro_text, intro_file_path, fast_tts=fast_tts)
-
-                    # get transition map entry, if it exists
-                    afp_kwargs = self.get_transition_map_entry(
-                        segment_transition_map, "intro_name"
-                    )
-                    self.timeline.add_after_previous(
-                        intro_file_path,
-                        label=audioTimeline.SegmentLabel.FOREGROUND,
-                        name=f"intro_name_{i}",
-                        type="intro_name",
-                        **afp_kwargs,
+        if res is None:
+            logger.info(f"No audio generated for type: {job['type']}")
+            return None  # None indicates no audio was generated
+
+        assets = {
+            "res": res,
+            "title": res.get("title", None) if type(res) == dict else None,
+            "intro_file_path": None,
+            "applause_file_path": None,
+        }
+
+        # generate the intro name, if enabled for this segment
+        if segment_type.get("intro_name", False) and assets["title"]:
+            intro_file_name = job["filename_prefix"] + "_intro_name.wav"
+            intro_file_path = os.path.join(output_folder, intro_file_name)
+            prompt = segment_type.get("intro_prompt", None)
+            if prompt and self.chat_app():
+                intro_prompt = prompt + job["value"] + ":::" + assets["title"]
+                logger.info(f"Prompting chat app with: {intro_prompt}")
+                with self._limit("chat"):
+                    intro_text = self.chat_app().chat(
+                        intro_prompt, strip_quotes=True
                     )
-                    logger.info(f"Generated intro name for: {intro_text}")
-
-            # generate applause, if enabled for this segment
-            if segment_type_map[segment_type].get("intro_applause", False):
-                applause_file_name = filename_prefix + "_intro_applause.wav"
-                applause_file_path = os.path.join(output_folder, applause_file_name)
+            else:
+                intro_text = "Ladies and gentlemen... {intro_text}"
+
+            fast_tts = segment_type.get("fast_tts", True)
+            with self._limit(self._provider("tts", {"fast_tts": fast_tts})):
+                self.tts(intro_text, intro_file_path, fast_tts=fast_tts)
+            assets["intro_file_path"] = intro_file_path
+            logger.info(f"Generated intro name for: {intro_text}")
+
+        # generate applause, if enabled for this segment
+        if segment_type.get("intro_applause", False):
+            applause_file_name = job["filename_prefix"] + "_intro_applause.wav"
+            applause_file_path = os.path.join(output_folder, applause_file_name)
+            with self._limit(self._provider("applause_generator")):
                 self.applause_generator("duration 3", applause_file_path)
+            assets["applause_file_path"] = applause_file_path
+            logger.info(f"Generated applause")
 
-                afp_kwargs = self.get_transition_map_entry(
-                    segment_transition_map, "intro_applause"
-                )
-                self.timeline.add_after_previous(
-                    applause_file_path,
-                    label=audioTimeline.SegmentLabel.FOREGROUND,
-                    name=f"intro_applause_{i}",
-                    type="intro_applause",
-                    **afp_kwargs,
-                )
-                logger.info(f"Generated applause")
+        return assets
+
+    def add_segment_to_timeline(self, job, assets):
+        """Add a job's generated audio files to the end of the timeline."""
+        segment_transition_map = self.params.get("segment_transition_map", {})
+        i = job["index"]
 
-            # append the entry to the timeline
+        if assets["intro_file_path"]:
+            # get transition map entry, if it exists
             afp_kwargs = self.get_transition_map_entry(
-                segment_transition_map, entry[type_key]
+                segment_transition_map, "intro_name"
             )
-            logger.info(
-                f"Adding {entry[type_key]} to timeline as label {audioTimeline.SegmentLabel.BACKGROUND if background_music else audioTimeline.SegmentLabel.FOREGROUND} and args {afp_kwargs}"
+            self.timeline.add_after_previous(
+                assets["intro_file_path"],
+                label=audioTimeline.SegmentLabel.FOREGROUND,
+                name=f"intro_name_{i}",
+                type="intro_name",
+                **afp_kwargs,
+            )
+
+        if assets["applause_file_path"]:
+            afp_kwargs = self.get_transition_map_entry(
+                segment_transition_map, "intro_applause"
             )
             self.timeline.add_after_previous(
-                file_path,
-                label=audioTimeline.SegmentLabel.BACKGROUND
-                if background_music
-                else audioTimeline.SegmentLabel.FOREGROUND,
-                #  name=f'{entry[type_key]}_{i}',
-                name=title if title else f"{entry[type_key]}_{i}",
-                type=entry[type_key],
+                assets["applause_file_path"],
+                label=audioTimeline.SegmentLabel.FOREGROUND,
+                name=f"intro_applause_{i}",
+                type="intro_applause",
                 **afp_kwargs,
             )
 
+        # append the entry to the timeline
+        afp_kwargs = self.get_transition_map_entry(
+            segment_transition_map, job["type"]
+        )
+        label = (
+            audioTimeline.SegmentLabel.BACKGROUND
+            if job["background_music"]
+            else audioTimeline.SegmentLabel.FOREGROUND
+        )
+        logger.info(
+            f"Adding {job['type']} to timeline as label {label} and args {afp_kwargs}"
+        )
+        title = assets["title"]
+        self.timeline.add_after_previous(
+            job["file_path"],
+            label=label,
+            #  name=f'{entry[type_key]}_{i}',
+            name=title if title else f"{job['type']}_{i}",
+            type=job["type"],
+            **afp_kwargs,
+        )
+
+    def generate_audio_segments(self):
+        """
+        Generate the audio for each segment and add it to the timeline in order.
+
+        With parallel_assets set, every segment's audio files are generated first on a pool of
+        asset_workers threads, with at most provider_concurrency[provider] calls to each
+        provider at once, and the timeline is then assembled in the original order.
+
+        Jobs start as their segments become available, so segments streamed from a script
+        are voiced while the rest of the script is still being written.
+
+        Each parallel job chats on its own fork of the chat app, whose turns are joined to the
+        conversation in segment order, so the conversation doesn't depend on thread timing.
+        """
+        if not self.params.get("parallel_assets", False):
+            for job in self.iter_jobs():
+                assets = self.generate_segment_assets(job)
+                if assets is not None:
+                    self.add_segment_to_timeline(job, assets)
+            return
+
+        max_workers = self.params.get("asset_workers", 8)
+        logger.info(f"Generating assets with {max_workers} workers")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            jobs, futures = [], []
+            for job in self.iter_jobs():
+                if self.chat_app_object is not None:
+                    job["chat_app"] = self.chat_app_object.fork()
+                jobs.append(job)
+                futures.append(executor.submit(self.generate_segment_assets, job))
+            for job, future in zip(jobs, futures):
+                assets = future.result()
+                if "chat_app" in job:
+                    self.chat_app_object.join(job["chat_app"])
+                if assets is not None:
+                    self.add_segment_to_timeline(job, assets)
+
     def execute(self):
         data = self.global_results.get(self.params.get("segments_object"))
         self.generate_audio_segments()
@@ -341,5 +483,7 @@ class SegmentsToTimeline:
 
     def finalize(self):
         logger.info(f"Finalizing {self.__class__.__name__}")
+        if self.show_tts is not None:
+            self.show_tts.cache.log_stats()
         if self.yt_fetch is not None:
             self.yt_fetch.finalize()
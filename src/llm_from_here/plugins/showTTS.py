@@ -1,5 +1,8 @@
+import io
 import numpy as np
 import re
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 
 # from bark.generation import (
 #     generate_text_semantic,
@@ -10,7 +13,9 @@ import re
 from scipy.io.wavfile import write as write_wav
 from gtts import gTTS
 from pydub import AudioSegment
-from pydub.silence import detect_nonsilent
+
+from llm_from_here.sound.silence import silence_bounds_array, trim_silence
+from llm_from_here.artifactStore import ArtifactStore, get_artifact_store
 
 import os
 import dotenv
@@ -21,6 +26,19 @@ logger = logging.getLogger(__name__)
 
 dotenv.load_dotenv()
 
+GTTS_LANG = "en"
+OPENAI_TTS_VOICE = "echo"
+# the maximum size of the stored speech, 1 GB by default
+TTS_CACHE_MAX_BYTES = int(os.getenv("LLMFH_TTS_CACHE_MAX_BYTES", 1 << 30))
+# OpenAI's limit on the input of a speech request
+OPENAI_TTS_MAX_CHARS = 4096
+# with LLMFH_TTS_CHUNK_CHARS set, longer text is split into chunks of whole sentences of up
+# to that many characters, synthesized LLMFH_TTS_CHUNK_WORKERS at a time
+TTS_CHUNK_CHARS = int(os.getenv("LLMFH_TTS_CHUNK_CHARS", 0))
+TTS_CHUNK_WORKERS = int(os.getenv("LLMFH_TTS_CHUNK_WORKERS", 4))
+# the pause between joined chunks, in ms
+TTS_CHUNK_PAUSE_MS = 300
+
 
 def split_sentences(text):
     # Define the pattern for sentence splitting
@@ -32,32 +50,40 @@ def split_sentences(text):
     return sentences
 
 
-def trim_silence_np_array(audio_array, sample_rate):
-    # Convert numpy array to audio segment
-    audio_segment = AudioSegment(
-        audio_array.tobytes(),
-        frame_rate=sample_rate,
-        sample_width=audio_array.dtype.itemsize,
-        channels=1,
-    )
+def chunk_sentences(text, max_chars):
+    # Group sentences into chunks of up to max_chars, splitting longer sentences on words
+    chunks = []
+    current = ""
+    for sentence in split_sentences(text):
+        while len(sentence) > max_chars:
+            split_at = sentence.rfind(" ", 0, max_chars)
+            split_at = split_at if split_at > 0 else max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:split_at])
+            sentence = sentence[split_at:].strip()
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
 
-    # Check if the audio_segment is stereo and convert it if not
-    if audio_segment.channels == 1:
-        audio_segment = audio_segment.set_channels(2)
 
-    start_trim = detect_nonsilent(
-        audio_segment, min_silence_len=100, silence_thresh=-50
-    )[0]
-    end_trim = detect_nonsilent(
-        audio_segment.reverse(), min_silence_len=100, silence_thresh=-50
-    )[0]
-    duration = len(audio_segment)
-    trimmed_audio = audio_segment[start_trim[0] : duration - end_trim[0]]
+def normalize_tts_text(text):
+    # Normalize unicode and whitespace, which don't change the speech, for cache keys
+    return " ".join(unicodedata.normalize("NFC", text).split())
 
-    # Convert the trimmed audio back to a numpy array
-    trimmed_audio_array = np.array(trimmed_audio.get_array_of_samples())
 
-    return trimmed_audio_array
+def trim_silence_np_array(audio_array, sample_rate):
+    # Trim leading and trailing silence from a mono array of integer samples
+    start, end = silence_bounds_array(
+        audio_array, sample_rate, audio_array.dtype.itemsize, silence_threshold=-50
+    )
+    return audio_array[start:end]
 
 
 class ShowTextToSpeech:
@@ -68,27 +94,33 @@ class ShowTextToSpeech:
         self.openai_model_name = os.getenv("OPENAI_TTS_MODEL_NAME", "tts-1-1106")
         self.openai_api_key = os.getenv("OPENAI_API_KEY", None)
         self.openai_client = None
+        # speech already generated for the same text, engine, voice and model is reused
+        self.cache = get_artifact_store("tts", max_bytes=TTS_CACHE_MAX_BYTES)
 
     def speak(self, text, output_file, fast=False):
+        text = normalize_tts_text(text)
         if fast:
             logger.info(f"Using fast TTS for text: {text}")
-            self._speak_gtts(text, output_file)
+            key = ArtifactStore.key("gtts", text, lang=GTTS_LANG)
+            self.cache.fetch(key, output_file, lambda path: self._speak_gtts(text, path))
         else:
             logger.info(f"Using slow TTS for text: {text}")
-            self._speak_openai_tts(text, output_file)
+            key = ArtifactStore.key(
+                "openai_tts", text, model=self.openai_model_name, voice=OPENAI_TTS_VOICE
+            )
+            self.cache.fetch(key, output_file, lambda path: self._speak_openai_tts(text, path))
+        self.audio_file = output_file
 
     def _speak_gtts(self, text, output_file):
         # fast version that uses google TTS
-        tts = gTTS(text=text, lang="en")
-        temp_mp3_file = "temp.mp3"
-        tts.save(temp_mp3_file)
+        tts = gTTS(text=text, lang=GTTS_LANG)
+        mp3 = io.BytesIO()
+        tts.write_to_fp(mp3)
+        mp3.seek(0)
 
-        # Convert the MP3 file to WAV using pydub
-        audio = AudioSegment.from_mp3(temp_mp3_file)
+        # Convert the MP3 to WAV in memory using pydub
+        audio = AudioSegment.from_file(mp3, format="mp3")
         audio.export(output_file, format="wav")
-
-        # Remove the temporary MP3 file
-        os.remove(temp_mp3_file)
         logger.info(f"Successfully generated audio file: {output_file}")
         self.audio_file = output_file
 
@@ -102,24 +134,49 @@ class ShowTextToSpeech:
         if self.openai_client is None:
             self.init_openai_client()
 
-        # Call OpenAI's TTS API
-        response = self.openai_client.audio.speech.create(
-            model=self.openai_model_name,
-            voice="echo",
-            input=text
-            )
-
-        # Save the audio to a file
-        response.stream_to_file(output_file+".mp3")
-
-        #convert to wav
-        audio = AudioSegment.from_mp3(output_file+".mp3")
+        max_chars = min(TTS_CHUNK_CHARS or OPENAI_TTS_MAX_CHARS, OPENAI_TTS_MAX_CHARS)
+        chunks = chunk_sentences(text, max_chars) if len(text) > max_chars else [text]
+        if len(chunks) == 1:
+            audio = self._openai_speech(text)
+        else:
+            audio = self._openai_speech_chunked(chunks)
         audio.export(output_file, format="wav")
-        os.remove(output_file+".mp3")
 
         logger.info(f"Successfully generated audio file: {output_file}")
         self.audio_file = output_file
 
+    def _openai_speech(self, text):
+        # Call OpenAI's TTS API, streaming WAV audio into memory
+        wav = io.BytesIO()
+        with self.openai_client.audio.speech.with_streaming_response.create(
+            model=self.openai_model_name,
+            voice=OPENAI_TTS_VOICE,
+            input=text,
+            response_format="wav",
+            ) as response:
+            for data in response.iter_bytes():
+                wav.write(data)
+        wav.seek(0)
+
+        # a streamed WAV has placeholder chunk sizes, which pydub reads up to the end of the data
+        return AudioSegment.from_wav(wav)
+
+    def _openai_speech_chunked(self, chunks):
+        # Synthesize the chunks concurrently and join them in order, trimming the silence
+        # at each join and putting a short pause there instead
+        logger.info(f"Synthesizing {len(chunks)} chunks with {TTS_CHUNK_WORKERS} workers")
+        with ThreadPoolExecutor(max_workers=TTS_CHUNK_WORKERS) as executor:
+            pieces = list(executor.map(
+                self._openai_speech, chunks))
+
+        audio = AudioSegment.empty()
+        for i, piece in enumerate(pieces):
+            piece = trim_silence(piece, silence_threshold=-50, leading=i > 0, trailing=i < len(pieces) - 1)
+            if i > 0:
+                audio += AudioSegment.silent(duration=TTS_CHUNK_PAUSE_MS, frame_rate=piece.frame_rate)
+            audio += piece
+        return audio
+
 
 if __name__ == "__main__":
     import sys
@@ -1,6 +1,9 @@
 from pydub import AudioSegment
 import os
 
+from llm_from_here.sound.silence import trim_silence
+from llm_from_here.artifactStore import replace_on_write
+
 import logging
 logger = logging.getLogger(__name__)
 
@@ -89,8 +92,7 @@ class StitchAudio():
             logger.info(
                 f"Found background music file '{background_music_filename}'; removing silence.")
             music = AudioSegment.from_file(background_music_filename)
-            music = music.strip_silence(
-                silence_thresh=-50, silence_len=50, padding=0)
+            music = trim_silence(music, silence_threshold=-50)
             music_volume_before = music.dBFS
             music = match_target_amplitude(music)
             music = music.apply_gain(self.params.get('background_music_gain', -5))
@@ -107,7 +109,8 @@ class StitchAudio():
         else:
             output_audio = merged_audio
 
-        output_audio.export(file_path, format=output_format)
+        with replace_on_write(file_path) as path:
+            output_audio.export(path, format=output_format)
 
         logger.info(f"Audio files merged and saved as '{file_path}'.")
 
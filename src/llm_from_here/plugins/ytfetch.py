@@ -14,10 +14,24 @@ from jinja2 import Template
 from llm_from_here.common import is_production_prefix
 import ytmusicapi
 from llm_from_here.common import get_nested_value
+from llm_from_here.artifactStore import ArtifactStore, get_artifact_store
+from llm_from_here.searchCache import SearchCache, get_search_cache
 
 import logging
 logger = logging.getLogger(__name__)
 
+LLM_FILTER_BATCH_PROMPT = (
+    "Answer the question below for each of these {} videos, which are numbered from 1."
+)
+LLM_FILTER_BATCH_SCHEMA_PROMPT = (
+    "Respond only with a list with one answer for each video, in order, giving the video's "
+    "number as video, using the following schema:"
+)
+# the most videos, and description characters per video, in a batched llm filter prompt
+LLM_FILTER_BATCH_SIZE = 10
+LLM_FILTER_DESCRIPTION_CHARS = 500
+# the most video ids a videos().list request accepts
+VIDEOS_LIST_MAX_IDS = 50
 
 
 class YtFetch():
@@ -26,9 +40,14 @@ class YtFetch():
                                                        developerKey=os.environ['YT_API_KEY'])
         self.ytmusic = ytmusicapi.YTMusic()
         self.last_response = None
+        # llm filter verdicts, by filter prompt and video id, and video details by video id
+        self.llm_verdicts = {}
+        self._video_details = {}
+        self.search_cache = get_search_cache()
         supaset_name = f'{is_production_prefix()}ytfetch_video_ids_returned'
         self.video_ids_returned = SupaSet(supaset_name,
-                                          autoexpire = kwargs.get('video_ids_supaset_autoexpire_days', 180))
+                                          autoexpire = kwargs.get('video_ids_supaset_autoexpire_days', 180),
+                                          local_cache = kwargs.get('video_ids_supaset_local_cache', True))
         
     def finalize(self):
         logger.info("Finalizing YtFetch")
@@ -38,14 +57,20 @@ class YtFetch():
         return self.search_videos(query, orderby=orderby, max_results=1)[0]
     
     def search_videos(self, query, duration_search_filter=None, orderby="relevance", max_results=30):
-        
+        if self.search_cache is not None:
+            key = SearchCache.key("youtube", query, duration_search_filter=duration_search_filter,
+                                  orderby=orderby, max_results=max_results)
+            if (videos := self.search_cache.get(key)) is not None:
+                logger.info(f"Using cached YouTube search results for {query}")
+                return videos
+
         request = self.youtube.search().list(
             part="snippet",
             type="video",
             q=query,
             videoDefinition="any",
             videoDuration="any" if duration_search_filter is None else duration_search_filter,
-            maxResults=30,
+            maxResults=max_results,
             fields="items(id(videoId),snippet(channelId,title,description,channelTitle))",
             safeSearch="strict",
             order=orderby #rating, relevance, viewCount, date, title, videoCount
@@ -61,10 +86,18 @@ class YtFetch():
                 'channel_title': html.unescape(item['snippet']['channelTitle']),
                 'video_url': f"https://www.youtube.com/watch?v={item['id']['videoId']}"
             })
-        
+
+        if self.search_cache is not None:
+            self.search_cache.put(key, videos, service="youtube")
         return videos
         
     def search_music(self, query, orderby=None, max_results=30):
+        if self.search_cache is not None:
+            key = SearchCache.key("ytmusic", query, max_results=max_results)
+            if (videos := self.search_cache.get(key)) is not None:
+                logger.info(f"Using cached YouTube Music search results for {query}")
+                return videos
+
         results = self.ytmusic.search(query, filter="videos", limit=max_results)
         
         videos = []
@@ -84,10 +117,19 @@ class YtFetch():
                 'video_url': f"https://www.youtube.com/watch?v={result['videoId']}",
                 'duration': duration
             })
+
+        if self.search_cache is not None:
+            self.search_cache.put(key, videos, service="ytmusic")
         return videos
         
     
     def download_audio(self, video_url, output_file, max_duration=None):
+        """Download the audio of a video to a wav file, reusing a previous download if there is one"""
+        key = ArtifactStore.key("youtube", video_url, max_duration=max_duration)
+        get_artifact_store().fetch(key, output_file.replace(".wav", "") + ".wav",
+                                   lambda path: self._download_audio(video_url, path, max_duration))
+
+    def _download_audio(self, video_url, output_file, max_duration=None):
         #strip .wav from output_file
         output_file = output_file.replace(".wav", "")
 
@@ -147,28 +189,157 @@ class YtFetch():
             duration = parse_duration(iso_duration)
             return duration.total_seconds()
 
-    def llm_filter_title(self, chat_app, llm_filter_prompt, llm_filter_js, title, description, channel_title):
+    def llm_filter_title(self, chat_app, llm_filter_prompt, llm_filter_js, title, description, channel_title,
+                         video_id=None):
         """
         Filter videos based on title, description, and channel title using a call to GPT.
+        Verdicts already made for the video by llm_filter_videos are reused.
         """
         if llm_filter_prompt and llm_filter_js:
+            if (llm_filter_prompt, video_id) in self.llm_verdicts:
+                return self.llm_verdicts[(llm_filter_prompt, video_id)]
             template = Template(llm_filter_prompt)
             logger.info(f"LLM Checking video title {title}")
             prompt = template.render(title=title, description=description, channel_title=channel_title)
             logger.info(f"Prompt: {prompt}")
             response = chat_app.enforce_json_response(prompt, llm_filter_js, log_prompt=True)
             logger.info(f"Response: {response}")
-            if response['answer'] == 'no':
-                return True
+            filtered = response['answer'] == 'no'
+            if video_id is not None:
+                self.llm_verdicts[(llm_filter_prompt, video_id)] = filtered
+            return filtered
         return False
 
+    def llm_filter_videos(self, chat_app, llm_filter_prompt, llm_filter_js, videos,
+                          batch_size=LLM_FILTER_BATCH_SIZE, description_chars=LLM_FILTER_DESCRIPTION_CHARS):
+        """
+        Filter many videos with a call to GPT per batch_size videos, asking the question of
+        llm_filter_title for each video, with its description truncated, and for a list of the
+        answers. Batches stop once a video passes, as only the first is used. The verdicts are
+        cached by video id and used by llm_filter_title; videos without one, e.g. because their
+        batch failed, are checked one at a time there.
+        """
+        videos = [video for video in videos if (llm_filter_prompt, video['video_id']) not in self.llm_verdicts]
+        if not (llm_filter_prompt and llm_filter_js and videos):
+            return
+
+        template = Template(llm_filter_prompt)
+        item_schema = {
+            "type": "object",
+            "properties": {"video": {"type": "integer"}, **llm_filter_js.get('properties', {})},
+            "required": ["video"] + llm_filter_js.get('required', []),
+        }
+        for i in range(0, len(videos), batch_size):
+            batch = videos[i:i + batch_size]
+            questions = [
+                f"Video {j}:\n" + template.render(title=video['title'],
+                                                   description=(video['description'] or '')[:description_chars],
+                                                   channel_title=video['channel_title'])
+                for j, video in enumerate(batch, 1)
+            ]
+            prompt = "\n\n".join([LLM_FILTER_BATCH_PROMPT.format(len(batch))] + questions +
+                                 [LLM_FILTER_BATCH_SCHEMA_PROMPT])
+            logger.info(f"LLM Checking {len(batch)} video titles")
+            try:
+                response = chat_app.enforce_json_response(prompt, {"type": "array", "items": item_schema},
+                                                          log_prompt=True)
+            except Exception as e:
+                logger.warning(f"Batched llm filter failed, checking videos one at a time: {e}")
+                return
+            logger.info(f"Response: {response}")
+
+            passed = False
+            for verdict in response:
+                if 1 <= verdict['video'] <= len(batch) and 'answer' in verdict:
+                    video_id = batch[verdict['video'] - 1]['video_id']
+                    filtered = verdict['answer'] == 'no'
+                    self.llm_verdicts[(llm_filter_prompt, video_id)] = filtered
+                    passed = passed or not filtered
+            if passed:
+                return
+
+    def fetch_video_details(self, video_ids):
+        """
+        Fetch the duration and full description of videos that haven't been fetched yet,
+        with one request per VIDEOS_LIST_MAX_IDS videos.
+        """
+        video_ids = [video_id for video_id in dict.fromkeys(video_ids) if video_id not in self._video_details]
+        for i in range(0, len(video_ids), VIDEOS_LIST_MAX_IDS):
+            chunk = video_ids[i:i + VIDEOS_LIST_MAX_IDS]
+            video_request = self.youtube.videos().list(
+                part="snippet,contentDetails",
+                id=",".join(chunk),
+                maxResults=len(chunk),
+                fields="items(id,snippet(description),contentDetails(duration))"
+            )
+            video_response = video_request.execute()
+
+            for item in video_response['items']:
+                self._video_details[item['id']] = {
+                    'duration_seconds': self.duration_in_seconds(item['contentDetails']['duration']),
+                    'description': html.unescape(item['snippet']['description']),
+                }
+            # videos that are gone or private aren't listed
+            for video_id in chunk:
+                self._video_details.setdefault(video_id, None)
+
+    def video_details(self, video_id):
+        """Return the duration in seconds and the full description of a video, or None if it's unavailable."""
+        self.fetch_video_details([video_id])
+        return self._video_details[video_id]
+
+    def check_video(self, video, use_music, description_filters, min_duration, max_duration):
+        """
+        Check a search result against the description and duration filters, returning the
+        video with its full description if it passes them, or None.
+        """
+        video_id = video['video_id']
+        duration_seconds = video['duration'] if use_music else None
+
+        # Check if the description contains the filter string
+        if self.description_filter(video['description'], description_filters):
+            return None
+
+        # Fetch the video details, only for non-music searches
+        if not use_music:
+            details = self.video_details(video_id)
+            if details is None:
+                logger.info(f"Video {video_id} details are unavailable. Skipping.")
+                return None
+            duration_seconds = details['duration_seconds']
+            full_description = details['description']
+
+            # Check if the full description contains the filter string
+            if self.description_filter(full_description, description_filters):
+                return None
+        else:
+            full_description = video['description']
+
+        #check duration
+        if min_duration and max_duration:
+            if duration_seconds is None:
+                logger.info(f"Video {video_id} duration is None. Skipping.")
+                return None
+            if not (min_duration <= duration_seconds <= max_duration):
+                logger.info(f"Video {video_id} duration {duration_seconds} does not fall within the specified range, {min_duration}:{max_duration}. Skipping.")
+                return None
+
+        return {**video, 'description': full_description}
+
     def search_video_with_duration(self, query, **kwargs):
-        """Searches for a video that falls within the specified duration range"""
+        """
+        Searches for a video that falls within the specified duration range.
+
+        With an llm filter, every search result that passes the other filters is checked in
+        batched calls to GPT first, of llm_filter_batch_size videos, unless llm_filter_batch is False.
+        """
         duration_search_filter = kwargs.get('duration_search_filter')
         description_filters = kwargs.get('description_filters')
         orderby = kwargs.get('orderby', 'relevance')
         llm_filter_prompt = kwargs.get('llm_filter_prompt')
         llm_filter_js = kwargs.get('llm_filter_js')
+        llm_filter_batch = kwargs.get('llm_filter_batch', True)
+        llm_filter_batch_size = kwargs.get('llm_filter_batch_size', LLM_FILTER_BATCH_SIZE)
         chat_app = kwargs.get('chat_app')
         min_duration = kwargs.get('duration_min_sec')
         max_duration = kwargs.get('duration_max_sec')
@@ -186,55 +357,40 @@ class YtFetch():
         # Randomize the order of items in the response
         if random_shuffle:
             random.shuffle(videos)
+
+        # Fetch the details of every video that may be checked at once
+        if not use_music:
+            self.fetch_video_details([video['video_id'] for video in videos
+                                      if video['video_id'] not in self.video_ids_returned])
+
+        if llm_filter_prompt and llm_filter_js and llm_filter_batch:
+            candidates = []
+            for video in videos:
+                if video['video_id'] in self.video_ids_returned:
+                    continue
+                if checked := self.check_video(video, use_music, description_filters, min_duration, max_duration):
+                    candidates.append(checked)
+            self.llm_filter_videos(chat_app, llm_filter_prompt, llm_filter_js, candidates,
+                                   batch_size=llm_filter_batch_size)
     
         # Now, for each video in the search results, check the duration
         for video in videos:
             video_id = video['video_id']
             title = video['title']
-            description_trimmed = video['description']
             channel_title = video['channel_title']
-            duration_seconds = video['duration'] if use_music else None
             
             # Check if this video has already been returned
             if not self.video_ids_returned.add(video_id):
                 logger.info(f"Video {video_id} already returned. Skipping.")
                 continue
 
-            # Check if the description contains the filter string
-            if self.description_filter(description_trimmed, description_filters):
+            checked = self.check_video(video, use_music, description_filters, min_duration, max_duration)
+            if checked is None:
                 continue
-        
-            # Fetch the video details, only for non-music searches
-            if not use_music:
-                video_request = self.youtube.videos().list(
-                    part="snippet, contentDetails",
-                    id=video_id
-                )
-                video_response = video_request.execute()
-
-                # Get the video duration and description
-                duration = video_response['items'][0]['contentDetails']['duration']
-                duration_seconds = self.duration_in_seconds(duration)
-                full_description = html.unescape(video_response['items'][0]['snippet']['description'])
-            
-                # Check if the full description contains the filter string
-                if self.description_filter(full_description, description_filters):
-                    continue
-            else:
-                full_description = description_trimmed
-            
-            #check duration
-            if min_duration and max_duration:
-                if duration_seconds is None:
-                    logger.info(f"Video {video_id} duration is None. Skipping.")
-                    continue
-                if not (min_duration <= duration_seconds <= max_duration):
-                    logger.info(f"Video {video_id} duration {duration_seconds} does not fall within the specified range, {min_duration}:{max_duration}. Skipping.")
-                    continue
             
             #llm filter for title and description and channel_title
             if self.llm_filter_title(chat_app, llm_filter_prompt, llm_filter_js, 
-                                     title, full_description, channel_title):
+                                     title, checked['description'], channel_title, video_id):
                 logger.info(f"Video https://www.youtube.com/watch?v={video_id} removed by llm filter. Skipping.")
                 continue
             
@@ -0,0 +1,105 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+import appdirs
+
+from llm_from_here.pluginCache import PluginCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_HOURS = 24
+
+
+class SearchCache:
+    """
+    A persistent cache of search results, keyed by the search service, the normalized query
+    and the search's filters, so that repeating a search within the time to live, in this
+    process or another, doesn't call the service.
+
+    Entries older than the time to live are treated as misses and evicted, and the cache is
+    bounded by size as in PluginCache.
+    """
+
+    def __init__(self, file_path, ttl_hours=DEFAULT_TTL_HOURS, max_bytes=None):
+        """
+        Args:
+        file_path (str): The SQLite file to store the cache in.
+        ttl_hours (float, optional): How long search results are reused for.
+        max_bytes (int, optional): The maximum total size of the cached results.
+        """
+        self.file_path = file_path
+        self.ttl = ttl_hours * 60 * 60
+        self.cache = PluginCache(file_path, autocommit=True)
+        self.cache.configure(max_bytes=max_bytes, max_age_days=ttl_hours / 24)
+        # searches in different threads share the cache
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(query):
+        """Normalize the case and whitespace of a query."""
+        return re.sub(r"\s+", " ", query).strip().lower()
+
+    @classmethod
+    def key(cls, service, query, **filters):
+        """Return the key of a search."""
+        data = json.dumps([service, cls.normalize(query), filters], sort_keys=True, default=str)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    @property
+    def stats(self):
+        return self.cache.stats
+
+    def get(self, key):
+        """Return the results cached for key, or None if there aren't any that are fresh."""
+        with self._lock:
+            entry = self.cache.get(key)
+            if entry is not None and time.time() - entry['time'] > self.ttl:
+                # PluginCache only evicts expired entries on writes
+                del self.cache[key]
+                self.stats['hits'] -= 1
+                self.stats['misses'] += 1
+                entry = None
+        return entry['results'] if entry is not None else None
+
+    def put(self, key, results, service=None):
+        """Cache the results of a search under key."""
+        with self._lock:
+            self.cache.set(key, {'time': time.time(), 'results': results}, plugin=service)
+
+    def log_stats(self):
+        logger.info(
+            f"Search cache: {self.stats['hits']} hits, {self.stats['misses']} misses, "
+            f"{self.stats['evictions']} evictions, {len(self.cache)} searches ({self.cache.size()} bytes)")
+
+
+_search_cache = None
+_search_cache_lock = threading.Lock()
+
+
+def get_search_cache():
+    """
+    Return the shared search cache, or None if it's off. It's turned on by setting
+    LLMFH_SEARCH_CACHE, and configured by LLMFH_SEARCH_CACHE_FILE,
+    LLMFH_SEARCH_CACHE_TTL_HOURS and LLMFH_SEARCH_CACHE_MAX_BYTES.
+    """
+    global _search_cache
+    if os.getenv("LLMFH_SEARCH_CACHE", "off").lower() in ("off", "0", "false", ""):
+        return None
+
+    with _search_cache_lock:
+        if _search_cache is None:
+            file_path = os.getenv("LLMFH_SEARCH_CACHE_FILE") or os.path.join(
+                appdirs.user_cache_dir(appname="llm_from_here"), "search_cache.sqlite")
+            os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+            ttl_hours = os.getenv("LLMFH_SEARCH_CACHE_TTL_HOURS")
+            max_bytes = os.getenv("LLMFH_SEARCH_CACHE_MAX_BYTES")
+            _search_cache = SearchCache(
+                file_path,
+                ttl_hours=float(ttl_hours) if ttl_hours else DEFAULT_TTL_HOURS,
+                max_bytes=int(max_bytes) if max_bytes else None,
+            )
+        return _search_cache
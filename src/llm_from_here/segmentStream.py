@@ -0,0 +1,143 @@
+import threading
+
+
+class SegmentStream:
+    """
+    A list of segments that is still being produced, e.g. parsed from a script as the LLM
+    writes it, so that consumers can start on the first segments before the last exist.
+
+    Iterating over the stream yields each segment as it's added, waiting for more until the
+    stream is closed. Operations that need every segment (len, indexing, pickling) wait for
+    the stream to be closed, and a stream pickles as a plain list. If the producer fails, it
+    closes the stream with the error, which is raised to consumers.
+    """
+
+    def __init__(self):
+        self._items = []
+        self._done = False
+        self._error = None
+        self._condition = threading.Condition()
+        self.script = ""
+
+    def append(self, item):
+        self.extend([item])
+
+    def extend(self, items):
+        with self._condition:
+            self._items.extend(items)
+            self._condition.notify_all()
+
+    def close(self, error=None):
+        """Mark the stream as complete, or as failed with error."""
+        with self._condition:
+            self._done = True
+            self._error = error
+            self._condition.notify_all()
+
+    def done(self):
+        with self._condition:
+            return self._done
+
+    def wait(self, timeout=None):
+        """Wait for the stream to be closed and return its segments as a list."""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._done, timeout):
+                raise TimeoutError("Segment stream wasn't closed in time")
+            if self._error is not None:
+                raise self._error
+            return list(self._items)
+
+    def __iter__(self):
+        i = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: i < len(self._items) or self._done)
+                if i >= len(self._items):
+                    if self._error is not None:
+                        raise self._error
+                    return
+                item = self._items[i]
+            yield item
+            i += 1
+
+    def __bool__(self):
+        # wait for the first segment, or for the stream to turn out empty
+        with self._condition:
+            self._condition.wait_for(lambda: self._items or self._done)
+            if not self._items and self._error is not None:
+                raise self._error
+            return bool(self._items)
+
+    def __len__(self):
+        return len(self.wait())
+
+    def __getitem__(self, index):
+        return self.wait()[index]
+
+    def __reduce__(self):
+        return (list, (self.wait(),))
+
+    def __repr__(self):
+        with self._condition:
+            state = "done" if self._done else "streaming"
+            return f"SegmentStream({len(self._items)} segments, {state})"
+
+
+class StreamedScript:
+    """
+    The script of a segment stream, which is only complete once the stream is closed.
+
+    It stands in for the script as a string: using it as one, e.g. with str(), comparing it
+    or calling a string method, waits for the stream to be closed, and it pickles as a plain
+    string. Attributes that strings don't have are missing without waiting.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def wait(self, timeout=None):
+        """Wait for the stream to be closed and return the script."""
+        self._stream.wait(timeout)
+        return self._stream.script
+
+    def done(self):
+        return self._stream.done()
+
+    def __getattr__(self, name):
+        if name.startswith('_') or not hasattr(str, name):
+            raise AttributeError(name)
+        return getattr(self.wait(), name)
+
+    def __str__(self):
+        return self.wait()
+
+    def __eq__(self, other):
+        return self.wait() == (other.wait() if isinstance(other, StreamedScript) else other)
+
+    def __hash__(self):
+        return hash(self.wait())
+
+    def __len__(self):
+        return len(self.wait())
+
+    def __contains__(self, item):
+        return item in self.wait()
+
+    def __iter__(self):
+        return iter(self.wait())
+
+    def __getitem__(self, index):
+        return self.wait()[index]
+
+    def __add__(self, other):
+        return self.wait() + other
+
+    def __radd__(self, other):
+        return other + self.wait()
+
+    def __reduce__(self):
+        return (str, (self.wait(),))
+
+    def __repr__(self):
+        state = "done" if self._stream.done() else "streaming"
+        return f"StreamedScript({state})"
@@ -6,10 +6,15 @@ import logging
 from dotenv import load_dotenv
 import hashlib
 import argparse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from jsonschema.exceptions import ValidationError
 from json.decoder import JSONDecodeError
 from retry import retry
-from llm_from_here.pickleDict import PickleDict
+from llm_from_here.pluginCache import PluginCache
+from llm_from_here.llmCache import get_llm_cache
+from llm_from_here.searchCache import get_search_cache
+from llm_from_here.plugins.gpt import ChatApp
+from llm_from_here.segmentStream import SegmentStream, StreamedScript
 import appdirs
 import llm_from_here.plugins as plugins
 from llm_from_here.common import is_production
@@ -30,12 +35,15 @@ cache_dir = appdirs.user_cache_dir(appname=os.path.basename(__file__))
 if not os.path.exists(cache_dir):
     os.makedirs(cache_dir)
 try:
-    plugin_cache = PickleDict(os.path.join(cache_dir , 'cache.pickle'), autocommit=True)
+    plugin_cache = PluginCache(os.path.join(cache_dir, 'cache.sqlite'), autocommit=True,
+                               legacy_file_path=os.path.join(cache_dir, 'cache.pickle'))
 except Exception as e:
     logger.exception(f"Exception while creating plugin cache: {e}")
     logger.info("Purging cache and retrying.")
-    os.remove(os.path.join(cache_dir , 'cache.pickle'))
-    plugin_cache = PickleDict(os.path.join(cache_dir , 'cache.pickle'), autocommit=True)
+    for file_name in ('cache.sqlite', 'cache.pickle'):
+        if os.path.exists(os.path.join(cache_dir, file_name)):
+            os.remove(os.path.join(cache_dir, file_name))
+    plugin_cache = PluginCache(os.path.join(cache_dir, 'cache.sqlite'), autocommit=True)
 
 def execute_plugin(plugin_class, plugin_params, global_results, plugin_instance_name, retries=1):
     retry_count = 0
@@ -66,7 +74,116 @@ def load_yaml(yaml_file):
         data = yaml.load(file, Loader=yaml.FullLoader)
     return data
 
+def param_strings(params):
+    """Yield every string value nested in a plugin's params."""
+    if isinstance(params, str):
+        yield params
+    elif isinstance(params, dict):
+        for value in params.values():
+            yield from param_strings(value)
+    elif isinstance(params, (list, tuple)):
+        for value in params:
+            yield from param_strings(value)
+
+def plugin_dependencies(entries):
+    """
+    Return, for each plugin entry, the set of indices of the earlier entries it depends on.
+
+    A named plugin depends on the earlier named plugins whose results it references, i.e. one
+    of its params is a '<name>_...' global results key, on the ones listed in its depends_on,
+    and on earlier entries with the same name, whose results it overwrites. Unnamed plugins
+    merge unprefixed results, so they act as barriers: they depend on every earlier entry and
+    every later entry depends on them.
+    """
+    names = [entry.get('name', '') for entry in entries]
+    dependencies = []
+    barrier = None
+    for i, entry in enumerate(entries):
+        if not names[i]:
+            dependencies.append(set(range(i)))
+            barrier = i
+            continue
+
+        refs = list(param_strings(entry.get('params', {})))
+        depends_on = entry.get('depends_on', [])
+        if isinstance(depends_on, str):
+            depends_on = [depends_on]
+        deps = {j for j in range(i) if names[j] and (
+            names[j] == names[i] or names[j] in depends_on or
+            any(ref.startswith(f'{names[j]}_') for ref in refs))}
+        if barrier is not None:
+            deps.add(barrier)
+        dependencies.append(deps)
+    return dependencies
+
+def import_plugin_class(entry):
+    """Import the plugin module of an entry and return its plugin class."""
+    plugin_name = entry.get('plugin')
+    try:
+        module = importlib.import_module(f'llm_from_here.plugins.{plugin_name}')
+        plugin_class = getattr(module, entry.get('class'))
+        logger.info(
+            f"Plugin '{plugin_name}' has been imported successfully.")
+    except AttributeError:
+        logger.critical(f"Plugin '{plugin_name}' not found.")
+        raise
+    except ModuleNotFoundError:
+        logger.critical(f"Module '{plugin_name}' not found.")
+        raise
+    return plugin_class
+
+def run_plugin_entry(entry, global_results):
+    """Import and execute the plugin of an entry, returning its results and instance."""
+    plugin_class = import_plugin_class(entry)
+    plugin_results, plugin_instance = execute_plugin(
+        plugin_class, entry.get('params', {}), global_results,
+        plugin_instance_name=entry.get('name', ''), retries=entry.get('retries', 1))
+    logger.info(
+        f"Plugin '{entry.get('plugin')}' has been executed successfully.")
+    return plugin_results, plugin_instance
+
+def merge_plugin_results(entry, plugin_results, plugin_instance, from_cache, global_results):
+    """
+    Merge a plugin's results into global results, prepending them with its name, and
+    return the objects that need to be finalized at the end of the run.
+    """
+    plugin_name = entry.get('plugin')
+    name_key = entry.get('name', '')
+    to_be_finalized = []
+
+    # Prepend plugin's results with name key
+    prepended_results = {}
+    for key, value in plugin_results.items():
+        prepended_key = f'{name_key}_{key}' if name_key else key
+        prepended_results[prepended_key] = value
+        
+        # If the plugin has a finalize method, add it to the list of objects to be finalized
+        if not from_cache and hasattr(value, 'finalize'):
+            logger.info(f"Adding {value} to to_be_finalized")
+            to_be_finalized.append(value)
+        
+    logger.info(f"Plugin '{plugin_name}' results: {prepended_results}")
+
+    # check if plugin_instance has a finalize method
+    if not from_cache and hasattr(plugin_instance, 'finalize'):
+        logger.info(f"Adding {plugin_instance} to to_be_finalized")
+        to_be_finalized.append(plugin_instance)
+
+    # Merge prepended results into global results
+    global_results.update(prepended_results)
+    return to_be_finalized
+
 def execute_plugins(yaml_file, clear_cache=False, outputs_dir=None):
+    """
+    Execute the plugins of a show configuration.
+
+    Plugins run in YAML order by default. With parallel_plugins set in the YAML, plugins
+    run on a pool of max_workers threads as soon as the plugins they depend on (see
+    plugin_dependencies) have finished. Results are merged into global results, and cached,
+    in the main thread, and finalizers run in YAML order at the end either way.
+    Dependencies are inferred from params, so plugins that read global results keys they
+    aren't given, e.g. a default chat_app_object, need a depends_on entry to run in parallel.
+    """
     global global_results
     if clear_cache:
         plugin_cache.clear()
@@ -74,6 +191,9 @@ def execute_plugins(yaml_file, clear_cache=False, outputs_dir=None):
 
     data = load_yaml(yaml_file)
 
+    # bound the cache, e.g. plugin_cache: {max_bytes: ..., max_age_days: ..., plugin_max_bytes: {plugin: ...}}
+    plugin_cache.configure(**data.get('plugin_cache', {}))
+
     # Create unique outputs folder based on show parameter
     show_name = data.get('show_name', 'show')
     global_results = data.get('global_parameters', {})
@@ -86,91 +206,118 @@ def execute_plugins(yaml_file, clear_cache=False, outputs_dir=None):
     output_folder = os.path.join(outputs_dir, f"{show_name}_run{run_count}")
     os.makedirs(output_folder, exist_ok=True)
     global_results['output_folder'] = output_folder
-    
-    # list of objects that need to be finalized at the end of a successful run
-    to_be_finalized = []
 
-    # Execute plugins
+    entries = []
     for entry in data.get('plugins', []):
         plugin_name = entry.get('plugin')
-        plugin_class = entry.get('class')
-        plugin_params = entry.get('params', {})
         name_key = entry.get('name', '')
-        cache_plugin = entry.get('cache', False)
-        plugin_retries = entry.get('retries', 1)
-        only_in_prod = entry.get('only_in_prod', False)
         
-        if plugin_retries > 1:
+        if entry.get('retries', 1) > 1:
             logger.info(
                 f"Retries enabled for plugin '{plugin_name}:{name_key}'.")
-        if cache_plugin:
+        if entry.get('cache', False):
             logger.info(
                 f"Cache enabled for plugin '{plugin_name}:{name_key}'.")
-        if only_in_prod and not is_production():
+        if entry.get('only_in_prod', False) and not is_production():
             logger.info(
                 f"Skipping plugin '{plugin_name}:{name_key}' because it is only enabled in production.")
             continue
+        entries.append(entry)
 
-        # Generate hash of the plugin entry
-        entry_hash = hashlib.md5(str(entry).encode()).hexdigest()
+    # list of objects that need to be finalized at the end of a successful run, per entry
+    to_be_finalized = [[] for _ in entries]
 
+    def cached_results(entry):
         # Check if cache is enabled and entry is in cache
-        from_cache = False
-        if cache_plugin and entry_hash in plugin_cache:
-            from_cache = True
-            plugin_results = plugin_cache[entry_hash]
+        if not entry.get('cache', False):
+            return None
+        plugin_results = plugin_cache.get(hashlib.md5(str(entry).encode()).hexdigest())
+        if plugin_results is not None:
             logger.info(
-                f"Plugin '{plugin_name}' results retrieved from cache.")
-        else:
-            # Import the plugin if it exists
-            try:
-                module = importlib.import_module(f'llm_from_here.plugins.{plugin_name}')
-                plugin_class = getattr(module, plugin_class)
-                logger.info(
-                    f"Plugin '{plugin_name}' has been imported successfully.")
-            except AttributeError:
-                logger.critical(f"Plugin '{plugin_name}' not found.")
-                raise
-            except ModuleNotFoundError:
-                logger.critical(f"Module '{plugin_name}' not found.")
-                raise
-
-            plugin_results, plugin_instance = execute_plugin(
-                plugin_class, plugin_params, global_results, plugin_instance_name=name_key, retries=plugin_retries)
+                f"Plugin '{entry.get('plugin')}' results retrieved from cache.")
+        return plugin_results
+
+    # results holding segment streams that were still being written when their plugin
+    # finished; they're cached at the end of the run, so that consumers needn't wait for them
+    deferred_cache_writes = []
+
+    def cache_results(entry, plugin_results):
+        plugin_cache.set(hashlib.md5(str(entry).encode()).hexdigest(), plugin_results,
+                         plugin=entry.get('plugin'))
+
+    def finish(i, plugin_results, plugin_instance=None, from_cache=True):
+        entry = entries[i]
+        # Store results in cache
+        if not from_cache and entry.get('cache', False):
+            if any(isinstance(value, (SegmentStream, StreamedScript)) and not value.done()
+                   for value in plugin_results.values()):
+                deferred_cache_writes.append((entry, plugin_results))
+            else:
+                cache_results(entry, plugin_results)
+        to_be_finalized[i] = merge_plugin_results(
+            entry, plugin_results, plugin_instance, from_cache, global_results)
+
+    # Execute plugins
+    if not data.get('parallel_plugins', False):
+        for i, entry in enumerate(entries):
+            plugin_results = cached_results(entry)
+            if plugin_results is not None:
+                finish(i, plugin_results)
+            else:
+                finish(i, *run_plugin_entry(entry, global_results), from_cache=False)
+    else:
+        dependencies = plugin_dependencies(entries)
+        max_workers = data.get('max_workers', 4)
+        logger.info(f"Executing {len(entries)} plugins with {max_workers} workers.")
+        done = set()
+        started = set()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            running = {}
+            while len(done) < len(entries):
+                for i, entry in enumerate(entries):
+                    if i in started or not dependencies[i] <= done:
+                        continue
+                    started.add(i)
+                    plugin_results = cached_results(entry)
+                    if plugin_results is not None:
+                        finish(i, plugin_results)
+                        done.add(i)
+                    else:
+                        running[executor.submit(run_plugin_entry, entry, global_results)] = i
+                if len(done) == len(entries):
+                    break
+                if not running:
+                    # a cached plugin finished, which may have unblocked others
+                    continue
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                # merge in YAML order so that runs are deterministic
+                for future in sorted(finished, key=running.get):
+                    i = running.pop(future)
+                    finish(i, *future.result(), from_cache=False)
+                    done.add(i)
+
+    for entry, plugin_results in deferred_cache_writes:
+        cache_results(entry, plugin_results)
 
-            logger.info(
-                f"Plugin '{plugin_name}' has been executed successfully.")
-
-            # Store results in cache
-            if cache_plugin:
-                plugin_cache[entry_hash] = plugin_results
-
-        # Prepend plugin's results with name key
-        prepended_results = {}
-        for key, value in plugin_results.items():
-            prepended_key = f'{name_key}_{key}' if name_key else key
-            prepended_results[prepended_key] = value
-            
-            # If the plugin has a finalize method, add it to the list of objects to be finalized
-            if not from_cache and hasattr(value, 'finalize'):
-                logger.info(f"Adding {value} to to_be_finalized")
-                to_be_finalized.append(value)
-            
-        logger.info(f"Plugin '{plugin_name}' results: {prepended_results}")
-
-        # check if plugin_instance has a finalize method
-        if not from_cache and hasattr(plugin_instance, 'finalize'):
-            logger.info(f"Adding {plugin_instance} to to_be_finalized")
-            to_be_finalized.append(plugin_instance)
-
-        # Merge prepended results into global results
-        global_results.update(prepended_results)
-        
     #finalize
-    for obj in to_be_finalized:
+    for obj in [obj for objs in to_be_finalized for obj in objs]:
         logger.info(f"Finalizing object {obj}")
         obj.finalize()
 
+    plugin_cache.log_stats()
+    # chat apps are shared between plugins under several names
+    chat_apps = {}
+    for name, value in global_results.items():
+        if isinstance(value, ChatApp):
+            chat_apps.setdefault(id(value), (name, value))
+    for name, chat_app in chat_apps.values():
+        chat_app.log_usage(name)
+    if (llm_cache := get_llm_cache()) is not None:
+        llm_cache.log_stats()
+    if (search_cache := get_search_cache()) is not None:
+        search_cache.log_stats()
+
 def get_last_run_count(show_name, outputs_dir):
     folders = [folder for folder in os.listdir(
         outputs_dir) if os.path.isdir(os.path.join(outputs_dir, folder))]
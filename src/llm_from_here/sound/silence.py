@@ -0,0 +1,80 @@
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+SILENCE_THRESHOLD = -50.0  # dBFS
+FRAME_MS = 10
+# frames processed at once, to bound the memory used for long audio
+BLOCK_FRAMES = 4096
+
+
+def audio_samples(audio):
+    """Return the samples of an AudioSegment as a (frames, channels) numpy array."""
+    if audio.sample_width == 3:
+        audio = audio.set_sample_width(4)
+    samples = np.frombuffer(audio.raw_data, dtype=f'<i{audio.sample_width}')
+    return samples.reshape(-1, audio.channels)
+
+
+def frame_levels(samples, frame_size, sample_width):
+    """
+    Return the RMS level in dBFS of each frame of frame_size samples, the last frame
+    possibly shorter. Silent frames are -inf.
+
+    Args:
+    samples (np.ndarray): (samples, channels) or mono array of integer samples.
+    frame_size (int): The number of samples in each frame.
+    sample_width (int): The sample width in bytes, which sets the full scale level.
+    """
+    samples = samples.reshape(len(samples), -1)
+    num_frames = -(-len(samples) // frame_size)
+    levels = np.empty(num_frames)
+    for first in range(0, num_frames, BLOCK_FRAMES):
+        last = min(first + BLOCK_FRAMES, num_frames)
+        block = samples[first * frame_size:last * frame_size].astype(np.float64)
+        squares = np.square(block).sum(axis=1)
+        offsets = np.arange(0, len(squares), frame_size)
+        counts = np.diff(np.append(offsets, len(squares))) * samples.shape[1]
+        # like audioop.rms, which pydub's dBFS is based on, the RMS is truncated to an integer
+        levels[first:last] = np.floor(np.sqrt(np.add.reduceat(squares, offsets) / counts))
+
+    full_scale = 2 ** (8 * sample_width - 1)
+    with np.errstate(divide='ignore'):
+        return 20 * np.log10(levels / full_scale)
+
+
+def silence_bounds_array(samples, frame_rate, sample_width, silence_threshold=SILENCE_THRESHOLD,
+                         frame_ms=FRAME_MS):
+    """
+    Return the (start, end) sample indices of the audio between its leading and trailing
+    silence, where silence is any frame of frame_ms quieter than silence_threshold.
+    Both are len(samples) if all of the audio is silent.
+    """
+    frame_size = max(int(round(frame_ms * frame_rate / 1000)), 1)
+    loud = np.flatnonzero(frame_levels(samples, frame_size, sample_width) >= silence_threshold)
+    if len(loud) == 0:
+        return len(samples), len(samples)
+    return loud[0] * frame_size, min((loud[-1] + 1) * frame_size, len(samples))
+
+
+def silence_bounds(audio, silence_threshold=SILENCE_THRESHOLD, frame_ms=FRAME_MS):
+    """
+    Return the (start, end) times in ms of an AudioSegment between its leading and
+    trailing silence. Both are len(audio) if all of the audio is silent.
+    """
+    start, end = silence_bounds_array(audio_samples(audio), audio.frame_rate, audio.sample_width,
+                                      silence_threshold, frame_ms)
+    if start == end:
+        return len(audio), len(audio)
+    # round outwards so that no sound is trimmed
+    return int(start * 1000 // audio.frame_rate), min(-(-end * 1000 // audio.frame_rate), len(audio))
+
+
+def trim_silence(audio, silence_threshold=SILENCE_THRESHOLD, frame_ms=FRAME_MS, leading=True, trailing=True):
+    """Trim the leading and/or trailing silence from an AudioSegment."""
+    start, end = silence_bounds(audio, silence_threshold, frame_ms)
+    if start == end:
+        return audio[0:0]
+    return audio[start if leading else 0:end if trailing else len(audio)]
@@ -8,58 +8,289 @@ CREATE TABLE IF NOT EXISTS supaqueue (
     id SERIAL PRIMARY KEY,
     value TEXT NOT NULL,
     queue_name TEXT NOT NULL,
-    to_be_deleted BOOLEAN DEFAULT FALSE  
+    to_be_deleted BOOLEAN DEFAULT FALSE,
+    claimed_by TEXT,
+    claimed_at TIMESTAMPTZ
 );
 
+Entries are dequeued atomically by this function, which claims the first n unclaimed
+entries of a queue by id for a session in a single statement, skipping entries another
+consumer is claiming at the same time:
+
+CREATE OR REPLACE FUNCTION supaqueue_dequeue(p_queue_name TEXT, p_n INTEGER, p_session_id TEXT)
+RETURNS TABLE (id INTEGER, value TEXT) AS $$
+    UPDATE supaqueue SET to_be_deleted = TRUE, claimed_by = p_session_id, claimed_at = NOW()
+    WHERE supaqueue.id IN (
+        SELECT supaqueue.id FROM supaqueue
+        WHERE supaqueue.queue_name = p_queue_name AND NOT supaqueue.to_be_deleted
+        ORDER BY supaqueue.id
+        LIMIT p_n
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING supaqueue.id, supaqueue.value;
+$$ LANGUAGE sql;
+
+Without the function, entries are selected and then claimed by id, in two requests.
+
+Tables made before entries were claimed by session need the claim columns added:
+
+ALTER TABLE supaqueue
+    ADD COLUMN IF NOT EXISTS claimed_by TEXT,
+    ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMPTZ;
+
+Until they are, entries are claimed without a session, as before, with a warning.
+
+A queue releases every claimed entry when it's created, as entries claimed by a run that
+crashed would otherwise never be dequeued again. A queue shared by other runs at the same
+time only releases the entries its own session claimed, and claims older than its claim
+timeout, so that the claims of the other runs are kept.
+
 It also requires environment variables to be set for SUPASET_URL and SUPASET_KEY.
 """
 from supabase import create_client
+from postgrest.exceptions import APIError
+from itertools import count
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+import threading
 import logging
 import os
 
 logger = logging.getLogger(__name__)
 
-class SupaQueue:
+# the PostgREST error code for a function that isn't in the schema cache
+MISSING_FUNCTION_ERROR = 'PGRST202'
+# the PostgREST and Postgres error codes for a column that isn't in the table
+MISSING_COLUMN_ERRORS = ('PGRST204', '42703')
+
+
+class SupabaseQueueBackend:
+    """Stores queues in the supaqueue table of Supabase."""
     table_name = 'supaqueue'
+    dequeue_function = 'supaqueue_dequeue'
 
-    def __init__(self, queue_name, case_sensitive=True):
+    def __init__(self):
+        self._connect()
+
+    def _connect(self):
         SUPASET_URL = os.environ.get('SUPASET_URL')
         SUPASET_KEY = os.environ.get('SUPASET_KEY')
-
         self.client = create_client(SUPASET_URL, SUPASET_KEY)
-        self.queue_name = queue_name
-        self.case_sensitive = case_sensitive
-        self._cleanup_incomplete_sessions()
+        self.has_dequeue_function = True
+        self.has_claim_columns = True
 
     def _table(self):
         return self.client.table(self.table_name)
 
+    def insert(self, queue_name, values):
+        self._table().insert(
+            [{"value": value, "queue_name": queue_name, "to_be_deleted": False} for value in values]).execute()
+
+    def _scoped(self, scoped, unscoped):
+        """
+        Run scoped, or unscoped if the table doesn't have the claim columns, as tables made
+        before claims were scoped by session don't.
+        """
+        if self.has_claim_columns:
+            try:
+                return scoped()
+            except APIError as e:
+                if e.code not in MISSING_COLUMN_ERRORS:
+                    raise
+                logger.warning(
+                    f"{self.table_name} doesn't have the claimed_by and claimed_at columns, so entries are "
+                    f"claimed and released without a session; add them as in the supaQueue docstring: {e}")
+                self.has_claim_columns = False
+        return unscoped()
+
+    def claim(self, queue_name, n_entries, session_id):
+        """
+        Mark the first n_entries unclaimed entries as to be deleted, claimed by session_id,
+        and return their values.
+        """
+        if self.has_dequeue_function and self.has_claim_columns:
+            try:
+                data = self.client.rpc(self.dequeue_function,
+                                       {"p_queue_name": queue_name, "p_n": n_entries,
+                                        "p_session_id": session_id}).execute()
+                return [item['value'] for item in sorted(data.data, key=lambda item: item['id'])]
+            except APIError as e:
+                if e.code != MISSING_FUNCTION_ERROR:
+                    raise
+                logger.warning(f"{self.dequeue_function} isn't installed, claiming entries by id instead: {e}")
+                self.has_dequeue_function = False
+
+        data = self._table().select("id").eq("queue_name", queue_name).eq("to_be_deleted", False).order("id").limit(n_entries).execute()
+        if not data.data:
+            return []
+        ids = [item['id'] for item in data.data]
+
+        def claim_ids(claim):
+            # entries another consumer claimed since they were selected aren't updated or returned
+            return self._table().update(claim).in_("id", ids).eq("to_be_deleted", False).execute()
+
+        data = self._scoped(
+            lambda: claim_ids({"to_be_deleted": True, "claimed_by": session_id,
+                               "claimed_at": datetime.now(timezone.utc).isoformat()}),
+            lambda: claim_ids({"to_be_deleted": True}))
+        return [item['value'] for item in sorted(data.data, key=lambda item: item['id'])]
+
+    def peek(self, queue_name, n_entries):
+        data = self._table().select("value").eq("queue_name", queue_name).eq("to_be_deleted", False).order("id").limit(n_entries).execute()
+        return [item['value'] for item in data.data]
+
+    def length(self, queue_name):
+        data = self._table().select("value").eq("queue_name", queue_name).eq("to_be_deleted", False).execute()
+        return len(data.data)
+
+    def release(self, queue_name, session_id, claimed_before):
+        """
+        Unclaim the entries of a queue claimed by session_id, or before claimed_before, or
+        every claimed entry if claimed_before is None.
+        """
+        def release(unclaim):
+            return self._table().update(unclaim).eq("queue_name", queue_name).eq("to_be_deleted", True)
+
+        def release_scoped():
+            query = release({"to_be_deleted": False, "claimed_by": None, "claimed_at": None})
+            if claimed_before is not None:
+                query = query.or_(
+                    f"claimed_by.eq.{session_id},claimed_at.lt.{claimed_before.isoformat()},claimed_at.is.null")
+            return query.execute()
+
+        self._scoped(release_scoped, lambda: release({"to_be_deleted": False}).execute())
+
+    def clear(self, queue_name):
+        self._table().delete().eq("queue_name", queue_name).execute()
+
+    def delete_claimed(self, queue_name, session_id):
+        def claimed():
+            return self._table().delete().eq("queue_name", queue_name).eq("to_be_deleted", True)
+
+        self._scoped(lambda: claimed().eq("claimed_by", session_id).execute(),
+                     lambda: claimed().execute())
+
+    def __getstate__(self):
+        return {'table_name': self.table_name}
+
+    def __setstate__(self, state):
+        # Re-create the Supabase client.
+        self._connect()
+
+
+class LocalQueueBackend:
+    """Stores queues in memory, e.g. for tests or to run without Supabase."""
+
+    def __init__(self):
+        self.rows = []
+        self._ids = count(1)
+        self._lock = threading.Lock()
+
+    def _unclaimed(self, queue_name):
+        return [row for row in self.rows if row['queue_name'] == queue_name and not row['to_be_deleted']]
+
+    def insert(self, queue_name, values):
+        with self._lock:
+            self.rows.extend({"id": next(self._ids), "value": value, "queue_name": queue_name,
+                              "to_be_deleted": False, "claimed_by": None, "claimed_at": None}
+                             for value in values)
+
+    def claim(self, queue_name, n_entries, session_id):
+        with self._lock:
+            rows = self._unclaimed(queue_name)[:n_entries]
+            for row in rows:
+                row.update(to_be_deleted=True, claimed_by=session_id, claimed_at=datetime.now(timezone.utc))
+            return [row['value'] for row in rows]
+
+    def peek(self, queue_name, n_entries):
+        with self._lock:
+            return [row['value'] for row in self._unclaimed(queue_name)[:n_entries]]
+
+    def length(self, queue_name):
+        with self._lock:
+            return len(self._unclaimed(queue_name))
+
+    def release(self, queue_name, session_id, claimed_before):
+        with self._lock:
+            for row in self.rows:
+                if row['queue_name'] == queue_name and row['to_be_deleted'] and (
+                        claimed_before is None or row['claimed_by'] == session_id
+                        or row['claimed_at'] is None or row['claimed_at'] < claimed_before):
+                    row.update(to_be_deleted=False, claimed_by=None, claimed_at=None)
+
+    def clear(self, queue_name):
+        with self._lock:
+            self.rows = [row for row in self.rows if row['queue_name'] != queue_name]
+
+    def delete_claimed(self, queue_name, session_id):
+        with self._lock:
+            self.rows = [row for row in self.rows
+                         if row['queue_name'] != queue_name or not row['to_be_deleted']
+                         or row['claimed_by'] != session_id]
+
+    def __getstate__(self):
+        return {'rows': self.rows}
+
+    def __setstate__(self, state):
+        self.rows = state['rows']
+        self._ids = count(max((row['id'] for row in self.rows), default=0) + 1)
+        self._lock = threading.Lock()
+
+
+class SupaQueue:
+    insert_chunk_size = 500  # the most rows sent in one bulk insert
+    session_id = uuid4().hex  # Shared session ID for all instances, which claims entries
+
+    def __init__(self, queue_name, case_sensitive=True, backend=None, shared=False, claim_timeout_hours=6):
+        """
+        Args:
+        queue_name (str): The name of the queue.
+        case_sensitive (bool, optional): If false, values are enqueued in lower case.
+        backend (optional): Where the queue is stored, Supabase by default.
+        shared (bool, optional): Whether other runs use the queue at the same time, so that
+            only this session's claims, and claims older than claim_timeout_hours, are released.
+        claim_timeout_hours (float, optional): How long a shared queue's claims are kept for.
+        """
+        self.backend = backend or SupabaseQueueBackend()
+        self.queue_name = queue_name
+        self.case_sensitive = case_sensitive
+        self.shared = shared
+        self.claim_timeout_hours = claim_timeout_hours
+        self._cleanup_incomplete_sessions()
+
     def enqueue(self, values):
         if not isinstance(values, list):
             values = [values]
-        
+        self.enqueue_many(values)
+
+    def enqueue_many(self, values):
+        """
+        Enqueue values in order, with a request per insert_chunk_size values. Returns the
+        values that were enqueued.
+        """
         if not self.case_sensitive:
             values = [value.lower() for value in values]
+        enqueued = []
         try:
-            for value in values:
-                logger.info(f"Enqueueing {value} to SupaQueue {self.queue_name}")
-                self._table().insert(
-                    {"value": value, "queue_name": self.queue_name, "to_be_deleted": False}).execute()
+            for i in range(0, len(values), self.insert_chunk_size):
+                chunk = values[i:i + self.insert_chunk_size]
+                logger.info(f"Enqueueing {chunk} to SupaQueue {self.queue_name}")
+                self.backend.insert(self.queue_name, chunk)
+                enqueued.extend(chunk)
         except Exception as e:
             logger.error(f"Failed to enqueue {values}, error: {e}")
+        return enqueued
 
     def dequeue(self, n_entries=1):
         """
-        Dequeue n_entries items from the queue.
+        Dequeue n_entries items from the queue. The entries are claimed by id in a single
+        statement, so concurrent consumers never dequeue the same entry.
         """
         if n_entries == 0:
             return []
         try:
-            data = self._table().select("value").eq("queue_name", self.queue_name).eq("to_be_deleted", False).order("id").limit(n_entries).execute()
-            values = [item['value'] for item in data.data]
-            for v in values:
-                logger.info(f"Dequeuing {v} from SupaQueue {self.queue_name}")
-                self._table().update({"to_be_deleted": True}).eq("queue_name", self.queue_name).eq("value", v).execute()
+            values = self.backend.claim(self.queue_name, n_entries, self.session_id)
+            logger.info(f"Dequeued {values} from SupaQueue {self.queue_name}")
             return values
         except Exception as e:
             logger.error(f"Failed to dequeue, error: {e}")
@@ -69,43 +300,47 @@ class SupaQueue:
         Returns the next n_entries items in the queue without dequeuing.
         """
         try:
-            data = self._table().select("value").eq("queue_name", self.queue_name).eq("to_be_deleted", False).order("id").limit(n_entries).execute()
-            values = [item['value'] for item in data.data]
-            return values
+            return self.backend.peek(self.queue_name, n_entries)
         except Exception as e:
             logger.error(f"Failed to peek, error: {e}")
 
 
     def _cleanup_incomplete_sessions(self):
+        """
+        Release the claimed entries, or for a shared queue, the entries claimed by this session
+        and by sessions that timed out.
+        """
         try:
-            self._table().update({"to_be_deleted": False}).eq("queue_name", self.queue_name).execute()
+            claimed_before = None
+            if self.shared:
+                claimed_before = datetime.now(timezone.utc) - timedelta(hours=self.claim_timeout_hours)
+            self.backend.release(self.queue_name, self.session_id, claimed_before)
         except Exception as e:
             logger.error(f"Failed to clean incomplete session entries, error: {e}")
-            
+
     def clear(self):
         try:
-            self._table().delete().eq("queue_name", self.queue_name).execute()
+            self.backend.clear(self.queue_name)
             logger.info(f"Cleared supaqueue: {self.queue_name}")
         except Exception as e:
             logger.error(f"Failed to clear {self.queue_name}, error: {e}")
-            
+
     def length(self):
         """
         Returns the current length (i.e., the number of items) in the queue.
         """
         try:
-            data = self._table().select("value").eq("queue_name", self.queue_name).eq("to_be_deleted", False).execute()
-            return len(data.data)
+            return self.backend.length(self.queue_name)
         except Exception as e:
             logger.error(f"Failed to get length of queue, error: {e}")
 
 
     def finalize(self):
         """
-        Finalizes the queue, deleting all entries with to_be_deleted set to True.
+        Finalizes the queue, deleting the entries this session dequeued.
         """
         try:
-            self._table().delete().eq("queue_name", self.queue_name).eq("to_be_deleted", True).execute()
+            self.backend.delete_claimed(self.queue_name, self.session_id)
             logger.info(f"Finalized queue: {self.queue_name}")
         except Exception as e:
             logger.error(f"Failed to finalize queue, error: {e}")
@@ -113,15 +348,16 @@ class SupaQueue:
     def __getstate__(self):
         return {
             'queue_name': self.queue_name,
-            'case_sensitive': self.case_sensitive
+            'case_sensitive': self.case_sensitive,
+            'backend': self.backend,
+            'shared': self.shared,
+            'claim_timeout_hours': self.claim_timeout_hours,
         }
 
     def __setstate__(self, state):
         self.queue_name = state['queue_name']
         self.case_sensitive = state['case_sensitive']
-        SUPASET_URL = os.environ.get('SUPASET_URL')
-        SUPASET_KEY = os.environ.get('SUPASET_KEY')
-
-        # Re-create the Supabase client.
-        self.client = create_client(SUPASET_URL, SUPASET_KEY)
-
+        # queues pickled before backends were added are in Supabase
+        self.backend = state.get('backend') or SupabaseQueueBackend()
+        self.shared = state.get('shared', False)
+        self.claim_timeout_hours = state.get('claim_timeout_hours', 6)
@@ -20,14 +20,19 @@ ON supasets (value, set_name);
 It also requires environment variables to be set for SUPASET_URL and SUPASET_KEY.
 """
 from supabase import create_client
+from postgrest.exceptions import APIError
 from uuid import uuid4
 import logging
 import os
+import threading
 from datetime import datetime, timedelta
 from llm_from_here.common import is_production
 
 logger = logging.getLogger(__name__)
 
+# the Postgres error code for a value that's already in the unique index
+UNIQUE_VIOLATION_ERROR = '23505'
+
 
 def clear_supaset(set_name):
     """
@@ -43,10 +48,18 @@ def clear_supaset(set_name):
 
 
 class SupaSet:
+    """
+    With local_cache, the set's values are loaded once, after expiring old entries, and
+    membership is answered from them locally, while adds and removes are written through.
+    Values added by other processes since loading aren't seen, but the unique index on
+    (value, set_name) still makes adding them fail.
+    """
     table_name = "supasets"
     session_id = uuid4().hex  # Shared session ID for all instances
+    page_size = 1000  # the default maximum rows returned by a Supabase select
+    insert_chunk_size = 500  # the most rows sent in one bulk insert
 
-    def __init__(self, set_name, autoexpire=None, case_sensitive=False):
+    def __init__(self, set_name, autoexpire=None, case_sensitive=False, local_cache=False):
         SUPASET_URL = os.environ.get("SUPASET_URL")
         SUPASET_KEY = os.environ.get("SUPASET_KEY")
 
@@ -56,9 +69,33 @@ class SupaSet:
         self.case_sensitive = case_sensitive
         self._cleanup_incomplete_sessions()
         self.autoexpire(autoexpire)
+        self._lock = threading.Lock()
+        self._values = self._load() if local_cache else None
+
+    def _load(self):
+        """Return all the values of the set, selected a page at a time."""
+        values = set()
+        start = 0
+        while True:
+            data = (
+                self._table()
+                .select("value")
+                .eq("set_name", self.set_name)
+                .order("id")
+                .range(start, start + self.page_size - 1)
+                .execute()
+            )
+            values.update(item["value"] for item in data.data)
+            if len(data.data) < self.page_size:
+                break
+            start += self.page_size
+        logger.info(f"Loaded {len(values)} values of supaset {self.set_name}")
+        return values
 
     def clear(self):
         clear_supaset(self.set_name)
+        if self._values is not None:
+            self._values.clear()
 
     def autoexpire(self, autoexpire):
         if autoexpire:
@@ -89,29 +126,99 @@ class SupaSet:
         """
         if not self.case_sensitive:
             value = value.lower()
+        if self._values is not None:
+            return self._add_local(value)
         try:
             logger.info(f"Adding {value} to supaset {self.set_name}")
             if value in self:
                 return False
-            self._table().insert(
-                {
-                    "value": value,
-                    "session_id": str(self.session_id),
-                    "set_name": self.set_name,
-                    "is_session_complete": False,
-                }
-            ).execute()
+            self._insert(value)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to insert {value}, error: {e}")
+
+    def _add_local(self, value):
+        # claim the value locally first so concurrent adds of it don't both insert it
+        with self._lock:
+            if value in self._values:
+                return False
+            self._values.add(value)
+        try:
+            logger.info(f"Adding {value} to supaset {self.set_name}")
+            self._insert(value)
             return True
         except Exception as e:
+            if isinstance(e, APIError) and e.code == UNIQUE_VIOLATION_ERROR:
+                # the value was added by another process, so it stays in the local set
+                logger.info(f"{value} was already added to supaset {self.set_name}")
+                return False
+            # the value wasn't written, so it isn't in the set
             logger.error(f"Failed to insert {value}, error: {e}")
+            with self._lock:
+                self._values.discard(value)
+
+    def _insert(self, value):
+        self._table().insert(
+            {
+                "value": value,
+                "session_id": str(self.session_id),
+                "set_name": self.set_name,
+                "is_session_complete": False,
+            }
+        ).execute()
+
+    def add_many(self, values):
+        """
+        Add values to the set with a request per insert_chunk_size values, rather than two
+        per value. Returns the values that were added, i.e. that weren't already in the set.
+        """
+        if not self.case_sensitive:
+            values = [value.lower() for value in values]
+        values = list(dict.fromkeys(values))
+        if self._values is not None:
+            with self._lock:
+                values = [value for value in values if value not in self._values]
+
+        added = []
+        for i in range(0, len(values), self.insert_chunk_size):
+            chunk = values[i:i + self.insert_chunk_size]
+            try:
+                logger.info(f"Adding {len(chunk)} values to supaset {self.set_name}")
+                # values already in the set are skipped, and only the new rows are returned
+                data = self._table().upsert(
+                    [
+                        {
+                            "value": value,
+                            "session_id": str(self.session_id),
+                            "set_name": self.set_name,
+                            "is_session_complete": False,
+                        }
+                        for value in chunk
+                    ],
+                    on_conflict="value,set_name",
+                    ignore_duplicates=True,
+                ).execute()
+                inserted = {item["value"] for item in data.data}
+                added.extend(value for value in chunk if value in inserted)
+                # the chunk's values are in the table now, whether or not they were new
+                if self._values is not None:
+                    with self._lock:
+                        self._values.update(chunk)
+            except Exception as e:
+                logger.error(f"Failed to insert {len(chunk)} values, error: {e}")
+        return added
 
     def remove(self, value):
         if not self.case_sensitive:
             value = value.lower()
         try:
-            self._table().delete().eq("value", value).eq(
+            data = self._table().delete().eq("value", value).eq(
                 "session_id", str(self.session_id)
             ).eq("set_name", self.set_name).execute()
+            # a value added by another session isn't deleted, so it stays in the local set too
+            if self._values is not None and data.data:
+                with self._lock:
+                    self._values.discard(value)
         except Exception as e:
             logger.error(f"Failed to remove {value}, error: {e}")
 
@@ -136,6 +243,9 @@ class SupaSet:
             logger.error(f"Failed to delete incomplete session entries, error: {e}")
 
     def elements(self):
+        if self._values is not None:
+            with self._lock:
+                return list(self._values)
         try:
             data = self._table().select("value").eq("set_name", self.set_name).execute()
             return [item["value"] for item in data.data]
@@ -145,6 +255,8 @@ class SupaSet:
     def __contains__(self, value):
         if not self.case_sensitive:
             value = value.lower()
+        if self._values is not None:
+            return value in self._values
         logger.info(f"Checking if {value} is in supaset {self.set_name}")
         try:
             data = (
@@ -0,0 +1,119 @@
+import unittest
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+from llm_from_here.artifactStore import ArtifactStore, replace_on_write
+
+
+def write_file(path, content=b'audio'):
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+class ArtifactStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = ArtifactStore(os.path.join(self.temp_dir.name, 'store'))
+        self.run1 = os.path.join(self.temp_dir.name, 'show_run1')
+        self.run2 = os.path.join(self.temp_dir.name, 'show_run2')
+        os.makedirs(self.run1)
+        os.makedirs(self.run2)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_key(self):
+        self.assertEqual(ArtifactStore.key('gtts', 'hello', lang='en'), ArtifactStore.key('gtts', 'hello', lang='en'))
+        self.assertNotEqual(ArtifactStore.key('gtts', 'hello', lang='en'), ArtifactStore.key('gtts', 'hello', lang='fr'))
+        self.assertNotEqual(ArtifactStore.key('gtts', 'hello'), ArtifactStore.key('openai_tts', 'hello'))
+
+    def test_fetch_reuses_stored_file(self):
+        key = ArtifactStore.key('gtts', 'hello')
+        produce = MagicMock(side_effect=write_file)
+
+        self.store.fetch(key, os.path.join(self.run1, 'a.wav'), produce)
+        self.store.fetch(key, os.path.join(self.run2, 'b.wav'), produce)
+
+        produce.assert_called_once_with(os.path.join(self.run1, 'a.wav'))
+        with open(os.path.join(self.run2, 'b.wav'), 'rb') as f:
+            self.assertEqual(f.read(), b'audio')
+        self.assertTrue(os.path.samefile(os.path.join(self.run2, 'b.wav'), self.store.path(key)))
+
+    def test_fetch_replaces_existing_output(self):
+        key = ArtifactStore.key('gtts', 'hello')
+        self.store.fetch(key, os.path.join(self.run1, 'a.wav'), write_file)
+        write_file(os.path.join(self.run2, 'a.wav'), b'stale')
+        self.store.fetch(key, os.path.join(self.run2, 'a.wav'), write_file)
+        with open(os.path.join(self.run2, 'a.wav'), 'rb') as f:
+            self.assertEqual(f.read(), b'audio')
+
+    def test_producing_over_a_linked_file_keeps_the_stored_file(self):
+        output_file = os.path.join(self.run1, 'a.wav')
+        self.store.fetch('a', output_file, write_file)
+        self.assertFalse(os.stat(self.store.path('a')).st_mode & 0o222)
+
+        # a later show produces another file at the same path
+        self.store.fetch('b', output_file, lambda path: write_file(path, b'other'))
+        with open(self.store.path('a'), 'rb') as f:
+            self.assertEqual(f.read(), b'audio')
+
+    def test_replace_on_write_keeps_the_stored_file(self):
+        output_file = os.path.join(self.run1, 'a.wav')
+        self.store.fetch('a', output_file, write_file)
+        with replace_on_write(output_file) as path:
+            write_file(path, b'edited')
+
+        with open(output_file, 'rb') as f:
+            self.assertEqual(f.read(), b'edited')
+        with open(self.store.path('a'), 'rb') as f:
+            self.assertEqual(f.read(), b'audio')
+        self.assertEqual(os.listdir(self.run1), ['a.wav'])
+
+    def test_empty_files_are_not_stored(self):
+        key = ArtifactStore.key('youtube', 'url')
+        self.store.fetch(key, os.path.join(self.run1, 'a.wav'), lambda path: write_file(path, b''))
+        self.assertFalse(os.path.exists(self.store.path(key)))
+
+    def test_disabled(self):
+        store = ArtifactStore(self.store.root, enabled=False)
+        produce = MagicMock(side_effect=write_file)
+        store.fetch('key', os.path.join(self.run1, 'a.wav'), produce)
+        store.fetch('key', os.path.join(self.run2, 'a.wav'), produce)
+        self.assertEqual(produce.call_count, 2)
+        self.assertFalse(os.path.exists(store.path('key')))
+
+    def test_evicts_least_recently_used(self):
+        store = ArtifactStore(self.store.root, max_bytes=15)
+        for i, key in enumerate(['a', 'b', 'c']):
+            store.fetch(key, os.path.join(self.run1, f'{key}.wav'), write_file)
+            os.utime(store.path(key), (i, i))
+        store.fetch('a', os.path.join(self.run2, 'a.wav'), write_file)
+        store.fetch('d', os.path.join(self.run2, 'd.wav'), write_file)
+
+        self.assertEqual([os.path.exists(store.path(key)) for key in 'abcd'], [True, False, True, True])
+        self.assertEqual(store.stats['hits'], 1)
+        self.assertEqual(store.stats['misses'], 4)
+        self.assertEqual(store.stats['evictions'], 1)
+
+    def test_put_only_scans_when_over_bound(self):
+        store = ArtifactStore(self.store.root, max_bytes=12)
+        with patch('llm_from_here.artifactStore.os.walk', wraps=os.walk) as walk:
+            store.fetch('a', os.path.join(self.run1, 'a.wav'), write_file)
+            store.fetch('b', os.path.join(self.run1, 'b.wav'), write_file)
+            walk.assert_not_called()
+            store.fetch('c', os.path.join(self.run1, 'c.wav'), write_file)
+            walk.assert_called_once()
+        self.assertEqual(store.stats['evictions'], 1)
+
+    def test_concurrent_puts_keep_the_size(self):
+        store = ArtifactStore(self.store.root, max_bytes=10 ** 6)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda key: store.fetch(key, os.path.join(self.run1, f'{key}.wav'), write_file),
+                              [str(i) for i in range(50)]))
+        self.assertEqual(store._size, store._scan_size())
+        self.assertEqual(store.stats['misses'], 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,11 +3,18 @@ import unittest
 from unittest.mock import patch, MagicMock, call
 from pydub import AudioSegment, generators
 import os
-from llm_from_here.plugins.audioTimeline import AudioTimeline, SegmentLabel
+from llm_from_here.plugins.audioTimeline import AudioTimeline, SegmentLabel, IntervalIndex, audio_to_array, array_to_audio
+import pickle
+import random
 import tempfile
 import numpy as np
 
 
+def generate_constant_audio(duration, value, sample_rate=1000):
+    samples = np.full((int(duration * sample_rate / 1000), 1), value, dtype=np.int16)
+    return AudioSegment(samples.tobytes(), frame_rate=sample_rate, sample_width=2, channels=1)
+
+
 def generate_noisy_audio(duration, sample_rate=44100, channels=2, bit_depth=16):
     num_samples = int(duration * sample_rate / 1000)
     random_samples = np.random.randint(-2**(bit_depth - 1), 2**(bit_depth - 1), size=(num_samples, channels))
@@ -68,6 +75,92 @@ class AudioTimelineTest(unittest.TestCase):
         self.assertEqual(self.timeline.timeline[1]['end_time'], duration1 + duration2)
 
 
+    def test_get_last_entry_per_label(self):
+        self.timeline.add_to_timeline(generate_noisy_audio(1000), start_time=0, name='fg1')
+        self.timeline.add_background(generate_noisy_audio(1000), start_time=0, name='bg1')
+        self.timeline.add_after_previous(generate_noisy_audio(500), name='fg2')
+
+        self.assertEqual(self.timeline.get_last_entry()['name'], 'fg2')
+        self.assertEqual(self.timeline.get_last_entry(label=SegmentLabel.BACKGROUND)['name'], 'bg1')
+        self.assertEqual(self.timeline.get_last_end_time(), 1500)
+
+    def test_get_last_entry_sees_entries_added_through_shared_timeline(self):
+        other = AudioTimeline()
+        other.timeline = self.timeline.timeline
+        self.timeline.add_to_timeline(generate_noisy_audio(1000), start_time=0, name='fg1')
+        self.assertEqual(other.get_last_entry()['name'], 'fg1')
+        other.add_after_previous(generate_noisy_audio(1000), name='fg2')
+        self.assertEqual(self.timeline.get_last_entry()['name'], 'fg2')
+        self.assertEqual(self.timeline.get_last_end_time(), 2000)
+
+    def test_entries_at_and_between(self):
+        self.timeline.add_to_timeline(generate_noisy_audio(1000), start_time=0, name='fg1')
+        self.timeline.add_background(generate_noisy_audio(1000), start_time=500, end_time=3000, name='bg1')
+        self.timeline.add_after_previous(generate_noisy_audio(1000), name='fg2')
+
+        self.assertEqual([e['name'] for e in self.timeline.entries_at(200)], ['fg1'])
+        self.assertEqual([e['name'] for e in self.timeline.entries_at(1500)], ['bg1', 'fg2'])
+        self.assertEqual([e['name'] for e in self.timeline.entries_between(900, 1100)], ['fg1', 'bg1', 'fg2'])
+        self.assertEqual(self.timeline.entries_at(3000), [])
+
+    def test_interval_index_matches_linear_scan(self):
+        random.seed(0)
+        intervals = [(start, start + random.randint(0, 500)) for start in
+                     (random.randint(0, 5000) for _ in range(200))]
+        index = IntervalIndex(intervals)
+        for _ in range(200):
+            start = random.randint(-100, 5500)
+            end = start + random.randint(1, 700)
+            expected = [i for i, (s, e) in enumerate(intervals) if s < e and s < end and e > start]
+            self.assertEqual(index.overlapping(start, end), expected)
+
+    def test_pickle_rebuilds_index(self):
+        self.timeline.add_to_timeline(generate_noisy_audio(1000), start_time=0, name='fg1')
+        self.timeline.entries_at(0)
+        restored = pickle.loads(pickle.dumps(self.timeline))
+        self.assertEqual(restored.get_last_entry()['name'], 'fg1')
+        self.assertEqual(len(restored.entries_at(0)), 1)
+
+    def test_file_entries_decode_at_render(self):
+        audio = AudioSegment.silent(duration=500, frame_rate=44100) + generate_noisy_audio(1500)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = f"{temp_dir}/clip.wav"
+            audio.export(filename, format='wav')
+            self.timeline.add_to_timeline(filename, start_time=0, duration=2500, gain=-3, fade_out=100)
+
+            entry = self.timeline.get_last_entry()
+            self.assertEqual(entry.source, filename)
+            self.assertEqual(entry.leading_silence, 500)
+            self.assertEqual(entry.duration, 2000)
+            self.assertEqual(entry['end_time'], 2000)
+            self.assertLess(len(pickle.dumps(self.timeline)), 1000)
+
+            in_memory = AudioTimeline()
+            in_memory.add_to_timeline(audio, start_time=0, duration=2500, gain=-3, fade_out=100)
+            self.assertEqual(self.timeline.mix(), in_memory.mix())
+
+    def test_fade_in_and_fade_out_are_both_applied(self):
+        audio = generate_constant_audio(1000, 10000)
+        self.timeline.add_to_timeline(audio, start_time=0, fade_in=200, fade_out=200)
+
+        samples = audio_to_array(self.timeline.get_last_entry()['audio'])[:, 0]
+        self.assertLess(abs(samples[0]), 1000)
+        self.assertLess(abs(samples[-1]), 1000)
+        self.assertEqual(samples[500], 10000)
+
+    def test_entry_reads_like_a_dict(self):
+        audio = generate_noisy_audio(1000)
+        self.timeline.add_to_timeline(audio, start_time=0, name='fg1', type='music')
+        entry = self.timeline.get_last_entry()
+        self.assertEqual(entry.keys(), ['audio', 'start_time', 'label', 'end_time', 'name', 'type'])
+        self.assertEqual(entry.get('type'), 'music')
+        self.assertIsNone(entry.get('missing'))
+        self.assertEqual(len(entry['audio']), 1000)
+        entry['name'] = 'renamed'
+        self.assertEqual(entry.name, 'renamed')
+        with self.assertRaises(KeyError):
+            entry['missing']
+
     def test_loop_audio(self):
         audio = AudioSegment.silent(duration=1000)
         duration = 5000
@@ -93,6 +186,66 @@ class AudioTimelineTest(unittest.TestCase):
             # Assert that the file was rendered successfully
             self.assertTrue(os.path.exists(filename))
 
+    def test_mix_sums_entries_at_offsets(self):
+        self.timeline._add_to_timeline(generate_constant_audio(1000, 100), 0, end_time=1000)
+        self.timeline._add_to_timeline(generate_constant_audio(1000, 50), 500, end_time=1500)
+
+        samples = audio_to_array(self.timeline.mix())[:, 0]
+
+        self.assertEqual(len(samples), 1500)
+        self.assertTrue(np.all(samples[:500] == 100))
+        self.assertTrue(np.all(samples[500:1000] == 150))
+        self.assertTrue(np.all(samples[1000:] == 50))
+
+    def test_mix_loops_to_end_time(self):
+        audio = AudioSegment(np.arange(1, 251, dtype=np.int16).tobytes(), frame_rate=1000,
+                             sample_width=2, channels=1)
+        self.timeline._add_to_timeline(audio, 0, label=SegmentLabel.BACKGROUND, end_time=1000)
+
+        samples = audio_to_array(self.timeline.mix())[:, 0]
+
+        self.assertEqual(len(samples), 1000)
+        np.testing.assert_array_equal(samples, np.tile(np.arange(1, 251), 4))
+
+    def test_add_clip_loops_into_window(self):
+        samples = np.arange(1, 8).reshape(-1, 1)
+        mixed = np.zeros((20, 1), dtype=np.int32)
+        # a 30 frame clip starting 3 frames before a window of frames 10 to 30
+        AudioTimeline._add_clip(mixed, 10, samples, 7, 30)
+        expected = np.tile(np.arange(1, 8), 5)[3:23]
+        np.testing.assert_array_equal(mixed[:, 0], expected)
+
+    def test_mix_clips_overflow(self):
+        self.timeline._add_to_timeline(generate_constant_audio(100, 30000), 0, end_time=100)
+        self.timeline._add_to_timeline(generate_constant_audio(100, 30000), 0, end_time=100)
+
+        samples = audio_to_array(self.timeline.mix())[:, 0]
+
+        self.assertTrue(np.all(samples == 32767))
+
+    def test_render_stream_matches_mix(self):
+        self.timeline._add_to_timeline(generate_noisy_audio(700), 0, end_time=700)
+        self.timeline._add_to_timeline(generate_noisy_audio(300), 0, label=SegmentLabel.BACKGROUND, end_time=1600)
+        self.timeline._add_to_timeline(generate_noisy_audio(900), 700, end_time=1600)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = f"{temp_dir}/test_audio.wav"
+            self.timeline.render_stream(filename, 'wav', window_ms=250)
+            rendered = AudioSegment.from_wav(filename)
+
+        self.assertEqual(rendered, self.timeline.mix())
+
+    def test_mix_windows_are_window_sized(self):
+        self.timeline._add_to_timeline(generate_constant_audio(1000, 100), 0, end_time=1000)
+
+        windows = [mixed for mixed, _, _ in self.timeline.mix_windows(window_ms=300)]
+
+        self.assertEqual([len(mixed) for mixed in windows], [300, 300, 300, 100])
+
+    def test_array_to_audio_round_trip(self):
+        audio = generate_noisy_audio(100)
+        self.assertEqual(array_to_audio(audio_to_array(audio), audio.frame_rate, audio.sample_width), audio)
+
     def test_visualize_timeline(self):
         audio = AudioSegment.silent(duration=1000)
         self.timeline.add_to_timeline(audio, start_time=0)
@@ -17,6 +17,7 @@ class TestFreeSound(unittest.TestCase):
     def test_search_and_download_top_samples(self, mock_search_samples):
         # Mock the sound object returned by the Freesound API
         mock_sound = MagicMock(spec=Sound)
+        mock_sound.id = 1
         mock_sound.name = "mock_sound"
         mock_sound.avg_rating = 5.0
         mock_search_samples.return_value = [mock_sound]
@@ -29,6 +30,7 @@ class TestFreeSound(unittest.TestCase):
     def test_execute(self, mock_search_samples):
         # Mock the sound object returned by the Freesound API
         mock_sound = MagicMock(spec=Sound)
+        mock_sound.id = 1
         mock_sound.name = "mock_sound"
         mock_sound.avg_rating = 5.0
         mock_search_samples.return_value = [mock_sound]
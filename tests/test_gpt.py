@@ -1,9 +1,12 @@
 import unittest
+import asyncio
+import threading
 import jsonschema
-from unittest.mock import patch, MagicMock
-from llm_from_here.plugins.gpt import ChatApp
+from unittest.mock import patch, MagicMock, AsyncMock
+from llm_from_here.plugins.gpt import ChatApp, retry_after, parse_list_response, get_validator
 import json
 import openai
+from openai.types.chat import ChatCompletionChunk
 
 class TestChatApp(unittest.TestCase):
     @patch('llm_from_here.plugins.gpt.openai.OpenAI')
@@ -100,6 +103,285 @@ class TestChatApp(unittest.TestCase):
 
         self.assertEqual(result, json.loads(valid_response))
 
+    @patch('llm_from_here.plugins.gpt.openai.AsyncOpenAI')
+    def test_chat_many(self, mock_async_openai):
+        client = mock_async_openai.return_value
+        client.__aenter__.return_value = client
+        running = []
+        max_running = []
+
+        async def create(model, messages):
+            running.append(messages[-1]["content"])
+            max_running.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(messages[-1]["content"])
+            # every prompt is sent after the conversation so far, and not the other prompts
+            self.assertEqual(len(messages), 2)
+            return MagicMock(choices=[MagicMock(message=MagicMock(content=f'"{messages[-1]["content"]} response"'))])
+
+        client.chat.completions.create = AsyncMock(side_effect=create)
+        responses = self.chat_app.chat_many(["a", "b", "c"], strip_quotes=True, max_concurrency=2)
+
+        self.assertEqual(responses, ["a response", "b response", "c response"])
+        self.assertEqual(max(max_running), 2)
+        self.assertEqual([m["content"] for m in self.chat_app.messages[1:]],
+                         ['"a response"', '"b response"', '"c response"'])
+        self.assertEqual(len(self.chat_app.responses), 3)
+
+    @patch('llm_from_here.plugins.gpt.openai.AsyncOpenAI')
+    def test_chat_many_reuses_the_async_client(self, mock_async_openai):
+        mock_async_openai.return_value.chat.completions.create = AsyncMock(
+            return_value=MagicMock(choices=[MagicMock(message=MagicMock(content="Test response"))]))
+
+        self.chat_app.chat_many(["a", "b"])
+        self.chat_app.chat_many(["c"])
+
+        mock_async_openai.assert_called_once()
+        self.assertEqual(mock_async_openai.return_value.chat.completions.create.await_count, 3)
+
+    def test_fork_and_join(self):
+        self.mock_client.chat.completions.create.side_effect = lambda model, messages: MagicMock(
+            choices=[MagicMock(message=MagicMock(content=f"{messages[-1]['content']} response"))])
+        self.chat_app.chat("first")
+        forks = [self.chat_app.fork(), self.chat_app.fork()]
+
+        # forks continue the conversation without seeing each other's turns
+        forks[1].chat("b")
+        forks[0].chat("a")
+        sent = [c.kwargs["messages"] for c in self.mock_client.chat.completions.create.call_args_list]
+        self.assertEqual([m["content"] for m in sent[1]], ["Welcome", "first response", "b"])
+        self.assertEqual([m["content"] for m in sent[2]], ["Welcome", "first response", "a"])
+        self.assertEqual(len(self.chat_app.messages), 2)
+
+        for fork in forks:
+            self.chat_app.join(fork)
+        self.assertEqual([m["content"] for m in self.chat_app.messages[1:]],
+                         ["first response", "a response", "b response"])
+        self.assertEqual(len(self.chat_app.responses), 3)
+        self.assertEqual(len(self.chat_app.usage), 3)
+
+    @patch('llm_from_here.plugins.gpt.asyncio.sleep', new_callable=AsyncMock)
+    @patch('llm_from_here.plugins.gpt.openai.AsyncOpenAI')
+    def test_achat_honours_retry_after(self, mock_async_openai, mock_sleep):
+        client = mock_async_openai.return_value
+        client.__aenter__.return_value = client
+        rate_limit = openai.RateLimitError(
+            "rate limited", response=MagicMock(status_code=429, headers={"retry-after": "1.5"}), body=None)
+        client.chat.completions.create = AsyncMock(side_effect=[
+            rate_limit, MagicMock(choices=[MagicMock(message=MagicMock(content="Test response"))])])
+
+        response = asyncio.run(self.chat_app.achat("Test message"))
+
+        self.assertEqual(response, "Test response")
+        mock_sleep.assert_awaited_once_with(1.5)
+        self.assertEqual(self.chat_app.messages[-1]["content"], "Test response")
+
+    def test_enforce_json_response_structured(self):
+        json_schema = {"type": "array", "items": {"type": "string"}}
+        self.mock_client.chat.completions.create.return_value = MagicMock(
+            choices=[MagicMock(message=MagicMock(content='{"response": ["a", "b"]}'))])
+
+        result = self.chat_app.enforce_json_response("Hello", json_schema, structured=True)
+
+        self.assertEqual(result, ["a", "b"])
+        kwargs = self.mock_client.chat.completions.create.call_args.kwargs
+        self.assertEqual(kwargs["messages"][-1]["content"], "Hello")
+        self.assertEqual(kwargs["response_format"]["type"], "json_schema")
+        self.assertEqual(kwargs["response_format"]["json_schema"]["schema"]["properties"]["response"], json_schema)
+
+    def test_enforce_json_response_structured_retries_refusals_and_bad_json(self):
+        json_schema = {"type": "object", "properties": {"answer": {"type": "string"}}}
+        self.mock_client.chat.completions.create.side_effect = [
+            MagicMock(choices=[MagicMock(message=MagicMock(content=None, refusal="No"))]),
+            MagicMock(choices=[MagicMock(message=MagicMock(content='{"answer": '))]),
+            MagicMock(choices=[MagicMock(message=MagicMock(content='{"answer": "yes"}'))])]
+
+        result = self.chat_app.enforce_json_response("Hello", json_schema, structured=True, delay=0)
+
+        self.assertEqual(result, {"answer": "yes"})
+        json_schema_format = self.mock_client.chat.completions.create.call_args.kwargs["response_format"]["json_schema"]
+        self.assertTrue(json_schema_format["strict"])
+        self.assertEqual(json_schema_format["schema"]["required"], ["answer"])
+        self.assertFalse(json_schema_format["schema"]["additionalProperties"])
+        self.assertNotIn("required", json_schema)
+
+    def test_enforce_json_response_structured_unsupported(self):
+        json_schema = {"type": "object", "properties": {"response": {"type": "string"}}}
+        bad_request = openai.BadRequestError(
+            "response_format is not supported", response=MagicMock(status_code=400, headers={}), body=None)
+        self.mock_client.chat.completions.create.side_effect = [
+            bad_request, MagicMock(choices=[MagicMock(message=MagicMock(content='{"response": "World"}'))])]
+
+        with patch.object(ChatApp, 'structured_output_unsupported', set()):
+            result = self.chat_app.enforce_json_response("Hello", json_schema, structured=True, delay=0)
+            self.assertIn(ChatApp.MODEL_NAME, ChatApp.structured_output_unsupported)
+
+        self.assertEqual(result, {"response": "World"})
+        kwargs = self.mock_client.chat.completions.create.call_args.kwargs
+        self.assertNotIn("response_format", kwargs)
+        self.assertIn(json.dumps(json_schema), kwargs["messages"][-1]["content"])
+
+    def test_enforce_json_response_structured_schema_rejected(self):
+        json_schema = {"type": "object", "properties": {"response": {"type": "string", "minLength": 1}}}
+        invalid_schema = openai.BadRequestError(
+            "Invalid schema for response_format 'response': 'minLength' is not permitted.",
+            response=MagicMock(status_code=400, headers={}), body=None)
+        other_error = openai.BadRequestError(
+            "Too many messages", response=MagicMock(status_code=400, headers={}), body=None)
+        response = MagicMock(choices=[MagicMock(message=MagicMock(content='{"response": "World"}'))])
+        self.mock_client.chat.completions.create.side_effect = [invalid_schema, response, other_error, response]
+
+        with patch.object(ChatApp, 'structured_output_unsupported', set()), \
+                patch.object(ChatApp, 'structured_schema_unsupported', set()):
+            # only the rejected schema falls back from then on
+            self.assertEqual(self.chat_app.enforce_json_response("Hello", json_schema, structured=True),
+                             {"response": "World"})
+            self.assertEqual(ChatApp.structured_output_unsupported, set())
+            self.assertEqual(len(ChatApp.structured_schema_unsupported), 1)
+
+            # other bad requests fall back for that call only
+            self.assertEqual(self.chat_app.enforce_json_response("Hello", {"type": "object"}, structured=True),
+                             {"response": "World"})
+            self.assertEqual(ChatApp.structured_output_unsupported, set())
+            self.assertEqual(len(ChatApp.structured_schema_unsupported), 1)
+
+    def test_enforce_json_response_structured_optional_properties(self):
+        json_schema = {"type": "object",
+                       "properties": {"name": {"type": "string"}, "year": {"type": "integer"}},
+                       "required": ["name"]}
+        self.mock_client.chat.completions.create.return_value = MagicMock(
+            choices=[MagicMock(message=MagicMock(content='{"name": "Tom", "year": null}'))])
+
+        result = self.chat_app.enforce_json_response("Hello", json_schema, structured=True)
+
+        self.assertEqual(result, {"name": "Tom"})
+        strict = self.mock_client.chat.completions.create.call_args.kwargs["response_format"]["json_schema"]["schema"]
+        self.assertEqual(strict["required"], ["name", "year"])
+        self.assertEqual(strict["properties"]["name"], {"type": "string"})
+        self.assertEqual(strict["properties"]["year"], {"type": ["integer", "null"]})
+
+    def test_get_validator_is_cached(self):
+        self.assertIs(get_validator({"type": "string", "minLength": 1}), get_validator({"minLength": 1, "type": "string"}))
+
+    def test_usage_accounting(self):
+        self.mock_client.chat.completions.create.return_value = MagicMock(
+            choices=[MagicMock(message=MagicMock(content="Test response"))],
+            usage=MagicMock(prompt_tokens=10, completion_tokens=5,
+                            prompt_tokens_details=MagicMock(cached_tokens=4)))
+        self.chat_app.chat("Test message")
+        self.chat_app.chat("Test message")
+
+        total = self.chat_app.total_usage()
+        self.assertEqual((total["requests"], total["prompt_tokens"], total["completion_tokens"], total["cached_tokens"]),
+                         (2, 20, 10, 8))
+        self.assertGreaterEqual(total["seconds"], 0)
+
+    def test_usage_accounting_ignores_missing_usage(self):
+        self.chat_app.chat("Test message")
+        self.assertEqual(self.chat_app.total_usage()["prompt_tokens"], 0)
+
+    def test_history_policy_pin(self):
+        self.chat_app.history_policy = {"type": "pin", "last_n": 2}
+        for i in range(4):
+            self.mock_client.chat.completions.create.return_value = MagicMock(
+                choices=[MagicMock(message=MagicMock(content=f"response {i}"))])
+            self.chat_app.chat(f"message {i}")
+
+        self.assertEqual([m["content"] for m in self.chat_app.messages],
+                         [self.system_message, "response 2", "response 3"])
+        self.assertEqual(len(self.chat_app.responses), 2)
+
+    def test_history_policy_summarize(self):
+        self.chat_app.history_policy = {"type": "summarize", "max_tokens": 60}
+        self.mock_client.chat.completions.create.side_effect = [
+            MagicMock(choices=[MagicMock(message=MagicMock(content="x" * 100))]),
+            MagicMock(choices=[MagicMock(message=MagicMock(content="y" * 100))]),
+            MagicMock(choices=[MagicMock(message=MagicMock(content="short"))]),
+        ]
+        self.chat_app.chat("first")
+        self.chat_app.chat("second")
+
+        self.assertEqual(self.chat_app.messages[1],
+                         {"role": "system", "content": "Summary of the earlier conversation: short"})
+        self.assertEqual(self.chat_app.messages[2]["content"], "y" * 100)
+        summary_request = self.mock_client.chat.completions.create.call_args.kwargs["messages"]
+        self.assertEqual(summary_request[1]["content"], "x" * 100)
+
+    def test_history_policy_type(self):
+        with self.assertRaises(ValueError):
+            ChatApp("Welcome", history_policy={"type": "forget"})
+
+    def test_chat_stream(self):
+        def chunk(content, finish_reason=None, usage=None):
+            return ChatCompletionChunk.model_validate({
+                "id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 0, "model": "gpt-test",
+                "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": finish_reason}],
+                "usage": usage,
+            })
+
+        self.mock_client.chat.completions.create.return_value = iter([
+            chunk("Hello"), chunk(" world"), chunk(None, "stop"),
+            chunk(None, usage={"prompt_tokens": 3, "completion_tokens": 2, "total_tokens": 5})])
+
+        pieces = list(self.chat_app.chat_stream("Test message"))
+
+        self.assertEqual(pieces, ["Hello", " world"])
+        self.assertTrue(self.mock_client.chat.completions.create.call_args.kwargs["stream"])
+        self.assertEqual(self.chat_app.messages[-1], {"role": "assistant", "content": "Hello world"})
+        self.assertEqual(self.chat_app.responses[-1].choices[0].message.content, "Hello world")
+        self.assertEqual(self.chat_app.total_usage()["completion_tokens"], 2)
+
+    def test_unfinished_chat_stream_doesnt_block(self):
+        chunk = ChatCompletionChunk.model_validate({
+            "id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 0, "model": "gpt-test",
+            "choices": [{"index": 0, "delta": {"content": "Streamed"}, "finish_reason": "stop"}]})
+        self.mock_client.chat.completions.create.side_effect = [
+            iter([chunk]), MagicMock(choices=[MagicMock(message=MagicMock(content="Other"))])]
+
+        stream = self.chat_app.chat_stream("First")
+        next(stream)
+        other = threading.Thread(target=self.chat_app.chat, args=("Second",))
+        other.start()
+        other.join(1)
+        # the other thread's turn doesn't wait for the stream
+        self.assertFalse(other.is_alive())
+        second_messages = self.mock_client.chat.completions.create.call_args_list[1].kwargs["messages"]
+        self.assertEqual([m["content"] for m in second_messages[1:]], ["Second"])
+        list(stream)
+        self.assertEqual([m["content"] for m in self.chat_app.messages[1:]], ["Other", "Streamed"])
+
+    def test_parse_list_response(self):
+        self.assertEqual(parse_list_response("'''\n- a\n- b\n'''"), ["a", "b"])
+        self.assertEqual(parse_list_response("```\n- a: b: c\n- d\n```"), ["a: b: c", "d"])
+        with self.assertRaises(ValueError):
+            parse_list_response("no list here")
+
+    def test_enforce_list_response_consensus(self):
+        def completion(*contents):
+            return MagicMock(choices=[MagicMock(message=MagicMock(content=c)) for c in contents])
+
+        self.mock_client.chat.completions.create.side_effect = [
+            completion("'''\n- a\n- b\n- c\n'''", "'''\n- a\n- d\n- e\n'''"),
+            completion("'''\n- b\n- d\n- f\n'''", "not a list"),
+        ]
+        result = self.chat_app.enforce_list_response_consensus("Hello", num_entries=3, num_consensus=2)
+
+        self.assertEqual(sorted(result), ["a", "b", "d"])
+        self.assertEqual(self.mock_client.chat.completions.create.call_count, 2)
+        self.assertEqual(self.mock_client.chat.completions.create.call_args.kwargs["n"], 2)
+
+    def test_enforce_list_response_consensus_max_rounds(self):
+        self.mock_client.chat.completions.create.return_value = MagicMock(
+            choices=[MagicMock(message=MagicMock(content="'''\n- a\n'''"))] * 2)
+        result = self.chat_app.enforce_list_response_consensus("Hello", num_entries=3, max_rounds=2)
+        self.assertEqual(result, ["a"])
+        self.assertEqual(self.mock_client.chat.completions.create.call_count, 2)
+
+    def test_retry_after(self):
+        self.assertEqual(retry_after(MagicMock(response=MagicMock(headers={"retry-after-ms": "250"}))), 0.25)
+        self.assertIsNone(retry_after(MagicMock(response=MagicMock(headers={}))))
+        self.assertIsNone(retry_after(ValueError()))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -33,3 +33,10 @@ class TestGuestSelection:
         result = guest_selection.get_params(guest_category)
         assert result == ("test_name", "test_prompt", 1, 1, 100, 1, 1)
 
+
+    def test_add_to_queue_consensus(self, guest_selection, mock_supa_queue, mock_chat_app):
+        guest_selection.params["consensus"] = True
+        mock_chat_app.enforce_list_response_consensus.return_value = ['guest1']
+        guest_selection.add_to_queue(mock_supa_queue, 1, 'Hello')
+        mock_chat_app.enforce_list_response_consensus.assert_called_with('Hello', 1, log_prompt=True)
+        mock_supa_queue.enqueue.assert_called_with(['guest1'])
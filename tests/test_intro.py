@@ -1,6 +1,7 @@
 import unittest
 from unittest.mock import Mock, MagicMock, patch
-from llm_from_here.plugins.intro import Intro, validate_json_response, filter_guests_count, match_categories
+from llm_from_here.plugins.intro import Intro, validate_json_response, filter_guests_count, match_categories, set_guests
+from jsonschema.exceptions import ValidationError
 import json
 
 class TestIntro(unittest.TestCase):
@@ -63,6 +64,7 @@ class TestIntro(unittest.TestCase):
         
         # Mock the behavior of the SupaSet methods as needed
         supaset_mock.add.return_value = True
+        supaset_mock.add_many.side_effect = lambda values: list(values)
         supaset_mock.elements.return_value = ['Guest1', 'Guest2']
         
 
@@ -86,6 +88,14 @@ class TestIntro(unittest.TestCase):
         responses = intro.get_extra_prompt_responses()
         self.assertEqual(responses, {'test_name': 'extra_prompt_response'})
 
+    def test_get_extra_prompt_responses_concurrent(self):
+        self.params['concurrent_extra_prompts'] = True
+        self.params['extra_prompts'].append({'name': 'other_name', 'prompt': 'other_prompt'})
+        self.chat_app.chat_many.return_value = ['response', 'other_response']
+        intro = Intro(self.params, self.global_params, self.plugin_instance_name, self.chat_app)
+        self.chat_app.chat_many.assert_called_once_with(['test_prompt', 'other_prompt'])
+        self.assertEqual(intro.extra_prompt_responses, {'test_name': 'response', 'other_name': 'other_response'})
+
     def test_execute(self):
         intro = Intro(self.params, self.global_params, self.plugin_instance_name, self.chat_app)
         result = intro.execute()
@@ -136,5 +146,13 @@ class TestFunctions(unittest.TestCase):
         replacement_map = match_categories(guest_list, standard_categories)
         self.assertEqual(replacement_map, {"cat10": ["cat1"], "cat20": ["cat2"]})
 
+    def test_set_guests_adds_in_one_call(self):
+        guest_set = MagicMock()
+        guest_set.add_many.side_effect = lambda values: [value.lower() for value in values if value != "Old"]
+        set_guests(["New", "Other"], guest_set)
+        guest_set.add_many.assert_called_once()
+        with self.assertRaises(ValidationError):
+            set_guests(["New", "Old"], guest_set)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,100 @@
+import asyncio
+import unittest
+import os
+import tempfile
+from unittest.mock import patch
+from openai.types.chat import ChatCompletion
+from llm_from_here.llmCache import LLMCache, LLMCacheMiss, get_llm_cache
+from llm_from_here.plugins.gpt import ChatApp
+
+
+def completion(content, model="gpt-test"):
+    return ChatCompletion.model_validate({
+        "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": model,
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": content}}],
+    })
+
+
+class LLMCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, 'llm_cache.sqlite')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_key(self):
+        messages = [{"role": "user", "content": "Hello"}]
+        self.assertEqual(LLMCache.key("m", messages), LLMCache.key("m", list(messages)))
+        self.assertNotEqual(LLMCache.key("m", messages), LLMCache.key("other", messages))
+        self.assertNotEqual(LLMCache.key("m", messages), LLMCache.key("m", messages, n=2))
+
+    def test_put_get_delete(self):
+        cache = LLMCache(self.file_path)
+        self.assertIsNone(cache.get("key"))
+        cache.put("key", completion("Hi"))
+        self.assertEqual(cache.get("key").choices[0].message.content, "Hi")
+        cache.delete("key")
+        self.assertIsNone(cache.get("key"))
+        self.assertEqual((cache.stats['hits'], cache.stats['misses']), (1, 2))
+
+    def test_expired_completions_are_misses(self):
+        cache = LLMCache(self.file_path, max_age_days=1)
+        with patch('llm_from_here.pluginCache.time.time', return_value=0):
+            cache.put("key", completion("Hi"))
+        self.assertIsNone(cache.get("key"))
+        self.assertEqual((cache.stats['hits'], cache.stats['misses']), (0, 1))
+
+    def test_replay_raises_on_miss(self):
+        cache = LLMCache(self.file_path, replay=True)
+        with self.assertRaises(LLMCacheMiss):
+            cache.get("key")
+
+    def test_get_llm_cache_is_off_by_default(self):
+        with patch.dict(os.environ, {}, clear=True):
+            self.assertIsNone(get_llm_cache())
+
+
+class ChatAppLLMCacheTestCase(unittest.TestCase):
+    @patch('llm_from_here.plugins.gpt.openai.OpenAI')
+    def setUp(self, mock_openai):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = LLMCache(os.path.join(self.temp_dir.name, 'llm_cache.sqlite'))
+        self.patcher = patch('llm_from_here.plugins.gpt.get_llm_cache', return_value=self.cache)
+        self.patcher.start()
+        self.mock_client = mock_openai.return_value
+        self.chat_app = ChatApp("Welcome")
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.temp_dir.cleanup()
+
+    def test_chat_reuses_cached_completion(self):
+        self.mock_client.chat.completions.create.return_value = completion("First")
+        self.assertEqual(self.chat_app.chat("Hello"), "First")
+        self.chat_app.reset_conversation()
+        self.assertEqual(self.chat_app.chat("Hello"), "First")
+        self.mock_client.chat.completions.create.assert_called_once()
+
+    def test_deleted_message_is_removed_from_cache(self):
+        self.mock_client.chat.completions.create.side_effect = [completion("Bad"), completion("Good")]
+        self.assertEqual(self.chat_app.chat("Hello"), "Bad")
+        self.chat_app.delete_last_message()
+        self.assertEqual(self.chat_app.chat("Hello"), "Good")
+        self.chat_app.reset_conversation()
+        self.assertEqual(self.chat_app.chat("Hello"), "Good")
+        self.assertEqual(self.mock_client.chat.completions.create.call_count, 2)
+
+
+    @patch.dict(os.environ, {'LLMFH_LLM_CACHE': 'replay'}, clear=True)
+    @patch('llm_from_here.plugins.gpt.openai.AsyncOpenAI')
+    def test_async_client_needs_no_key_in_replay_mode(self, mock_async_openai):
+        async def make_client():
+            return self.chat_app._async_client()
+
+        asyncio.run(make_client())
+        self.assertEqual(mock_async_openai.call_args.kwargs['api_key'], 'replay')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import unittest
+import os
+import tempfile
+from unittest.mock import patch
+from llm_from_here.pickleDict import PickleDict
+from llm_from_here.pluginCache import PluginCache
+
+class PluginCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, 'cache.sqlite')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_set_get_del_item(self):
+        cache = PluginCache(self.file_path)
+        cache['key1'] = {'timeline': [1, 2, 3]}
+        self.assertIn('key1', cache)
+        self.assertEqual(cache['key1'], {'timeline': [1, 2, 3]})
+        del cache['key1']
+        self.assertNotIn('key1', cache)
+        with self.assertRaises(KeyError):
+            cache['key1']
+        cache.close()
+
+    def test_mapping(self):
+        cache = PluginCache(self.file_path)
+        cache['key1'] = 'value1'
+        cache['key2'] = 'value2'
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(set(cache), {'key1', 'key2'})
+        self.assertEqual(set(cache.keys()), {'key1', 'key2'})
+        self.assertEqual(set(cache.values()), {'value1', 'value2'})
+        self.assertEqual(set(cache.items()), {('key1', 'value1'), ('key2', 'value2')})
+        cache.close()
+
+    def test_autocommit(self):
+        cache = PluginCache(self.file_path, autocommit=True)
+        cache['key1'] = 'value1'
+        cache['key1'] = 'new_value'
+        cache['key2'] = 'value2'
+
+        # Open a second connection to read back from disk
+        reopened = PluginCache(self.file_path)
+        self.assertEqual(reopened['key1'], 'new_value')
+        self.assertEqual(reopened['key2'], 'value2')
+
+        cache.clear()
+        self.assertEqual(len(reopened), 0)
+        cache.close()
+        reopened.close()
+
+    def test_migrates_pickle_dict(self):
+        legacy_file_path = os.path.join(self.temp_dir.name, 'cache.pickle')
+        legacy = PickleDict(legacy_file_path, autocommit=True)
+        legacy['key1'] = 'value1'
+
+        cache = PluginCache(self.file_path, legacy_file_path=legacy_file_path)
+        self.assertEqual(cache['key1'], 'value1')
+        self.assertFalse(os.path.exists(legacy_file_path))
+        cache.close()
+
+    def test_evicts_least_recently_hit(self):
+        cache = PluginCache(self.file_path, autocommit=True)
+        with patch('llm_from_here.pluginCache.time.time', side_effect=range(100)):
+            cache.set('key1', 'x' * 1000, plugin='a')
+            cache.set('key2', 'x' * 1000, plugin='a')
+            cache.get('key1')
+            cache.configure(max_bytes=2500)
+            cache.set('key3', 'x' * 1000, plugin='b')
+
+        self.assertEqual(set(cache.keys()), {'key1', 'key3'})
+        self.assertEqual(cache.stats['evictions'], 1)
+        self.assertLessEqual(cache.size(), 2500)
+
+        # eviction metadata survives reopening the cache
+        reopened = PluginCache(self.file_path)
+        self.assertEqual(reopened.size(), cache.size())
+        cache.close()
+        reopened.close()
+
+    def test_evicts_with_entries_changed_through_another_handle(self):
+        cache = PluginCache(self.file_path, autocommit=True)
+        other = PluginCache(self.file_path, autocommit=True)
+        with patch('llm_from_here.pluginCache.time.time', side_effect=range(100)):
+            cache.set('key1', 'x' * 1000)
+            cache.set('key2', 'x' * 1000)
+            del other['key1']
+            other.set('key3', 'x' * 1000)
+            self.assertLess(cache.size(), 2500)
+            cache.configure(max_bytes=1500)
+
+        self.assertEqual(set(cache.keys()), {'key3'})
+        self.assertEqual(cache.stats['evictions'], 1)
+        cache.close()
+        other.close()
+
+    def test_set_only_scans_when_over_bound(self):
+        cache = PluginCache(self.file_path, autocommit=True)
+        cache.configure(max_bytes=2500, plugin_max_bytes={'a': 1500})
+        with patch.object(cache, '_reload_meta', wraps=cache._reload_meta) as reload_meta:
+            cache.set('key1', 'x' * 1000, plugin='a')
+            cache.set('key2', 'x' * 1000, plugin='b')
+            reload_meta.assert_not_called()
+            cache.set('key3', 'x' * 1000, plugin='a')
+            reload_meta.assert_called_once()
+            # replacing an entry doesn't count it twice
+            cache.set('key3', 'y' * 1000, plugin='a')
+            reload_meta.assert_called_once()
+            cache.set('key4', 'x' * 1000, plugin='b')
+            self.assertEqual(reload_meta.call_count, 2)
+
+        self.assertEqual(set(cache.keys()), {'key3', 'key4'})
+        self.assertEqual(cache._size, cache.size())
+        cache.close()
+
+    def test_plugin_quota_and_max_age(self):
+        cache = PluginCache(self.file_path)
+        with patch('llm_from_here.pluginCache.time.time', return_value=0):
+            cache.set('old', 'value', plugin='b')
+        cache.set('key1', 'x' * 1000, plugin='a')
+        cache.set('key2', 'x' * 1000, plugin='a')
+        cache.set('key3', 'x' * 1000, plugin='c')
+        cache.configure(max_age_days=1, plugin_max_bytes={'a': 1500})
+        self.assertEqual(set(cache.keys()), {'key2', 'key3'})
+        cache.close()
+
+    def test_hit_miss_stats(self):
+        cache = PluginCache(self.file_path)
+        cache['key1'] = 'value1'
+        self.assertEqual(cache.get('key1'), 'value1')
+        self.assertIsNone(cache.get('key2'))
+        self.assertEqual((cache.stats['hits'], cache.stats['misses']), (1, 1))
+        cache.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+from unittest.mock import patch
+from llm_from_here.plugins.promptToSegment import PromptToSegment
+
+
+class PromptToSegmentTestCase(unittest.TestCase):
+    def setUp(self):
+        self.params = {
+            'prompts': [{'prompt': 'Write a script', 'accumulate': True}],
+            'is_dialog': True,
+        }
+
+    @patch('llm_from_here.plugins.promptToSegment.ChatApp')
+    def test_convert_script_to_segments(self, mock_chat_app):
+        mock_chat_app.return_value.chat.return_value = "HOST: Hello\n[sound of rain]\n\nGUEST: Hi"
+        prompt_to_segment = PromptToSegment(self.params, {}, 'script')
+        self.assertEqual([(s['speaker'], s['dialog']) for s in prompt_to_segment.segments],
+                         [('character 1', 'Hello'), ('sound effect', ' rain'), ('character 2', 'Hi')])
+
+    @patch('llm_from_here.plugins.promptToSegment.ChatApp')
+    def test_stream_matches_convert_script_to_segments(self, mock_chat_app):
+        script = "HOST: Hello\n[sound of rain]\n\nGUEST: Hi"
+        mock_chat_app.return_value.chat.return_value = script
+        # the script arrives in pieces that split lines
+        mock_chat_app.return_value.chat_stream.return_value = iter(["HOST: He", "llo\n[sound of", " rain]\n\nGU", "EST: Hi"])
+        expected = PromptToSegment(self.params, {}, 'script').segments
+
+        prompt_to_segment = PromptToSegment({**self.params, 'stream': True}, {}, 'script')
+        results = prompt_to_segment.execute()
+
+        self.assertEqual(list(results['segments']), expected)
+        self.assertEqual(results['segments'].script.strip(), script)
+        self.assertEqual(str(results['script']).strip(), script)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+import os
+import tempfile
+from unittest.mock import patch
+from llm_from_here.searchCache import SearchCache, get_search_cache
+
+
+class SearchCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.temp_dir.name, 'search_cache.sqlite')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_key_normalizes_query(self):
+        self.assertEqual(SearchCache.key("youtube", " Jazz  Music"), SearchCache.key("youtube", "jazz music"))
+        self.assertNotEqual(SearchCache.key("youtube", "jazz"), SearchCache.key("ytmusic", "jazz"))
+        self.assertNotEqual(SearchCache.key("youtube", "jazz", orderby="date"),
+                            SearchCache.key("youtube", "jazz", orderby="rating"))
+
+    def test_put_get(self):
+        cache = SearchCache(self.file_path)
+        self.assertIsNone(cache.get("key"))
+        cache.put("key", [{'video_id': 'a'}], service="youtube")
+        self.assertEqual(SearchCache(self.file_path).get("key"), [{'video_id': 'a'}])
+
+    def test_expired_results_are_misses(self):
+        cache = SearchCache(self.file_path, ttl_hours=1)
+        with patch('llm_from_here.searchCache.time.time', return_value=0):
+            cache.put("key", [])
+        with patch('llm_from_here.searchCache.time.time', return_value=2 * 60 * 60):
+            self.assertIsNone(cache.get("key"))
+        self.assertEqual((cache.stats['hits'], cache.stats['misses']), (0, 1))
+
+    def test_get_search_cache_is_off_by_default(self):
+        with patch.dict(os.environ, {}, clear=True):
+            self.assertIsNone(get_search_cache())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import pickle
+import threading
+import time
+from llm_from_here.segmentStream import SegmentStream, StreamedScript
+
+
+class SegmentStreamTestCase(unittest.TestCase):
+    def test_iterates_segments_as_they_arrive(self):
+        stream = SegmentStream()
+        received = []
+
+        def consume():
+            for segment in stream:
+                received.append(segment)
+
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        stream.append({'dialog': 'one'})
+        time.sleep(0.05)
+        # the first segment is consumed before the stream is complete
+        self.assertEqual(received, [{'dialog': 'one'}])
+        stream.extend([{'dialog': 'two'}, {'dialog': 'three'}])
+        stream.close()
+        consumer.join(1)
+        self.assertEqual([s['dialog'] for s in received], ['one', 'two', 'three'])
+
+    def test_bool_waits_for_first_segment(self):
+        stream = SegmentStream()
+        threading.Timer(0.05, stream.append, [{'dialog': 'one'}]).start()
+        self.assertTrue(stream)
+        empty = SegmentStream()
+        empty.close()
+        self.assertFalse(empty)
+
+    def test_pickles_as_list(self):
+        stream = SegmentStream()
+        stream.append({'dialog': 'one'})
+        threading.Timer(0.05, stream.close).start()
+        self.assertEqual(pickle.loads(pickle.dumps(stream)), [{'dialog': 'one'}])
+        self.assertEqual(len(stream), 1)
+
+    def test_error_is_raised_to_consumers(self):
+        stream = SegmentStream()
+        stream.append({'dialog': 'one'})
+        stream.close(error=ValueError("failed"))
+        with self.assertRaises(ValueError):
+            list(stream)
+        with self.assertRaises(ValueError):
+            stream.wait()
+
+
+    def test_streamed_script_waits_for_stream(self):
+        stream = SegmentStream()
+        script = StreamedScript(stream)
+        # attributes strings don't have are missing without waiting
+        self.assertFalse(hasattr(script, 'finalize'))
+        stream.script = "HOST: Hello"
+
+        threading.Timer(0.05, stream.close).start()
+        self.assertEqual(script, "HOST: Hello")
+        self.assertEqual(script.split(": "), ["HOST", "Hello"])
+        self.assertEqual(pickle.loads(pickle.dumps(script)), "HOST: Hello")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,8 +4,11 @@ import os
 import shutil
 import yaml
 import tempfile
+import time
 from llm_from_here.plugins.segmentsToTimeline import SegmentsToTimeline
+from llm_from_here.plugins.gpt import ChatApp
 import llm_from_here.plugins.audioTimeline as audioTimeline
+import llm_from_here.artifactStore as artifactStore
 
 yaml_string = """
     params:
@@ -42,6 +45,14 @@ class TestSegmentsToTimeline(unittest.TestCase):
     @patch("llm_from_here.plugins.freesoundfetch.FreeSoundFetch")
     @patch("llm_from_here.plugins.ytfetch.YtFetch")
     def setUp(self, patch_showTTS, patch_freesoundfetch, patch_ytFetch):
+        # keep stored artifacts, e.g. TTS, out of the user cache directory
+        artifact_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, artifact_dir, ignore_errors=True)
+        for patcher in (patch.dict(os.environ, {'LLMFH_ARTIFACT_DIR': artifact_dir}),
+                        patch.dict(artifactStore._artifact_stores, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
         self.mock_params = yaml.safe_load(yaml_string)['params']
         self.mock_segment_transition_map = self.mock_params['segment_transition_map']
 
@@ -123,6 +134,63 @@ class TestSegmentsToTimeline(unittest.TestCase):
         # Clean up the temporary directory
         shutil.rmtree(output_folder)
 
+    def test_generate_audio_segments_parallel(self):
+        data = [{'speaker': 'chris thile', 'dialog': f'dialog{i}'} for i in range(6)]
+        data.insert(3, {'speaker': 'audience', 'dialog': 'duration 2'})
+        self.mock_global_results['intro_intro'] = data
+        self.mock_params['parallel_assets'] = True
+        self.mock_params['provider_concurrency'] = {'fast_tts': 3}
+
+        self.stt = SegmentsToTimeline(
+            self.mock_params, self.mock_global_results, self.mock_plugin_instance_name)
+        self.stt.fast_TTS = MagicMock(return_value={})
+        self.stt.applause_generator = MagicMock(return_value=True)
+        self.stt.timeline = MagicMock()
+        self.stt.timeline.get_last_type.return_value = None
+
+        self.stt.generate_audio_segments()
+
+        self.assertEqual(self.stt.fast_TTS.call_count, 6)
+        self.stt.applause_generator.assert_called_once()
+        # the timeline is assembled in segment order, whatever order the assets finished in
+        added = [c.kwargs['name'] for c in self.stt.timeline.add_after_previous.call_args_list]
+        self.assertEqual(added, ['chris thile_0', 'chris thile_1', 'chris thile_2', 'audience_3',
+                                 'chris thile_4', 'chris thile_5', 'chris thile_6'])
+
+        shutil.rmtree(self.mock_global_results['output_folder'])
+
+    @patch('llm_from_here.plugins.gpt.openai.OpenAI')
+    def test_generate_audio_segments_parallel_intros(self, mock_openai):
+        def create(model, messages):
+            # the first segments' intros finish last
+            time.sleep(0.01 * (4 - int(messages[-1]['content'][-1])))
+            return MagicMock(choices=[MagicMock(message=MagicMock(content=f"Intro {messages[-1]['content']}"))])
+
+        mock_openai.return_value.chat.completions.create.side_effect = create
+        self.mock_global_results['intro_intro'] = [{'speaker': 'host', 'dialog': f'dialog{i}'} for i in range(4)]
+        self.mock_params['parallel_assets'] = True
+        self.mock_params['provider_concurrency'] = {'chat': 4}
+        self.mock_params['segment_type_map']['host'] = {
+            'segment_type': 'fast_TTS', 'intro_name': True, 'intro_prompt': 'Introduce: '}
+
+        self.stt = SegmentsToTimeline(
+            self.mock_params, self.mock_global_results, self.mock_plugin_instance_name)
+        self.stt.chat_app_object = ChatApp("Welcome")
+        self.stt.fast_TTS = MagicMock(side_effect=lambda text, output_file: {'title': text})
+        self.stt.tts = MagicMock()
+        self.stt.timeline = MagicMock()
+        self.stt.timeline.get_last_type.return_value = None
+
+        self.stt.generate_audio_segments()
+
+        # every intro is asked after the same conversation, and answered in segment order
+        sent = [c.kwargs['messages'] for c in mock_openai.return_value.chat.completions.create.call_args_list]
+        self.assertTrue(all(len(messages) == 2 for messages in sent))
+        self.assertEqual([m['content'] for m in self.stt.chat_app_object.messages[1:]],
+                         [f"Intro Introduce: dialog{i}:::dialog{i}" for i in range(4)])
+
+        shutil.rmtree(self.mock_global_results['output_folder'])
+
     @patch('llm_from_here.plugins.audioTimeline.AudioTimeline')
     def test_execute(self, mock_audio_timeline):
         # Mock the audio timeline instance and its methods
@@ -60,6 +60,58 @@ class TestShowRunner(unittest.TestCase):
                         except Exception as e:
                             self.fail(f'execute_plugins raised an exception: {e}')
 
+    def test_plugin_dependencies(self):
+        entries = [
+            {'name': 'intro', 'params': {}},
+            {'name': 'intro_audio', 'params': {'segments_object': 'intro_intro'}},
+            {'name': 'music', 'params': {'nested': [{'x': 'unrelated'}]}},
+            {'name': 'outro', 'params': {}, 'depends_on': 'music'},
+            {'name': '', 'params': {}},
+            {'name': 'render', 'params': {'timeline_variable': 'intro_audio_timeline'}},
+            {'name': 'music', 'params': {}},
+        ]
+        self.assertEqual(showRunner.plugin_dependencies(entries),
+                         [set(), {0}, set(), {2}, {0, 1, 2, 3}, {0, 1, 4}, {2, 4}])
+
+    def test_execute_plugins_parallel(self):
+        finished = []
+
+        def plugin_class(name, result):
+            def create(params, global_results, plugin_instance_name):
+                instance = MagicMock(spec=['execute'])
+                def execute():
+                    # dependencies have been merged before a plugin starts
+                    for key in params.values():
+                        self.assertIn(key, global_results)
+                    finished.append(name)
+                    return {'result': result}
+                instance.execute.side_effect = execute
+                return instance
+            return create
+
+        module = MagicMock()
+        module.A = plugin_class('a', 1)
+        module.B = plugin_class('b', 2)
+        module.C = plugin_class('c', 3)
+        mocked_data = {
+            'show_name': 'TestShow',
+            'parallel_plugins': True,
+            'plugins': [
+                {'plugin': 'test_plugin', 'class': 'A', 'name': 'a', 'params': {}},
+                {'plugin': 'test_plugin', 'class': 'B', 'name': 'b', 'params': {'input': 'a_result'}},
+                {'plugin': 'test_plugin', 'class': 'C', 'name': 'c', 'params': {}},
+            ]
+        }
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with patch('llm_from_here.showRunner.load_yaml', return_value=mocked_data), \
+                    patch('importlib.import_module', return_value=module):
+                showRunner.execute_plugins('test_config.yaml', outputs_dir=temp_dir)
+
+        self.assertEqual(sorted(finished), ['a', 'b', 'c'])
+        self.assertLess(finished.index('a'), finished.index('b'))
+        self.assertEqual({k: showRunner.global_results[k] for k in ('a_result', 'b_result', 'c_result')},
+                         {'a_result': 1, 'b_result': 2, 'c_result': 3})
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+import io
+import os
+import tempfile
+from unittest.mock import patch, MagicMock
+from pydub import AudioSegment, generators
+from llm_from_here.artifactStore import ArtifactStore
+import llm_from_here.plugins.showTTS as showTTS
+from llm_from_here.plugins.showTTS import ShowTextToSpeech, normalize_tts_text, chunk_sentences
+
+
+def write_speech(text, output_file):
+    with open(output_file, 'wb') as f:
+        f.write(text.encode())
+
+
+class ShowTextToSpeechTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.tts = ShowTextToSpeech()
+        self.tts.cache = ArtifactStore(os.path.join(self.temp_dir.name, 'tts'))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_normalize_tts_text(self):
+        self.assertEqual(normalize_tts_text("  Ladies and\n gentlemen... "), "Ladies and gentlemen...")
+
+    @patch.object(ShowTextToSpeech, '_speak_gtts', side_effect=write_speech)
+    def test_speak_reuses_cached_speech(self, mock_speak_gtts):
+        first = os.path.join(self.temp_dir.name, 'first.wav')
+        second = os.path.join(self.temp_dir.name, 'second.wav')
+        self.tts.speak("Ladies and gentlemen...", first, fast=True)
+        self.tts.speak(" Ladies and  gentlemen... ", second, fast=True)
+
+        mock_speak_gtts.assert_called_once_with("Ladies and gentlemen...", first)
+        with open(second, 'rb') as f:
+            self.assertEqual(f.read(), b"Ladies and gentlemen...")
+        self.assertEqual((self.tts.cache.stats['hits'], self.tts.cache.stats['misses']), (1, 1))
+
+    @patch.object(ShowTextToSpeech, '_speak_openai_tts', side_effect=write_speech)
+    @patch.object(ShowTextToSpeech, '_speak_gtts', side_effect=write_speech)
+    def test_cache_is_keyed_by_engine(self, mock_speak_gtts, mock_speak_openai_tts):
+        self.tts.speak("Hello", os.path.join(self.temp_dir.name, 'fast.wav'), fast=True)
+        self.tts.speak("Hello", os.path.join(self.temp_dir.name, 'slow.wav'), fast=False)
+        mock_speak_gtts.assert_called_once()
+        mock_speak_openai_tts.assert_called_once()
+
+    def test_chunk_sentences(self):
+        text = "One two. Three four? Five six seven. " + "word " * 10
+        chunks = chunk_sentences(text.strip(), 20)
+        self.assertTrue(all(len(chunk) <= 20 for chunk in chunks))
+        self.assertEqual(chunks[:2], ["One two. Three four?", "Five six seven."])
+        self.assertEqual(" ".join(chunks).split(), text.split())
+
+    def test_speak_openai_tts_chunked(self):
+        tone = generators.Sine(440).to_audio_segment(duration=1000)
+        def speech(text):
+            # a second of sound per chunk, padded with silence
+            return AudioSegment.silent(duration=200, frame_rate=44100) + tone + AudioSegment.silent(duration=200, frame_rate=44100)
+
+        self.tts.openai_client = MagicMock()
+        output_file = os.path.join(self.temp_dir.name, 'chunked.wav')
+        with patch.object(showTTS, 'TTS_CHUNK_CHARS', 12), \
+                patch.object(ShowTextToSpeech, '_openai_speech', side_effect=speech) as mock_speech:
+            self.tts._speak_openai_tts("First one. Second one. Third one.", output_file)
+
+        self.assertEqual([c.args[0] for c in mock_speech.call_args_list], ["First one.", "Second one.", "Third one."])
+        audio = AudioSegment.from_wav(output_file)
+        # the silence at the joins is replaced by the pause, the ends are kept
+        self.assertAlmostEqual(len(audio), 400 + 3 * 1000 + 2 * showTTS.TTS_CHUNK_PAUSE_MS, delta=30)
+
+    def test_speak_gtts_decodes_in_memory(self):
+        def write_to_fp(fp):
+            # gTTS output, as a wav so that it decodes without ffmpeg
+            generators.Sine(440).to_audio_segment(duration=500).export(fp, format='wav')
+
+        from_file = AudioSegment.from_file
+        output_file = os.path.join(self.temp_dir.name, 'fast.wav')
+        with patch.object(showTTS, 'gTTS') as mock_gtts, \
+                patch.object(showTTS.AudioSegment, 'from_file', side_effect=lambda fp, format: from_file(fp, format='wav')):
+            mock_gtts.return_value.write_to_fp.side_effect = write_to_fp
+            self.tts._speak_gtts("Hello", output_file)
+
+        mock_gtts.return_value.save.assert_not_called()
+        self.assertEqual(os.listdir(self.temp_dir.name), ['fast.wav'])
+        self.assertAlmostEqual(len(AudioSegment.from_wav(output_file)), 500, delta=10)
+
+    def test_openai_speech_streams_wav(self):
+        wav = io.BytesIO()
+        generators.Sine(440).to_audio_segment(duration=500).export(wav, format='wav')
+        self.tts.openai_client = MagicMock()
+        create = self.tts.openai_client.audio.speech.with_streaming_response.create
+        create.return_value.__enter__.return_value.iter_bytes.return_value = [wav.getvalue()[:100], wav.getvalue()[100:]]
+
+        audio = self.tts._openai_speech("Hello")
+
+        self.assertEqual(create.call_args.kwargs['response_format'], 'wav')
+        self.assertAlmostEqual(len(audio), 500, delta=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
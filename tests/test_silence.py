@@ -0,0 +1,46 @@
+import unittest
+import numpy as np
+from pydub import AudioSegment, generators
+from llm_from_here.sound.silence import frame_levels, silence_bounds, silence_bounds_array, trim_silence
+
+
+def chunked_leading_silence(audio, silence_threshold=-50.0, chunk_size=10):
+    # the per-slice loop the vectorized version replaces
+    trim_ms = 0
+    while audio[trim_ms:trim_ms+chunk_size].dBFS < silence_threshold and trim_ms < len(audio):
+        trim_ms += chunk_size
+    return min(trim_ms, len(audio))
+
+
+class SilenceTest(unittest.TestCase):
+    def setUp(self):
+        tone = generators.Sine(440).to_audio_segment(duration=2000).fade_in(1000).fade_out(1000)
+        self.audio = AudioSegment.silent(duration=3000) + tone + AudioSegment.silent(duration=500)
+
+    def test_frame_levels_match_pydub(self):
+        frames = [self.audio[ms:ms+10] for ms in range(0, len(self.audio), 10)]
+        samples = np.frombuffer(self.audio.raw_data, dtype=np.int16)
+        levels = frame_levels(samples, 441, 2)
+        self.assertEqual(len(levels), len(frames))
+        np.testing.assert_allclose(levels, [frame.dBFS for frame in frames])
+
+    def test_silence_bounds(self):
+        self.assertEqual(silence_bounds(self.audio)[0], chunked_leading_silence(self.audio))
+        start, end = silence_bounds(self.audio)
+        self.assertGreaterEqual(start, 3000)
+        self.assertLessEqual(end, 5000)
+        self.assertLess(start, end)
+
+    def test_trim_silence(self):
+        start, end = silence_bounds(self.audio)
+        self.assertEqual(len(trim_silence(self.audio)), end - start)
+        self.assertEqual(len(trim_silence(self.audio, trailing=False)), len(self.audio) - silence_bounds(self.audio)[0])
+        self.assertEqual(len(trim_silence(AudioSegment.silent(duration=1000))), 0)
+
+    def test_silence_bounds_array_all_silent(self):
+        samples = np.zeros(1000, dtype=np.int16)
+        self.assertEqual(silence_bounds_array(samples, 1000, 2), (1000, 1000))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import unittest
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+from postgrest.exceptions import APIError
+from llm_from_here.supaQueue import SupaQueue, LocalQueueBackend
+
+
+class TestSupaQueue(unittest.TestCase):
+    @patch('llm_from_here.supaQueue.create_client')
+    def setUp(self, mock_create_client):
+        self.client = mock_create_client.return_value
+        self.table = self.client.table.return_value
+        self.supaqueue = SupaQueue('test_queue')
+
+    def test_enqueue_many_chunks_inserts(self):
+        with patch.object(SupaQueue, 'insert_chunk_size', 2):
+            enqueued = self.supaqueue.enqueue_many(['a', 'b', 'c'])
+        self.assertEqual(enqueued, ['a', 'b', 'c'])
+        self.assertEqual([[row['value'] for row in call.args[0]] for call in self.table.insert.call_args_list],
+                         [['a', 'b'], ['c']])
+
+    def test_enqueue_single_value(self):
+        self.supaqueue.enqueue('a')
+        self.table.insert.assert_called_once_with([{"value": 'a', "queue_name": 'test_queue', "to_be_deleted": False}])
+
+    def test_dequeue_claims_with_one_call(self):
+        self.client.rpc.return_value.execute.return_value = MagicMock(
+            data=[{'id': 2, 'value': 'b'}, {'id': 1, 'value': 'a'}])
+        self.assertEqual(self.supaqueue.dequeue(2), ['a', 'b'])
+        self.client.rpc.assert_called_once_with('supaqueue_dequeue', {"p_queue_name": 'test_queue', "p_n": 2,
+                                                                      "p_session_id": SupaQueue.session_id})
+        self.table.update.return_value.in_.assert_not_called()
+
+    def test_dequeue_claims_by_id_without_function(self):
+        self.client.rpc.return_value.execute.side_effect = APIError({'code': 'PGRST202', 'message': "missing"})
+        select = self.table.select.return_value.eq.return_value.eq.return_value.order.return_value.limit.return_value
+        select.execute.return_value = MagicMock(data=[{'id': 1}, {'id': 2}, {'id': 3}])
+        update = self.table.update.return_value.in_.return_value.eq.return_value
+        # entry 2 was claimed by another consumer in between
+        update.execute.return_value = MagicMock(data=[{'id': 3, 'value': 'a'}, {'id': 1, 'value': 'a'}])
+        self.assertEqual(self.supaqueue.dequeue(3), ['a', 'a'])
+        self.table.update.return_value.in_.assert_called_once_with("id", [1, 2, 3])
+        self.table.update.return_value.in_.return_value.eq.assert_called_once_with("to_be_deleted", False)
+        self.supaqueue.dequeue(2)
+        self.client.rpc.assert_called_once()
+
+    def test_claims_without_claim_columns(self):
+        self.client.rpc.return_value.execute.side_effect = APIError({'code': 'PGRST202', 'message': "missing"})
+        select = self.table.select.return_value.eq.return_value.eq.return_value.order.return_value.limit.return_value
+        select.execute.return_value = MagicMock(data=[{'id': 1}])
+        update = self.table.update.return_value.in_.return_value.eq.return_value
+        missing_column = APIError({'code': 'PGRST204', 'message': "Could not find the 'claimed_by' column"})
+        update.execute.side_effect = [missing_column, MagicMock(data=[{'id': 1, 'value': 'a'}])]
+
+        with self.assertLogs('llm_from_here.supaQueue', 'WARNING'):
+            self.assertEqual(self.supaqueue.dequeue(1), ['a'])
+        self.assertEqual(self.table.update.call_args.args[0], {"to_be_deleted": True})
+
+        # entries are then released and deleted without a session
+        self.supaqueue.finalize()
+        self.table.delete.return_value.eq.return_value.eq.return_value.eq.assert_not_called()
+        self.table.delete.return_value.eq.return_value.eq.return_value.execute.assert_called_once()
+
+
+class TestLocalSupaQueue(unittest.TestCase):
+    def setUp(self):
+        self.supaqueue = SupaQueue('test_queue', backend=LocalQueueBackend())
+
+    def test_queue(self):
+        self.supaqueue.enqueue(['a', 'b', 'a', 'c'])
+        self.assertEqual(self.supaqueue.dequeue(1), ['a'])
+        self.assertEqual(self.supaqueue.peek(3), ['b', 'a', 'c'])
+        self.assertEqual(self.supaqueue.length(), 3)
+        self.supaqueue.finalize()
+        self.supaqueue._cleanup_incomplete_sessions()
+        self.assertEqual(self.supaqueue.length(), 3)
+
+    def test_concurrent_dequeues_claim_distinct_entries(self):
+        self.supaqueue.enqueue([str(i) for i in range(100)])
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            claimed = [value for values in executor.map(self.supaqueue.dequeue, [5] * 20) for value in values]
+        self.assertEqual(sorted(claimed, key=int), [str(i) for i in range(100)])
+
+    def test_new_queue_releases_claims(self):
+        self.supaqueue.enqueue(['a', 'b'])
+        self.supaqueue.dequeue(1)
+        with patch.object(SupaQueue, 'session_id', 'other'):
+            supaqueue = SupaQueue('test_queue', backend=self.supaqueue.backend)
+        self.assertEqual(supaqueue.peek(2), ['a', 'b'])
+
+    def test_new_session_keeps_live_claims_of_shared_queue(self):
+        backend = LocalQueueBackend()
+        first = SupaQueue('test_queue', backend=backend, shared=True)
+        first.enqueue(['a', 'b', 'c'])
+        self.assertEqual(first.dequeue(1), ['a'])
+        with patch.object(SupaQueue, 'session_id', 'other'):
+            second = SupaQueue('test_queue', backend=backend, shared=True)
+            self.assertEqual(second.dequeue(1), ['b'])
+            second.finalize()
+        self.assertEqual(backend.rows[0]['claimed_by'], SupaQueue.session_id)
+        self.assertEqual(first.peek(3), ['c'])
+        # claims past the timeout are released
+        with patch.object(SupaQueue, 'session_id', 'third'):
+            SupaQueue('test_queue', backend=backend, shared=True, claim_timeout_hours=-1)
+        self.assertEqual(first.peek(3), ['a', 'c'])
+
+    def test_pickle(self):
+        self.supaqueue.enqueue(['a', 'b'])
+        self.supaqueue.dequeue()
+        supaqueue = pickle.loads(pickle.dumps(self.supaqueue))
+        supaqueue.enqueue('c')
+        self.assertEqual(supaqueue.peek(2), ['b', 'c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 from unittest.mock import Mock, patch, MagicMock
 from uuid import uuid4
+from postgrest.exceptions import APIError
 from llm_from_here.supaSet import SupaSet
 
 class TestSupaSet(unittest.TestCase):
@@ -41,6 +42,67 @@ class TestSupaSet(unittest.TestCase):
         self.supaset._table().select().eq().eq().execute = MagicMock(return_value=MagicMock(data=[{'value': 'test_value'}]))  # Mock the chained methods and their return value
         contains = self.supaset.__contains__('test_value')
         self.assertTrue(contains)  # Check if the method returns the expected result
+    @patch('llm_from_here.supaSet.create_client')
+    def test_local_cache(self, mock_create_client):
+        table = mock_create_client.return_value.table.return_value
+        pages = table.select.return_value.eq.return_value.order.return_value.range.return_value
+        pages.execute.side_effect = [MagicMock(data=[{'value': 'a'}, {'value': 'b'}]),
+                                     MagicMock(data=[{'value': 'c'}])]
+        with patch.object(SupaSet, 'page_size', 2):
+            supaset = SupaSet('local_set', local_cache=True)
+        self.assertEqual(pages.execute.call_count, 2)
+        self.assertIn('C', supaset)
+        self.assertFalse(supaset.add('a'))
+        self.assertTrue(supaset.add('d'))
+        self.assertIn('d', supaset)
+        table.insert.assert_called_once()
+        table.select.return_value.eq.return_value.eq.assert_not_called()
+
+        delete = table.delete.return_value.eq.return_value.eq.return_value.eq.return_value
+        delete.execute.return_value = MagicMock(data=[])
+        supaset.remove('a')
+        self.assertIn('a', supaset)
+        delete.execute.return_value = MagicMock(data=[{'value': 'd'}])
+        supaset.remove('d')
+        self.assertNotIn('d', supaset)
+
+    @patch('llm_from_here.supaSet.create_client')
+    def test_local_cache_add_failure(self, mock_create_client):
+        table = mock_create_client.return_value.table.return_value
+        table.select.return_value.eq.return_value.order.return_value.range.return_value.execute.return_value = \
+            MagicMock(data=[])
+        table.insert.return_value.execute.side_effect = [
+            Exception("timeout"), APIError({'code': '23505', 'message': "duplicate key"})]
+        supaset = SupaSet('local_set', local_cache=True)
+        # a value that failed to be written isn't in the set
+        self.assertFalse(supaset.add('a'))
+        self.assertNotIn('a', supaset)
+        # a value another process added is
+        self.assertFalse(supaset.add('b'))
+        self.assertIn('b', supaset)
+
+    @patch('llm_from_here.supaSet.create_client')
+    def test_add_many(self, mock_create_client):
+        table = mock_create_client.return_value.table.return_value
+        table.upsert.return_value.execute.return_value = MagicMock(data=[{'value': 'b'}])
+        supaset = SupaSet('bulk_set')
+        self.assertEqual(supaset.add_many(['A', 'b', 'B']), ['b'])
+        rows, kwargs = table.upsert.call_args
+        self.assertEqual([row['value'] for row in rows[0]], ['a', 'b'])
+        self.assertEqual(kwargs, {'on_conflict': 'value,set_name', 'ignore_duplicates': True})
+
+    @patch('llm_from_here.supaSet.create_client')
+    def test_add_many_failure_leaves_local_cache(self, mock_create_client):
+        table = mock_create_client.return_value.table.return_value
+        table.select.return_value.eq.return_value.order.return_value.range.return_value.execute.return_value = \
+            MagicMock(data=[])
+        table.upsert.return_value.execute.side_effect = [MagicMock(data=[{'value': 'a'}]), Exception("timeout")]
+        with patch.object(SupaSet, 'insert_chunk_size', 1):
+            supaset = SupaSet('local_set', local_cache=True)
+            self.assertEqual(supaset.add_many(['a', 'b']), ['a'])
+        self.assertIn('a', supaset)
+        self.assertNotIn('b', supaset)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+import os
+import tempfile
+from unittest.mock import patch, MagicMock
+from llm_from_here.plugins.ytfetch import YtFetch
+from llm_from_here.searchCache import SearchCache
+
+
+FILTER_PROMPT = "Is {{title}} by {{channel_title}} a song? {{description}}"
+FILTER_JS = {"type": "object", "properties": {"answer": {"type": "string", "pattern": "(?i)^(yes|no)$"}},
+             "required": ["answer"]}
+
+
+def video(video_id, duration=200):
+    return {'video_id': video_id, 'title': f"Title {video_id}", 'description': "",
+            'channel_title': "Channel", 'duration': duration}
+
+
+class YtFetchTestCase(unittest.TestCase):
+    @patch.dict(os.environ, {'YT_API_KEY': 'test'})
+    @patch('llm_from_here.plugins.ytfetch.SupaSet')
+    @patch('llm_from_here.plugins.ytfetch.ytmusicapi.YTMusic')
+    @patch('llm_from_here.plugins.ytfetch.googleapiclient.discovery.build')
+    def setUp(self, mock_build, mock_ytmusic, mock_supaset):
+        self.returned = set()
+        supaset = mock_supaset.return_value
+        supaset.__contains__.side_effect = lambda video_id: video_id in self.returned
+
+        def add(video_id):
+            if video_id in self.returned:
+                return False
+            self.returned.add(video_id)
+            return True
+        supaset.add.side_effect = add
+
+        self.ytfetch = YtFetch()
+        self.ytfetch.search_music = MagicMock(return_value=[video('a'), video('b', duration=10), video('c')])
+        self.chat_app = MagicMock()
+
+    def search(self, **kwargs):
+        return self.ytfetch.search_video_with_duration(
+            "query", use_music_search=True, duration_min_sec=60, duration_max_sec=600,
+            llm_filter_prompt=FILTER_PROMPT, llm_filter_js=FILTER_JS, chat_app=self.chat_app, **kwargs)
+
+    def test_llm_filter_is_batched(self):
+        self.chat_app.enforce_json_response.return_value = [
+            {'video': 1, 'answer': 'no'}, {'video': 2, 'answer': 'yes'}]
+        self.assertEqual(self.search()['video_id'], 'c')
+        self.chat_app.enforce_json_response.assert_called_once()
+        prompt = self.chat_app.enforce_json_response.call_args[0][0]
+        self.assertIn("Title a", prompt)
+        self.assertNotIn("Title b", prompt)
+        self.assertEqual(self.returned, {'a', 'b', 'c'})
+
+    def test_verdicts_are_cached_by_video_id(self):
+        self.chat_app.enforce_json_response.return_value = [
+            {'video': 1, 'answer': 'yes'}, {'video': 2, 'answer': 'yes'}]
+        self.assertEqual(self.search()['video_id'], 'a')
+        self.assertEqual(self.search()['video_id'], 'c')
+        self.chat_app.enforce_json_response.assert_called_once()
+
+    def test_missing_verdict_falls_back_to_single_check(self):
+        self.chat_app.enforce_json_response.side_effect = [[{'video': 2, 'answer': 'no'}], {'answer': 'yes'}]
+        self.assertEqual(self.search()['video_id'], 'a')
+        self.assertEqual(self.chat_app.enforce_json_response.call_count, 2)
+
+    def test_llm_filter_batches_stop_once_a_video_passes(self):
+        self.ytfetch.search_music.return_value = [video(video_id) for video_id in 'abcde']
+        self.chat_app.enforce_json_response.return_value = [{'video': 1, 'answer': 'no'}, {'video': 2, 'answer': 'yes'}]
+        self.assertEqual(self.search(llm_filter_batch_size=2)['video_id'], 'b')
+        self.chat_app.enforce_json_response.assert_called_once()
+
+    def test_failed_batch_falls_back_to_single_checks(self):
+        self.chat_app.enforce_json_response.side_effect = [Exception("context length exceeded"), {'answer': 'yes'}]
+        self.assertEqual(self.search()['video_id'], 'a')
+        self.assertEqual(self.chat_app.enforce_json_response.call_count, 2)
+
+    def test_batched_descriptions_are_truncated(self):
+        self.chat_app.enforce_json_response.return_value = []
+        self.ytfetch.llm_filter_videos(self.chat_app, FILTER_PROMPT, FILTER_JS,
+                                       [{**video('a'), 'description': "x" * 1000}], description_chars=10)
+        prompt = self.chat_app.enforce_json_response.call_args[0][0]
+        self.assertIn("x" * 10, prompt)
+        self.assertNotIn("x" * 11, prompt)
+
+    def test_unbatched_llm_filter(self):
+        self.chat_app.enforce_json_response.side_effect = [{'answer': 'no'}, {'answer': 'yes'}]
+        self.assertEqual(self.search(llm_filter_batch=False)['video_id'], 'c')
+        self.assertEqual(self.chat_app.enforce_json_response.call_count, 2)
+
+    def test_video_details_are_fetched_in_one_request(self):
+        self.ytfetch.search_videos = MagicMock(return_value=[video('a'), video('b'), video('c')])
+        videos = self.ytfetch.youtube.videos.return_value
+        videos.list.return_value.execute.return_value = {'items': [
+            {'id': 'a', 'snippet': {'description': "A"}, 'contentDetails': {'duration': 'PT10S'}},
+            {'id': 'c', 'snippet': {'description': "C"}, 'contentDetails': {'duration': 'PT3M'}},
+        ]}
+        result = self.ytfetch.search_video_with_duration("query", duration_min_sec=60, duration_max_sec=600)
+        self.assertEqual(result['video_id'], 'c')
+        videos.list.assert_called_once()
+        self.assertEqual(videos.list.call_args.kwargs['id'], "a,b,c")
+        self.assertIsNone(self.ytfetch.video_details('b'))
+        videos.list.assert_called_once()
+
+    def test_search_results_are_cached(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.ytfetch.search_cache = SearchCache(os.path.join(temp_dir, 'search_cache.sqlite'))
+            self.ytfetch.ytmusic.search.return_value = [
+                {'videoId': 'a', 'title': "Song", 'artists': [{'name': "Artist"}], 'duration': "3:05"}]
+            del self.ytfetch.search_music
+            videos = self.ytfetch.search_music("Some  Song")
+            self.assertEqual(videos[0]['duration'], 185)
+            self.assertEqual(self.ytfetch.search_music("some song"), videos)
+            self.ytfetch.ytmusic.search.assert_called_once()
+
+    def test_search_cache_key_includes_max_results(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.ytfetch.search_cache = SearchCache(os.path.join(temp_dir, 'search_cache.sqlite'))
+            search = self.ytfetch.youtube.search.return_value
+            search.list.return_value.execute.return_value = {'items': [
+                {'id': {'videoId': 'a'}, 'snippet': {'title': "A", 'description': "", 'channelTitle': "C"}}]}
+            self.ytfetch.search_video("query")
+            self.ytfetch.search_videos("query")
+            self.assertEqual([call.kwargs['maxResults'] for call in search.list.call_args_list], [1, 30])
+
+
+if __name__ == '__main__':
+    unittest.main()